@@ -0,0 +1,390 @@
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from time import perf_counter_ns
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import constants  # noqa: E402
+import file_io  # noqa: E402
+from classes import DirectoryNode, FileNode, FS_Node, Memory  # noqa: E402
+from inodes import InodeTable  # noqa: E402
+from paths import dcache, resolve  # noqa: E402
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+def fresh_fs(size: int, dedup: bool = False):
+    FS_Node.inodes = InodeTable()
+    root = DirectoryNode('/', datetime.now())
+    memory = Memory(size, dedup=dedup)
+
+    FS_Node.memory = memory
+    FS_Node.root = root
+    dcache.invalidate()
+    return root, memory
+
+
+def summarize(samples, elapsed_ns: int = None, nbytes: int = 0):
+    # samples are per-op latencies in ns, elapsed defaults to their sum
+    samples = sorted(samples)
+    elapsed_ns = elapsed_ns or sum(samples) or 1
+    result = {
+        'ops': len(samples),
+        'ops_per_sec': len(samples) * 1e9 / elapsed_ns,
+        'latency_us': {
+            'mean': sum(samples) / len(samples) / 1e3 if samples else 0.0,
+            'max': samples[-1] / 1e3 if samples else 0.0,
+        },
+    }
+    for percentile in PERCENTILES:
+        index = min(len(samples) - 1, int(len(samples) * percentile / 100))
+        result['latency_us'][f'p{percentile:g}'] = samples[index] / 1e3 if samples else 0.0
+
+    if nbytes:
+        result['mb_per_sec'] = nbytes / 2 ** 20 * 1e9 / elapsed_ns
+
+    return result
+
+
+def new_file(directory: DirectoryNode, name: str, memory: Memory, data: bytes) -> FileNode:
+    file = directory.add_child(FileNode(name, datetime.now()))
+    file.starting_addr = memory.write_file(memory.allocate(len(data)), data)
+    file.size = len(data)
+    return file
+
+
+def tiny_files(scale: float):
+    count = int(50000 * scale)
+    root, memory = fresh_fs(count * 64 * 2)
+    rnd = random.Random(1)
+    payloads = [os.urandom(rnd.randint(1, 32)) for _ in range(256)]
+
+    allocate, write, read = [], [], []
+    addrs = []
+    for i in range(count):
+        data = payloads[i % len(payloads)]
+
+        start = perf_counter_ns()
+        addr = memory.allocate(len(data))
+        allocate.append(perf_counter_ns() - start)
+
+        start = perf_counter_ns()
+        addr = memory.write_file(addr, data)
+        write.append(perf_counter_ns() - start)
+        addrs.append((addr, len(data)))
+
+    for addr, size in addrs:
+        start = perf_counter_ns()
+        memory.read_file(addr, 0, size)
+        read.append(perf_counter_ns() - start)
+
+    deallocate = []
+    for addr, _ in addrs:
+        start = perf_counter_ns()
+        memory.deallocate(addr)
+        deallocate.append(perf_counter_ns() - start)
+
+    return {'allocate': summarize(allocate), 'write_file': summarize(write),
+            'read_file': summarize(read), 'deallocate': summarize(deallocate)}
+
+
+def large_files(scale: float):
+    count = 8
+    size = int(4 * 2 ** 20 * scale)
+    root, memory = fresh_fs(count * size * 2)
+    data = os.urandom(size)
+
+    write, read = [], []
+    addrs = []
+    for _ in range(count):
+        start = perf_counter_ns()
+        addr = memory.write_file(memory.allocate(size), data)
+        write.append(perf_counter_ns() - start)
+        addrs.append(addr)
+
+    for addr in addrs:
+        start = perf_counter_ns()
+        bytes(memory.read_file(addr, 0, size))
+        read.append(perf_counter_ns() - start)
+
+    return {'write_file': summarize(write, nbytes=count * size),
+            'read_file': summarize(read, nbytes=count * size)}
+
+
+def append_log(scale: float):
+    logs = 16
+    records = int(100000 * scale)
+    root, memory = fresh_fs(int(records * 128 * 4) + logs * constants.BLOCK_SIZE)
+    rnd = random.Random(2)
+    lines = [f'{i:08d} level=info msg="request served" ms={rnd.random():.3f}\n'.encode()
+             for i in range(1024)]
+
+    addrs = [memory.allocate(0) for _ in range(logs)]
+    append = []
+    nbytes = 0
+    for i in range(records):
+        log = i % logs
+        line = lines[i % len(lines)]
+
+        start = perf_counter_ns()
+        addrs[log] = memory.append_file(addrs[log], line)
+        append.append(perf_counter_ns() - start)
+        nbytes += len(line)
+
+    extents = sum(len(memory.extents[addr]) for addr in addrs)
+    return {'append_file': summarize(append, nbytes=nbytes),
+            'extents_per_log': extents / logs}
+
+
+def duplicate_files(scale: float):
+    # templates and repeated log chunks, written to a deduplicating store
+    count = int(5000 * scale)
+    templates = [os.urandom(constants.BLOCK_SIZE * random.Random(i).randint(4, 64)) for i in range(16)]
+    root, memory = fresh_fs(count * max(len(template) for template in templates) * 2, dedup=True)
+
+    write, read = [], []
+    addrs = []
+    nbytes = 0
+    for i in range(count):
+        # a private header in front of a shared body, as rendered templates have
+        data = f'{i:0{constants.BLOCK_SIZE}d}'.encode() + templates[i % len(templates)]
+
+        start = perf_counter_ns()
+        addrs.append((memory.write_file(memory.allocate(len(data)), data), len(data)))
+        write.append(perf_counter_ns() - start)
+        nbytes += len(data)
+
+    for addr, length in addrs:
+        start = perf_counter_ns()
+        bytes(memory.read_file(addr, 0, length))
+        read.append(perf_counter_ns() - start)
+
+    return {'write_file': summarize(write, nbytes=nbytes), 'read_file': summarize(read, nbytes=nbytes),
+            'saved_mb': memory.deduped * constants.BLOCK_SIZE / 2 ** 20,
+            'dedup_ratio': nbytes / (nbytes - memory.deduped * constants.BLOCK_SIZE)}
+
+
+def deep_tree(scale: float):
+    depth = 200
+    lookups = int(20000 * scale)
+    root, memory = fresh_fs(2 ** 16)
+
+    mkdir = []
+    directory = root
+    for level in range(depth):
+        start = perf_counter_ns()
+        directory = directory.add_child(DirectoryNode(f'd{level}', datetime.now()))
+        mkdir.append(perf_counter_ns() - start)
+    new_file(directory, 'leaf', memory, b'leaf')
+
+    components = [f'd{level}' for level in range(depth)]
+    prefixes = ['/' + '/'.join(components[:level]) for level in range(1, depth + 1)]
+    path = prefixes[-1]
+    rnd = random.Random(3)
+
+    resolve_cached, resolve_cold, get_child = [], [], []
+    for _ in range(lookups):
+        target = rnd.choice(prefixes)
+
+        start = perf_counter_ns()
+        resolve(target, root)
+        resolve_cached.append(perf_counter_ns() - start)
+
+    for _ in range(lookups // 10):
+        dcache.invalidate()
+        start = perf_counter_ns()
+        resolve(path + '/leaf', root)
+        resolve_cold.append(perf_counter_ns() - start)
+
+    for _ in range(lookups // 10):
+        level = rnd.randrange(depth)
+        node = root
+        start = perf_counter_ns()
+        for i in range(level + 1):
+            node = node.get_child(f'd{i}')
+        get_child.append(perf_counter_ns() - start)
+
+    return {'mkdir': summarize(mkdir), 'resolve_cached': summarize(resolve_cached),
+            'resolve_uncached': summarize(resolve_cold), 'get_child_walk': summarize(get_child)}
+
+
+def wide_directory(scale: float):
+    count = int(100000 * scale)
+    root, memory = fresh_fs(2 ** 16)
+    directory = root.add_child(DirectoryNode('wide', datetime.now()))
+
+    add = []
+    for i in range(count):
+        start = perf_counter_ns()
+        directory.add_child(FileNode(f'file-{i:07d}', datetime.now()))
+        add.append(perf_counter_ns() - start)
+
+    rnd = random.Random(4)
+    hit, miss = [], []
+    for _ in range(count):
+        name = f'file-{rnd.randrange(count):07d}'
+        start = perf_counter_ns()
+        directory.get_child(name)
+        hit.append(perf_counter_ns() - start)
+
+        start = perf_counter_ns()
+        directory.get_child(name + '-missing')
+        miss.append(perf_counter_ns() - start)
+
+    start = perf_counter_ns()
+    directory.children
+    listing = perf_counter_ns() - start
+
+    remove = []
+    for child in directory.children[:count // 10]:
+        start = perf_counter_ns()
+        directory.remove_child(child)
+        child.release()
+        remove.append(perf_counter_ns() - start)
+
+    return {'add_child': summarize(add), 'get_child_hit': summarize(hit),
+            'get_child_miss': summarize(miss), 'remove_child': summarize(remove),
+            'list_ms': listing / 1e6}
+
+
+def save_load(scale: float):
+    image_mb = max(1, int(64 * scale))
+    files = 20000
+    size = image_mb * 2 ** 20
+    root, memory = fresh_fs(size * 2)
+
+    per_file = size // files
+    payload = os.urandom(per_file)
+    for i in range(files):
+        directory = root.get_child(f'd{i % 100}') or root.add_child(DirectoryNode(f'd{i % 100}', datetime.now()))
+        new_file(directory, f'f{i}', memory, payload)
+
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, 'bench.dat')
+        journal_filename = os.path.join(directory, 'bench.journal')
+
+        save = []
+        for _ in range(3):
+            start = perf_counter_ns()
+            file_io.save_to_file(filename, root, memory)
+            save.append(perf_counter_ns() - start)
+
+        # nothing changed: a checkpoint only compares and returns
+        start = perf_counter_ns()
+        file_io.checkpoint(filename, root, memory)
+        idle_checkpoint = perf_counter_ns() - start
+
+        load, first_walk = [], []
+        for _ in range(3):
+            start = perf_counter_ns()
+            loaded, loaded_memory = file_io.load_from_file(filename, journal_filename)
+            load.append(perf_counter_ns() - start)
+
+            # loading is lazy, touching every file is where the decoding happens
+            start = perf_counter_ns()
+            for child in loaded.children:
+                for file in child.children:
+                    file.size
+            first_walk.append(perf_counter_ns() - start)
+
+        image_bytes = os.path.getsize(filename)
+
+    return {'save_to_file': summarize(save, nbytes=image_bytes * len(save)),
+            'load_from_file': summarize(load, nbytes=image_bytes * len(load)),
+            'walk_after_load': summarize(first_walk),
+            'idle_checkpoint_ms': idle_checkpoint / 1e6,
+            'image_mb': image_bytes / 2 ** 20}
+
+
+WORKLOADS = {
+    'tiny_files': tiny_files,
+    'large_files': large_files,
+    'append_log': append_log,
+    'duplicate_files': duplicate_files,
+    'deep_tree': deep_tree,
+    'wide_directory': wide_directory,
+    'save_load': save_load,
+}
+
+
+def run_workload(name: str, scale: float):
+    # runs in its own process, so peak RSS belongs to this workload alone
+    start = time.perf_counter()
+    phases = WORKLOADS[name](scale)
+    return {
+        'phases': phases,
+        'seconds': time.perf_counter() - start,
+        # kilobytes on Linux, bytes on macOS
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        / (2 ** 20 if sys.platform == 'darwin' else 2 ** 10),
+    }
+
+
+def compare(baseline: dict, current: dict, outfile=sys.stderr):
+    print(f'{"workload.phase":40} {"baseline":>12} {"current":>12} {"change":>8}', file=outfile)
+    for name, result in current['workloads'].items():
+        old = baseline['workloads'].get(name)
+        if not old:
+            continue
+
+        for phase, stats in result['phases'].items():
+            old_stats = old['phases'].get(phase)
+            if not isinstance(stats, dict) or not isinstance(old_stats, dict):
+                continue
+
+            before, after = old_stats['ops_per_sec'], stats['ops_per_sec']
+            print(f'{name + "." + phase:40} {before:12,.0f} {after:12,.0f} {after / before - 1:+8.1%}',
+                  file=outfile)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Allocator, tree and persistence benchmarks')
+    parser.add_argument('workloads', nargs='*', metavar='WORKLOAD',
+                        help=f'any of {", ".join(WORKLOADS)}, all by default')
+    parser.add_argument('--scale', type=float, default=1.0, help='multiplies every workload size')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    parser.add_argument('--compare', metavar='BASELINE', help='print ops/s against an earlier report')
+    args = parser.parse_args()
+    unknown = set(args.workloads) - set(WORKLOADS)
+    if unknown:
+        parser.error(f'unknown workloads: {", ".join(sorted(unknown))}')
+
+    report = {
+        'meta': {
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'scale': args.scale,
+            'block_size': constants.BLOCK_SIZE,
+        },
+        'workloads': {},
+    }
+
+    for name in args.workloads or WORKLOADS:
+        with ProcessPoolExecutor(1) as pool:
+            report['workloads'][name] = pool.submit(run_workload, name, args.scale).result()
+        print(f'{name}: {report["workloads"][name]["seconds"]:.2f}s', file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == '__main__':
+    main()
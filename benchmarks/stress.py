@@ -0,0 +1,195 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import constants  # noqa: E402
+import locks  # noqa: E402
+import menu  # noqa: E402
+import paths  # noqa: E402
+from classes import DirectoryNode, FileNode, FS_Node, Memory  # noqa: E402
+from inodes import InodeTable  # noqa: E402
+from pagecache import PagedMemory  # noqa: E402
+from session import Session  # noqa: E402
+
+
+def fresh_fs(args, backing_filename):
+    FS_Node.inodes = InodeTable()
+    root = DirectoryNode('/', datetime.now())
+    if args.paged:
+        memory = PagedMemory(args.size, backing_filename, args.cache_pages, dedup=args.dedup)
+    else:
+        memory = Memory(args.size, dedup=args.dedup)
+
+    FS_Node.memory = memory
+    FS_Node.root = root
+    return root, memory
+
+
+def command(function, *args):
+    # what menu.run_command does around every command
+    with locks.fs_lock.read():
+        return function(*args)
+
+
+def worker(root: DirectoryNode, worker_id: int, args, expected, created):
+    rnd = random.Random(worker_id)
+    home = f'/w{worker_id}'
+    session = Session(root, open(os.devnull, 'w'))
+    command(menu.mkdir, session, home)
+
+    names = [f'{home}/f{i}' for i in range(args.files)]
+    for name in names:
+        command(menu.touch, session, name)
+        command(menu.open_file, session, name, 'w')
+        command(menu.open_file, session, name, 'a')
+        expected[name] = ''
+
+    ops = 0
+    for i in range(args.ops):
+        name = rnd.choice(names)
+        roll = rnd.random()
+
+        if roll < 0.3:
+            content = f'{worker_id}:{i};' * rnd.randint(1, 8)
+            command(menu.write_file, session, name, content)
+            expected[name] = content
+
+        elif roll < 0.6:
+            content = f'+{i}'
+            command(menu.append_file, session, name, content)
+            expected[name] += content
+
+        elif roll < 0.9:
+            command(menu.display_file, session, name)
+
+        else:
+            # shared directory: every worker creates and removes here
+            shared = f'/shared/{worker_id}-{i}'
+            command(menu.touch, session, shared)
+            if rnd.random() < 0.5:
+                command(menu.remove, session, shared)
+            else:
+                created.add(shared)
+
+        ops += 1
+
+    return ops
+
+
+def check_memory(memory: Memory):
+    owner = {}
+    slots = {}
+    references = {}
+    for addr, runs in memory.extents.items():
+        if memory.is_slab(addr):
+            # slots of one slab block share it, but never overlap
+            block, offset = runs[0][0], addr % constants.BLOCK_SIZE
+            size = memory.allocations[addr]
+            assert runs == [(block, 1)] and offset % size == 0 and offset + size <= constants.BLOCK_SIZE
+            assert (block, offset) not in slots and memory.slabs.slot_size[block] == size
+            assert memory.slabs.used[block] >> (offset // size) & 1
+            assert owner.setdefault(block, 'slab') == 'slab', f'slab block {block} owned by {owner[block]}'
+            assert not memory.free_space.is_free(block)
+            assert memory.used_per_allocation[addr] <= size
+            slots[(block, offset)] = addr
+            continue
+
+        capacity = 0
+        for start, length in runs:
+            for block in range(start, start + length):
+                # only blocks deduplication shares may have more than one owner
+                assert block not in owner or block in memory.refs, f'block {block} shared by {owner[block]} and {addr}'
+                assert not memory.free_space.is_free(block), f'block {block} of {addr} marked free'
+                references[block] = references.get(block, 0) + 1
+                owner[block] = addr
+            capacity += length * constants.BLOCK_SIZE
+
+        assert memory.used_per_allocation[addr] <= memory.allocations[addr] <= capacity
+
+    assert memory.refs == {block: count for block, count in references.items() if count > 1}
+    assert memory.space_used == sum(memory.allocations.values())
+    assert sum(bin(mask).count('1') for mask in memory.slabs.used.values()) == len(slots)
+    assert memory.free_space.free_count + len(owner) == memory.total_blocks
+
+
+def check_tree(root: DirectoryNode, memory: Memory, expected, created):
+    seen = set()
+
+    def walk(directory):
+        for name, child in directory.entries.items():
+            assert child.name == name and child.parent is directory
+            assert child.ino not in seen
+            seen.add(child.ino)
+            if isinstance(child, DirectoryNode):
+                walk(child)
+
+    walk(root)
+    table = root.table
+    live = sum(1 for kind in table.kind if kind != InodeTable.KIND_FREE)
+    assert live == len(seen) + 1, f'{live - len(seen) - 1} leaked inodes'
+
+    files = 0
+    for name, content in expected.items():
+        file = paths.resolve(name, root)
+        data = bytes(memory.read_file(file.starting_addr, 0, file.size)) if file.size else b''
+        assert data.decode() == content, f'{name}: {data!r} != {content!r}'
+        files += 1
+
+    for name in created:
+        assert isinstance(paths.resolve(name, root), FileNode), f'{name} missing'
+
+    return files
+
+
+def run(threads: int, args, directory: str):
+    root, memory = fresh_fs(args, os.path.join(directory, f'stress-{threads}.blocks'))
+    menu.mkdir(Session(root, open(os.devnull, 'w')), '/shared')
+
+    expected = {}
+    created = set()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        futures = [pool.submit(worker, root, i, args, expected, created)
+                   for i in range(args.workers)]
+        ops = sum(future.result() for future in futures)
+    elapsed = time.perf_counter() - start
+
+    check_memory(memory)
+    check_tree(root, memory, expected, created)
+    if args.paged:
+        memory.close()
+
+    return ops, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Concurrent clients against one filesystem')
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--workers', type=int, default=16, help='clients, each with its own directory')
+    parser.add_argument('--files', type=int, default=8, help='files per client')
+    parser.add_argument('--ops', type=int, default=500, help='operations per client')
+    parser.add_argument('--size', type=int, default=1 << 24, help='store size in bytes')
+    parser.add_argument('--paged', action='store_true', help='use a PagedMemory store')
+    parser.add_argument('--cache-pages', type=int, default=64)
+    parser.add_argument('--dedup', action='store_true', help='share blocks with identical content')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        baseline = None
+        for threads in args.threads:
+            ops, elapsed = run(threads, args, directory)
+            throughput = ops / elapsed
+            baseline = baseline or throughput
+            print(f'threads={threads:3d}  ops={ops}  time={elapsed:.2f}s  '
+                  f'ops/s={throughput:,.0f}  speedup={throughput / baseline:.2f}x  checks=ok')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,467 @@
+from abc import ABC, abstractmethod
+from array import array
+from typing import Dict, List, Optional, Set, Tuple
+
+
+class FreeSpaceManager(ABC):
+    def __init__(self, total_blocks: int) -> None:
+        self.total_blocks = total_blocks
+
+    @property
+    @abstractmethod
+    def free_count(self) -> int:
+        pass
+
+    @abstractmethod
+    def allocate(self, num_blocks: int) -> List[Tuple[int, int]]:
+        pass
+
+    @abstractmethod
+    def allocate_at(self, start: int, num_blocks: int) -> int:
+        pass
+
+    @abstractmethod
+    def free(self, start: int, length: int):
+        pass
+
+    @abstractmethod
+    def mark_used(self, start: int, length: int):
+        pass
+
+    @abstractmethod
+    def free_extents(self) -> List[Tuple[int, int]]:
+        pass
+
+    @abstractmethod
+    def bitmap_bytes(self) -> bytes:
+        pass
+
+    @abstractmethod
+    def load_bitmap(self, data: bytes):
+        pass
+
+    def stats(self):
+        extents = self.free_extents()
+        free = sum(length for _, length in extents)
+        largest = max((length for _, length in extents), default=0)
+
+        return {
+            'free_blocks': free,
+            'free_extents': len(extents),
+            'largest_free_extent': largest,
+            # share of free space that can't be handed out as one run
+            'fragmentation': 1 - largest / free if free else 0.0,
+        }
+
+
+class BitmapFreeSpaceManager(FreeSpaceManager):
+    WORD_BITS = 64
+    FULL_WORD = (1 << WORD_BITS) - 1
+
+    POLICY_BEST_FIT = 'best_fit'
+    POLICY_FIRST_FIT = 'first_fit'
+
+    # size classes: one per length below EXACT_CLASSES, then SUBCLASSES per
+    # power of two, so a class never spans more than 1/16 of its lengths
+    EXACT_CLASSES = 64
+    SUBCLASSES = 16
+
+    def __init__(self, total_blocks: int, policy: str = POLICY_BEST_FIT) -> None:
+        super().__init__(total_blocks)
+        if policy not in (self.POLICY_BEST_FIT, self.POLICY_FIRST_FIT):
+            raise ValueError(f'Unknown allocation policy {policy}')
+
+        self.policy = policy
+
+        # 1 = used, one bit per block
+        num_words = -(-total_blocks // self.WORD_BITS)
+        self.bitmap = array('Q', [0]) * num_words
+        self._free_count = 0
+
+        # free extent index: start -> length, end -> start, length -> starts
+        self._by_start: Dict[int, int] = {}
+        self._by_end: Dict[int, int] = {}
+        self._by_length: Dict[int, Set[int]] = {}
+        # size class -> lengths present, and a bit per non-empty class
+        self._classes: List[Set[int]] = [set() for _ in range(self._class(max(total_blocks, 1)) + 1)]
+        self._nonempty = 0
+
+        # first fit only: a max tree over bitmap words, each leaf the longest
+        # free extent starting in its word
+        self._leaves = 1
+        while self._leaves < num_words:
+            self._leaves *= 2
+        self._tree = array('q', [0]) * (2 * self._leaves) if policy == self.POLICY_FIRST_FIT else None
+        self._touched: Set[int] = set()
+
+        self._mark_tail_used()
+        self.rebuild()
+
+    def _class(self, length: int) -> int:
+        if length < self.EXACT_CLASSES:
+            return length
+
+        shift = length.bit_length() - 5
+        return self.EXACT_CLASSES + (shift - 2) * self.SUBCLASSES + (length >> shift) - self.SUBCLASSES
+
+    def _mark_tail_used(self):
+        # bits past total_blocks in the last word never become free
+        tail = len(self.bitmap) * self.WORD_BITS - self.total_blocks
+        if tail:
+            self.bitmap[-1] |= (self.FULL_WORD << (self.WORD_BITS - tail)) & self.FULL_WORD
+
+    def _set_range(self, start: int, length: int, used: bool):
+        end = start + length
+        while start < end:
+            word, bit = divmod(start, self.WORD_BITS)
+            span = min(self.WORD_BITS - bit, end - start)
+            mask = (((1 << span) - 1) << bit)
+            if used:
+                self.bitmap[word] |= mask
+            else:
+                self.bitmap[word] &= ~mask & self.FULL_WORD
+            start += span
+
+    def is_free(self, block: int) -> bool:
+        word, bit = divmod(block, self.WORD_BITS)
+        return not (self.bitmap[word] >> bit) & 1
+
+    def _insert(self, start: int, length: int):
+        self._by_start[start] = length
+        self._by_end[start + length] = start
+        starts = self._by_length.setdefault(length, set())
+        if not starts:
+            size_class = self._class(length)
+            self._classes[size_class].add(length)
+            self._nonempty |= 1 << size_class
+        starts.add(start)
+        self._free_count += length
+        if self._tree is not None:
+            self._touched.add(start // self.WORD_BITS)
+
+    def _remove(self, start: int, length: int):
+        del self._by_start[start]
+        del self._by_end[start + length]
+        starts = self._by_length[length]
+        starts.discard(start)
+        if not starts:
+            del self._by_length[length]
+            size_class = self._class(length)
+            lengths = self._classes[size_class]
+            lengths.discard(length)
+            if not lengths:
+                self._nonempty &= ~(1 << size_class)
+        self._free_count -= length
+        if self._tree is not None:
+            self._touched.add(start // self.WORD_BITS)
+
+    def _take(self, start: int, length: int, num_blocks: int) -> Tuple[int, int]:
+        self._remove(start, length)
+        if length > num_blocks:
+            self._insert(start + num_blocks, length - num_blocks)
+
+        self._set_range(start, num_blocks, True)
+        return start, num_blocks
+
+    def _starts_in(self, word: int):
+        # free extents starting in a word, lowest first: free bits whose
+        # previous bit is used
+        bits = self.bitmap[word]
+        carry = self.bitmap[word - 1] >> (self.WORD_BITS - 1) if word else 1
+        starts = ~bits & ((bits << 1) | carry) & self.FULL_WORD
+        base = word * self.WORD_BITS
+        while starts:
+            low = starts & -starts
+            start = base + low.bit_length() - 1
+            yield start, self._by_start[start]
+            starts ^= low
+
+    def _refresh(self):
+        # after the bitmap and the index agree again, fix the touched leaves
+        tree = self._tree
+        if tree is None:
+            return
+
+        for word in self._touched:
+            value = max((length for _, length in self._starts_in(word)), default=0)
+            node = self._leaves + word
+            tree[node] = value
+            node //= 2
+            while node:
+                value = max(tree[2 * node], tree[2 * node + 1])
+                if tree[node] == value:
+                    break
+                tree[node] = value
+                node //= 2
+
+        self._touched.clear()
+
+    def _largest(self) -> Tuple[int, int]:
+        # -> length and start of one of the longest free extents
+        if not self._nonempty:
+            return 0, -1
+
+        length = max(self._classes[self._nonempty.bit_length() - 1])
+        return length, next(iter(self._by_length[length]))
+
+    def _best_fit(self, num_blocks: int) -> Optional[Tuple[int, int]]:
+        # the shortest extent that fits: in the request's own class only
+        # some lengths may, any class above it has only lengths that do
+        size_class = self._class(num_blocks)
+        fits = [length for length in self._classes[size_class] if length >= num_blocks]
+        if not fits:
+            above = self._nonempty >> (size_class + 1)
+            if not above:
+                return None
+            fits = self._classes[size_class + (above & -above).bit_length()]
+
+        length = min(fits)
+        return length, next(iter(self._by_length[length]))
+
+    def _first_fit(self, num_blocks: int) -> Optional[Tuple[int, int]]:
+        # the lowest extent that fits: down the tree to the first word with
+        # one starting in it, then along that word
+        tree = self._tree
+        if tree[1] < num_blocks:
+            return None
+
+        node = 1
+        while node < self._leaves:
+            node = 2 * node if tree[2 * node] >= num_blocks else 2 * node + 1
+
+        for start, length in self._starts_in(node - self._leaves):
+            if length >= num_blocks:
+                return length, start
+
+    def _scan(self):
+        # word-level walk: all-free and all-used words are skipped whole
+        run_start = None
+        for word_index, word in enumerate(self.bitmap):
+            base = word_index * self.WORD_BITS
+            if word == 0:
+                if run_start is None:
+                    run_start = base
+                continue
+
+            if word == self.FULL_WORD:
+                if run_start is not None:
+                    yield run_start, base - run_start
+                    run_start = None
+                continue
+
+            for bit in range(self.WORD_BITS):
+                if (word >> bit) & 1:
+                    if run_start is not None:
+                        yield run_start, base + bit - run_start
+                        run_start = None
+                elif run_start is None:
+                    run_start = base + bit
+
+        if run_start is not None:
+            yield run_start, min(len(self.bitmap) * self.WORD_BITS, self.total_blocks) - run_start
+
+    def rebuild(self):
+        self._by_start.clear()
+        self._by_end.clear()
+        self._by_length.clear()
+        for lengths in self._classes:
+            lengths.clear()
+        self._nonempty = 0
+        self._free_count = 0
+
+        for start, length in self._scan():
+            self._insert(start, length)
+
+        if self._tree is not None:
+            # every leaf at once, then the inner nodes bottom up
+            tree = self._tree
+            tree[:] = array('q', [0]) * len(tree)
+            for start, length in self._by_start.items():
+                leaf = self._leaves + start // self.WORD_BITS
+                tree[leaf] = max(tree[leaf], length)
+            for node in range(self._leaves - 1, 0, -1):
+                tree[node] = max(tree[2 * node], tree[2 * node + 1])
+            self._touched.clear()
+
+    @property
+    def free_count(self) -> int:
+        return self._free_count
+
+    def allocate(self, num_blocks: int) -> List[Tuple[int, int]]:
+        if num_blocks > self._free_count:
+            raise ValueError('No free blocks available')
+
+        fit = self._best_fit(num_blocks) if self.policy == self.POLICY_BEST_FIT else self._first_fit(num_blocks)
+        if fit is not None:
+            length, start = fit
+            extents = [self._take(start, length, num_blocks)]
+
+        else:
+            # no single run is large enough, use the fewest (largest) runs
+            extents = []
+            remaining = num_blocks
+            while remaining:
+                length, start = self._largest()
+                taken = self._take(start, length, min(length, remaining))
+                extents.append(taken)
+                remaining -= taken[1]
+
+        self._refresh()
+        return extents
+
+    def allocate_at(self, start: int, num_blocks: int) -> int:
+        # grows a run in place, returns how many blocks from start were taken
+        length = self._by_start.get(start)
+        if length is None:
+            return 0
+
+        taken = self._take(start, length, min(length, num_blocks))[1]
+        self._refresh()
+        return taken
+
+    def free(self, start: int, length: int):
+        if length <= 0:
+            return
+
+        self._set_range(start, length, False)
+
+        # coalesce with the free neighbours on both sides
+        before = self._by_end.get(start)
+        if before is not None:
+            before_length = self._by_start[before]
+            self._remove(before, before_length)
+            start, length = before, length + before_length
+
+        after_length = self._by_start.get(start + length)
+        if after_length is not None:
+            self._remove(start + length, after_length)
+            length += after_length
+
+        self._insert(start, length)
+        self._refresh()
+
+    def mark_used(self, start: int, length: int):
+        # bulk restore path, call rebuild() once all runs are marked
+        self._set_range(start, length, True)
+
+    def free_extents(self) -> List[Tuple[int, int]]:
+        return sorted(self._by_start.items())
+
+    def stats(self):
+        # from the index, without listing every extent
+        free = self._free_count
+        largest = self._largest()[0]
+
+        return {
+            'free_blocks': free,
+            'free_extents': len(self._by_start),
+            'largest_free_extent': largest,
+            'fragmentation': 1 - largest / free if free else 0.0,
+        }
+
+    def bitmap_bytes(self) -> bytes:
+        return self.bitmap.tobytes()
+
+    def load_bitmap(self, data: bytes):
+        self.bitmap = array('Q')
+        self.bitmap.frombytes(data)
+        self._mark_tail_used()
+        self.rebuild()
+
+
+class SlabAllocator:
+    # small allocations share blocks: each slab block is cut into equal
+    # power-of-two slots of one size class, handed out lowest first
+
+    def __init__(self, free_space: FreeSpaceManager, block_size: int, min_size: int) -> None:
+        self.free_space = free_space
+        self.block_size = block_size
+
+        # slot sizes, min_size up to half a block
+        self.classes: List[int] = []
+        size = min_size
+        while 0 < size <= block_size // 2:
+            self.classes.append(size)
+            size *= 2
+
+        # block -> slot size, block -> bitmask of used slots
+        self.slot_size: Dict[int, int] = {}
+        self.used: Dict[int, int] = {}
+        # slot size -> blocks with at least one free slot
+        self.partial: Dict[int, Set[int]] = {size: set() for size in self.classes}
+
+    def size_class(self, size: int) -> Optional[int]:
+        for slot in self.classes:
+            if size <= slot:
+                return slot
+
+        return None
+
+    def is_slab(self, block: int) -> bool:
+        return block in self.slot_size
+
+    def allocate(self, slot: int) -> Tuple[int, int]:
+        # -> block and byte offset of a free slot of size slot
+        partial = self.partial[slot]
+        if partial:
+            block = next(iter(partial))
+        else:
+            block = self.free_space.allocate(1)[0][0]
+            self.slot_size[block] = slot
+            self.used[block] = 0
+            partial.add(block)
+
+        mask = self.used[block]
+        bit = ~mask & (mask + 1)
+        self._set_used(block, mask | bit)
+        return block, (bit.bit_length() - 1) * slot
+
+    def free(self, block: int, offset: int):
+        slot = self.slot_size[block]
+        mask = self.used[block] & ~(1 << (offset // slot))
+        if mask:
+            self._set_used(block, mask)
+            return
+
+        # last slot gone, the block goes back to the free space manager
+        del self.slot_size[block]
+        del self.used[block]
+        self.partial[slot].discard(block)
+        self.free_space.free(block, 1)
+
+    def mark_used(self, block: int, offset: int, slot: int):
+        # bulk restore path, the block is already used in the free space manager
+        if block not in self.slot_size:
+            self.slot_size[block] = slot
+            self.used[block] = 0
+
+        self._set_used(block, self.used[block] | (1 << (offset // slot)))
+
+    def load(self, blocks: array, slots: array, masks: array):
+        # bulk restore of a saved state, the blocks are already used in the
+        # free space manager
+        self.slot_size = dict(zip(blocks, slots))
+        self.used = dict(zip(blocks, masks))
+        self.partial = {size: set() for size in self.classes}
+        for block, slot, mask in zip(blocks, slots, masks):
+            if mask != (1 << (self.block_size // slot)) - 1:
+                self.partial[slot].add(block)
+
+    def remap(self, blocks: Dict[int, int]):
+        # old block -> new block, after the store moved slab blocks
+        self.slot_size = {blocks.get(block, block): slot for block, slot in self.slot_size.items()}
+        self.used = {blocks.get(block, block): mask for block, mask in self.used.items()}
+        self.partial = {slot: {blocks.get(block, block) for block in partial}
+                        for slot, partial in self.partial.items()}
+
+    def _set_used(self, block: int, mask: int):
+        self.used[block] = mask
+        slot = self.slot_size[block]
+        if mask == (1 << (self.block_size // slot)) - 1:
+            self.partial[slot].discard(block)
+        else:
+            self.partial[slot].add(block)
+
+    def stats(self):
+        slots = sum(bin(mask).count('1') for mask in self.used.values())
+        return {'slab_blocks': len(self.slot_size), 'slab_slots': slots}
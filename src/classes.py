@@ -1,90 +1,551 @@
 import datetime
+import hashlib
+import itertools
 import math
 import string
+import threading
 from abc import ABC
+from array import array
 import sys
-from typing import Dict, List
+from typing import Dict, List, Set, Tuple
 
 import constants
+import stats
 import utils
+from allocator import BitmapFreeSpaceManager, FreeSpaceManager, SlabAllocator
+from inodes import InodeTable
+from locks import RWLock
 
 
 class Memory:
     OFFSET_BITS = int(math.log2(constants.BLOCK_SIZE))
     BLOCK_BITS = int(math.log2(constants.TOTAL_BLOCKS))
+    # reserved capacity multiplier when an append outgrows its allocation
+    GROWTH_FACTOR = 2
 
-    def __init__(self, total_size=constants.TOTAL_MEMORY_SIZE) -> None:
+    # bytes of the digest blocks are indexed by
+    DIGEST_SIZE = 16
+
+    def __init__(self, total_size=constants.TOTAL_MEMORY_SIZE, free_space: FreeSpaceManager = None, buffer=None,
+                 dedup: bool = False) -> None:
         self.space_used = 0
         self.total_size = int(total_size)
-        self.memory: List[List[int]] = [[0] * constants.BLOCK_SIZE
-                                        for _ in range(constants.TOTAL_BLOCKS)]
+        self.total_blocks = self.total_size // constants.BLOCK_SIZE
+
+        self._attach(buffer)
 
-        # addr -> size
-        # addr [4 bits for block number, 6 bits for offset]
+        # addr -> reserved size
+        # addr [4 bits for block number, 6 bits for offset], the offset is
+        # non-zero for small allocations packed into a shared slab block
         self.allocations: Dict[int, int] = {}
+        # addr -> logical size
         self.used_per_allocation: Dict[int, int] = {}
-        self.free_blocks = [i for i in range(constants.TOTAL_BLOCKS)]
+        # addr -> [(start block, number of blocks), ...]
+        self.extents: Dict[int, List[Tuple[int, int]]] = {}
+        self.free_space = free_space or BitmapFreeSpaceManager(self.total_blocks)
+        self.slabs = SlabAllocator(self.free_space, constants.BLOCK_SIZE, constants.SLAB_MIN_SIZE)
+        # allocator lock: free space, allocations and space_used change together,
+        # file contents are guarded by the owning inode's lock instead
+        self.lock = threading.RLock()
+
+        # PAGE_SIZE pages written and allocation changes since the last
+        # checkpoint, pages rather than blocks keep the set small under bulk writes
+        self.dirty_pages: Set[int] = set()
+        self.metadata_dirty = False
+
+        # copy-on-write snapshots: every unit (a block, or a slab slot by its
+        # addr) records the generation it was allocated in, each snapshot
+        # ends one; units born up to the newest snapshot's are shared with it;
+        # None while there are no snapshots, every block counts as born in 0
+        self.generation = 0
+        self.births = None
+        self.slot_births: Dict[int, int] = {}
+        # name -> snapshot, oldest first
+        self.snapshots: Dict[str, 'Snapshot'] = {}
+        # units released since the newest snapshot, which still uses them
+        self.dead: List[int] = []
+
+        # deduplication: blocks written full are looked up by content, a match
+        # is shared instead of stored again and copied once one file writes it;
+        # a file's first block is never shared, its number is the file's addr
+        self.dedup = dedup
+        # digest -> block and back, for blocks whose content is known
+        self.index: Dict[bytes, int] = {}
+        self.digests: Dict[int, bytes] = {}
+        # block -> allocations using it, only for blocks more than one uses
+        self.refs: Dict[int, int] = {}
+        # references served by a block another allocation already had
+        self.deduped = 0
+
+    def _attach(self, buffer):
+        # one contiguous store, blocks are fixed-size windows into it,
+        # an existing writable buffer (e.g. a mapped image) can back it
+        if buffer is None:
+            buffer = bytearray(self.total_blocks * constants.BLOCK_SIZE)
+        self.memory = buffer
+        self._view = memoryview(self.memory)
+
+    # byte-level access to the store, subclasses can put it somewhere else
+    def _load(self, start: int, length: int):
+        return self._view[start:start + length]
+
+    def _store(self, start: int, data):
+        self._view[start:start + len(data)] = data
+
+    @staticmethod
+    def _as_buffer(data):
+        return utils.to_buffer(data)
+
+    @staticmethod
+    def blocks_needed(size: int) -> int:
+        return max(1, -(-size // constants.BLOCK_SIZE))
+
+    @property
+    def max_file_size(self) -> int:
+        return constants.MAX_FILE_SIZE or self.total_size
+
+    def is_slab(self, addr: int) -> bool:
+        return self.slabs.is_slab(addr >> self.OFFSET_BITS)
+
+    @property
+    def shared_generation(self) -> int:
+        return next(reversed(self.snapshots.values())).generation if self.snapshots else -1
+
+    @property
+    def space_committed(self) -> int:
+        # reserved bytes less the blocks deduplication saved
+        return self.space_used - self.deduped * constants.BLOCK_SIZE
+
+    def capacity(self, addr: int) -> int:
+        if self.is_slab(addr):
+            return self.allocations[addr]
+
+        return sum(length for _, length in self.extents[addr]) * constants.BLOCK_SIZE
+
+    def _segments(self, addr: int, starting_byte: int, num_bytes: int):
+        position = starting_byte + (addr & ((2 ** self.OFFSET_BITS) - 1))
+        remaining = num_bytes
+
+        for start_block, length in self.extents[addr]:
+            if remaining <= 0:
+                return
+
+            run_bytes = length * constants.BLOCK_SIZE
+            if position >= run_bytes:
+                position -= run_bytes
+                continue
+
+            chunk = min(run_bytes - position, remaining)
+            yield start_block * constants.BLOCK_SIZE + position, chunk
+            remaining -= chunk
+            position = 0
+
+        if remaining > 0:
+            raise ValueError('Access past the end of the allocation')
+
+    def _write(self, addr: int, starting_byte: int, data):
+        data = memoryview(data)
+        written = 0
+        for start, length in self._segments(addr, starting_byte, len(data)):
+            self._store(start, data[written:written + length])
+            self.dirty_pages.update(range(
+                start // constants.PAGE_SIZE, (start + length - 1) // constants.PAGE_SIZE + 1))
+            written += length
+
+    def reserve(self, addr: int, new_size: int) -> int:
+        # returns the addr, which changes when a slot has to move out of its slab
+        with self.lock:
+            size = self.allocations[addr]
+            if new_size <= size:
+                return addr
+
+            if self.is_slab(addr):
+                return self._relocate(addr, new_size)
+
+            if self.space_committed - size + new_size > self.total_size:
+                raise ValueError('Not enough space in memory')
+
+            missing = self.blocks_needed(new_size - self.capacity(addr)) \
+                if new_size > self.capacity(addr) else 0
+            if missing > self.free_space.free_count:
+                raise ValueError('No free blocks available')
+
+            if missing:
+                extents = self.extents[addr]
+
+                # extend the last run in place when the blocks after it are free
+                last_start, last_length = extents[-1]
+                taken = self.free_space.allocate_at(
+                    last_start + last_length, missing)
+                extents[-1] = (last_start, last_length + taken)
+                self._stamp(last_start + last_length, taken)
+
+                if missing > taken:
+                    for start, length in self.free_space.allocate(missing - taken):
+                        self._stamp(start, length)
+                        last_start, last_length = extents[-1]
+                        if last_start + last_length == start:
+                            extents[-1] = (last_start, last_length + length)
+                        else:
+                            extents.append((start, length))
+
+            self.allocations[addr] = new_size
+            self.space_used += new_size - size
+            self.metadata_dirty = True
+            return addr
+
+    def _relocate(self, addr: int, new_size: int) -> int:
+        # the new allocation is taken first, a failure leaves the old one intact
+        used = self.used_per_allocation[addr]
+        new_addr = self.allocate(new_size)
+
+        self._write(new_addr, 0, bytes(self.read_file(addr, 0, used)))
+        self.used_per_allocation[new_addr] = used
+        self.deallocate(addr)
+        return new_addr
 
-    def allocate(self, size: int):
-        if self.space_used + size > self.total_size:
-            raise ValueError('Not enough space in memory')
+    def _stamp(self, start: int, length: int):
+        if self.births is not None:
+            self.births[start:start + length] = array('I', [self.generation]) * length
 
-        if size > constants.MAX_FILE_SIZE:
-            raise ValueError(
-                f'File size too large (max {constants.MAX_FILE_SIZE} bytes)')
+    def _birth(self, unit: int) -> int:
+        if self.is_slab(unit):
+            return self.slot_births.get(unit, 0)
 
-        if len(self.free_blocks) == 0:
-            raise ValueError('No free blocks available')
+        return self.births[unit >> self.OFFSET_BITS] if self.births is not None else 0
 
-        block = self.free_blocks.pop(0)
-        addr = block << self.OFFSET_BITS
+    def _unit_size(self, unit: int) -> int:
+        if self.is_slab(unit):
+            return self.slabs.slot_size[unit >> self.OFFSET_BITS]
 
-        self.allocations[addr] = size
-        self.used_per_allocation[addr] = 0
-        self.space_used += size
+        return constants.BLOCK_SIZE
 
-        return addr
+    def _free_unit(self, unit: int):
+        if self.is_slab(unit):
+            self.slot_births.pop(unit, None)
+            self.slabs.free(unit >> self.OFFSET_BITS, unit & ((2 ** self.OFFSET_BITS) - 1))
+        else:
+            self.free_space.free(unit >> self.OFFSET_BITS, 1)
+
+    def _free_run(self, start: int, length: int):
+        # blocks another allocation shares or the newest snapshot still uses
+        # stay, the rest go back to the free space manager
+        shared = self.shared_generation
+        if shared < 0 and not self.refs and not self.digests:
+            self.free_space.free(start, length)
+            return
+
+        end = start + length
+        for block in range(start, end):
+            if self._unref(block, shared):
+                self.free_space.free(start, block - start)
+                start = block + 1
+
+        self.free_space.free(start, end - start)
+
+    def _unref(self, block: int, shared: int) -> bool:
+        # drops one allocation's use of the block, True while it is still used
+        refs = self.refs.get(block)
+        if refs:
+            if refs > 2:
+                self.refs[block] = refs - 1
+            else:
+                del self.refs[block]
+            self.deduped -= 1
+            return True
+
+        digest = self.digests.pop(block, None)
+        if digest is not None:
+            del self.index[digest]
+
+        if shared >= 0 and self.births[block] <= shared:
+            self.dead.append(block << self.OFFSET_BITS)
+            return True
+
+        return False
+
+    @staticmethod
+    def _add_run(runs: List[Tuple[int, int]], start: int, length: int):
+        if length <= 0:
+            return
 
+        if runs and runs[-1][0] + runs[-1][1] == start:
+            runs[-1] = (runs[-1][0], runs[-1][1] + length)
+        else:
+            runs.append((start, length))
+
+    def _blocks(self, addr: int, first: int, last: int):
+        # (index in the file, block) of the file's blocks first to last
+        index = 0
+        for start, length in self.extents[addr]:
+            for i in range(max(first, index), min(last, index + length - 1) + 1):
+                yield i, start + i - index
+            index += length
+
+    def _swap_blocks(self, addr: int, swaps: List[Tuple[int, int]]) -> int:
+        # (index in the file, new block) in file order, returns the addr,
+        # which moves with the first block
+        swaps = iter(swaps)
+        swap = next(swaps, None)
+        runs = []
+        index = 0
+        for start, length in self.extents[addr]:
+            cursor = start
+            while swap and swap[0] < index + length:
+                i, new = swap
+                block = start + i - index
+                self._add_run(runs, cursor, block - cursor)
+                self._add_run(runs, new, 1)
+                cursor = block + 1
+                swap = next(swaps, None)
+            self._add_run(runs, cursor, start + length - cursor)
+            index += length
+
+        new_addr = runs[0][0] << self.OFFSET_BITS
+        del self.extents[addr]
+        self.extents[new_addr] = runs
+        self.allocations[new_addr] = self.allocations.pop(addr)
+        self.used_per_allocation[new_addr] = self.used_per_allocation.pop(addr)
+        self.metadata_dirty = True
+        return new_addr
+
+    def _unshare(self, addr: int, starting_byte: int, num_bytes: int) -> int:
+        # copy-on-write: the blocks of the range the newest snapshot or another
+        # allocation still uses are swapped for fresh ones before a write,
+        # only partly overwritten ones are copied; returns the addr, which
+        # moves with the first block
+        if num_bytes <= 0 or not (self.snapshots or self.refs or self.digests):
+            return addr
+
+        with self.lock:
+            shared = self.shared_generation
+            if self.is_slab(addr):
+                # slots are never deduplicated
+                if self.slot_births.get(addr, 0) <= shared:
+                    return self._relocate(addr, self.allocations[addr])
+                return addr
+
+            block_size = constants.BLOCK_SIZE
+            end = starting_byte + num_bytes
+
+            touched = []
+            for i, block in self._blocks(addr, starting_byte // block_size, (end - 1) // block_size):
+                if block in self.refs or (shared >= 0 and self.births[block] <= shared):
+                    touched.append((i, block))
+                elif block in self.digests:
+                    # about to change, the index must not hand it out any more
+                    del self.index[self.digests.pop(block)]
+
+            if not touched:
+                return addr
+
+            fresh = [block for start, length in self.free_space.allocate(len(touched))
+                     for block in range(start, start + length)]
+            swaps = []
+            for (i, old), new in zip(touched, fresh):
+                if not (starting_byte <= i * block_size and (i + 1) * block_size <= end):
+                    self._copy_block(old, new)
+                self._stamp(new, 1)
+                # the last use goes when a file held the same block twice
+                if not self._unref(old, shared):
+                    self.free_space.free(old, 1)
+                swaps.append((i, new))
+
+            return self._swap_blocks(addr, swaps)
+
+    def _dedup(self, addr: int, starting_byte: int, num_bytes: int, tail: bool = False) -> int:
+        # after a write: every block of the range the file now fills is looked
+        # up by content, a match takes its place and the written one is freed;
+        # with tail the partly filled last block counts too, whole-file writes
+        # use it, appends would only index a block the next one changes
+        if not self.dedup or num_bytes <= 0 or self.is_slab(addr):
+            return addr
+
+        with self.lock:
+            block_size = constants.BLOCK_SIZE
+            used = self.used_per_allocation[addr]
+            end = min(starting_byte + num_bytes, used)
+            first = max(1, starting_byte // block_size)
+            last = (end - 1) // block_size if tail else end // block_size - 1
+            if last < first:
+                return addr
+
+            content = bytes(self.read_file(
+                addr, first * block_size, min(used, (last + 1) * block_size) - first * block_size))
+            swaps = []
+            freed = []
+            for i, block in self._blocks(addr, first, last):
+                if block in self.digests or block in self.refs:
+                    continue
+
+                data = content[(i - first) * block_size:(i - first + 1) * block_size]
+                digest = hashlib.blake2b(data, digest_size=self.DIGEST_SIZE).digest()
+                match = self.index.get(digest)
+                if match is None:
+                    self.index[digest] = block
+                    self.digests[block] = digest
+                    continue
+
+                if bytes(self._load(match * block_size, len(data))) != data:
+                    continue
+
+                self.refs[match] = self.refs.get(match, 1) + 1
+                self.deduped += 1
+                self._add_run(freed, block, 1)
+                swaps.append((i, match))
+
+            # the write unshared its range first, nothing else uses these
+            for start, length in freed:
+                self.free_space.free(start, length)
+
+            return self._swap_blocks(addr, swaps) if swaps else addr
+
+    @stats.probe(stats.ALLOCATE)
+    def allocate(self, size: int):
+        with self.lock:
+            if self.space_committed + size > self.total_size:
+                raise ValueError('Not enough space in memory')
+
+            if size > self.max_file_size:
+                raise ValueError(
+                    f'File size too large (max {self.max_file_size} bytes)')
+
+            slot = self.slabs.size_class(size)
+            if slot is not None:
+                # small enough to share a block, the slot offset goes in the offset bits
+                block, offset = self.slabs.allocate(slot)
+                extents = [(block, 1)]
+                addr = (block << self.OFFSET_BITS) | offset
+                size = slot
+                if self.births is not None:
+                    self.slot_births[addr] = self.generation
+            else:
+                extents = self.free_space.allocate(self.blocks_needed(size))
+                addr = extents[0][0] << self.OFFSET_BITS
+                for start, length in extents:
+                    self._stamp(start, length)
+
+            self.allocations[addr] = size
+            self.used_per_allocation[addr] = 0
+            self.extents[addr] = extents
+            self.space_used += size
+            self.metadata_dirty = True
+
+            return addr
+
+    @stats.probe(stats.READ, lambda args, kwargs, result: len(result))
     def read_file(self, addr: int, starting_byte=0, num_bytes=None):
-        size = self.allocations[addr]
         if num_bytes is None:
             num_bytes = self.used_per_allocation[addr]
 
-        block = addr >> self.OFFSET_BITS
-        offset = addr & ((2 ** self.OFFSET_BITS) - 1)
+        segments = list(self._segments(addr, starting_byte, num_bytes))
+        if len(segments) == 1:
+            return self._load(*segments[0])
+
+        return b''.join(self._load(start, length) for start, length in segments)
+
+    def iter_file(self, addr: int, starting_byte: int = 0, num_bytes: int = None,
+                  chunk_size: int = constants.STREAM_CHUNK_SIZE):
+        # memoryview chunks of at most chunk_size, only one is loaded at a time;
+        # views into the store are only valid until the file is next written
+        if num_bytes is None:
+            num_bytes = self.used_per_allocation[addr] - starting_byte
+
+        for start, length in self._segments(addr, starting_byte, num_bytes):
+            for offset in range(0, length, chunk_size):
+                yield memoryview(self._load(start + offset, min(chunk_size, length - offset)))
+
+    def _reserve_for_append(self, addr: int, new_size: int) -> int:
+        size = self.allocations[addr]
+        if new_size <= size:
+            return addr
+
+        try:
+            return self.reserve(addr, max(new_size, size * self.GROWTH_FACTOR))
+        except ValueError:
+            # the geometric step doesn't fit, settle for what is needed
+            return self.reserve(addr, new_size)
+
+    def _release(self, addr: int, new_size: int):
+        if self.is_slab(addr):
+            # a slot keeps its size class
+            return
 
-        return self.memory[block][offset + starting_byte:offset + starting_byte + num_bytes]
+        with self.lock:
+            keep = self.blocks_needed(new_size)
+
+            extents = []
+            for start, length in self.extents[addr]:
+                if keep >= length:
+                    extents.append((start, length))
+                elif keep > 0:
+                    extents.append((start, keep))
+                    self._free_run(start + keep, length - keep)
+                else:
+                    self._free_run(start, length)
+                keep -= length
+
+            self.extents[addr] = extents
+            self.space_used -= self.allocations[addr] - new_size
+            self.allocations[addr] = new_size
+            self.metadata_dirty = True
 
     def truncate(self, addr: int, new_size: int):
         if new_size > self.allocations[addr]:
             raise ValueError('New size must be smaller than current size')
 
-        self.allocations[addr] = new_size
         self.used_per_allocation[addr] = min(
             self.used_per_allocation[addr], new_size)
+        self._release(addr, new_size)
 
-    def write_file(self, addr: int, data: List[int]):
-        size = self.allocations[addr]
-        if len(data) > size:
-            addr = self.reallocate(addr, len(data))
+    def shrink_to_fit(self, addr: int):
+        self._release(addr, self.used_per_allocation[addr])
+
+    @stats.probe(stats.WRITE, lambda args, kwargs, result: len(args[2]))
+    def write_file(self, addr: int, data):
+        data = self._as_buffer(data)
 
-        block = addr >> self.OFFSET_BITS
-        offset = addr & ((2 ** self.OFFSET_BITS) - 1)
+        addr = self.reserve(addr, len(data))
+        addr = self._unshare(addr, 0, len(data))
 
-        # self.memory[block][offset:len(data)] = data
-        self.memory[block] = self.memory[block][:offset] + \
-            data + self.memory[block][offset + len(data):]
+        self._write(addr, 0, data)
         self.used_per_allocation[addr] = len(data)
-        return addr
+        self.metadata_dirty = True
+        return self._dedup(addr, 0, len(data), tail=True)
 
-    def append_file(self, addr: int, data: List[int]):
-        new_addr = addr
-        previous_data_length = self.used_per_allocation[addr]
-        if previous_data_length + len(data) > self.allocations[addr]:
-            new_addr = self.reallocate(addr, previous_data_length + len(data))
+    @stats.probe(stats.APPEND, lambda args, kwargs, result: len(args[2]))
+    def append_file(self, addr: int, data):
+        data = self._as_buffer(data)
 
-        previous_data = self.read_file(addr, 0, previous_data_length)
-        return self.write_file(new_addr, previous_data + data)
+        # only the new tail is written, existing runs never move
+        previous_data_length = self.used_per_allocation[addr]
+        addr = self._reserve_for_append(addr, previous_data_length + len(data))
+        addr = self._unshare(addr, previous_data_length, len(data))
+
+        self._write(addr, previous_data_length, data)
+        self.used_per_allocation[addr] = previous_data_length + len(data)
+        self.metadata_dirty = True
+        return self._dedup(addr, previous_data_length, len(data))
+
+    @stats.probe(stats.WRITE, lambda args, kwargs, result: len(args[3]))
+    def write_at(self, addr: int, offset: int, data):
+        data = self._as_buffer(data)
+
+        used = self.used_per_allocation[addr]
+        end = offset + len(data)
+        if end > used:
+            addr = self._reserve_for_append(addr, end)
+
+        start = min(offset, used)
+        addr = self._unshare(addr, start, end - start)
+        if offset > used:
+            # a gap left by seeking past the end reads back as zeros
+            self._write(addr, used, bytes(offset - used))
+
+        self._write(addr, offset, data)
+        self.used_per_allocation[addr] = max(used, end)
+        self.metadata_dirty = True
+        return self._dedup(addr, start, end - start)
 
     def move_within_file(self, addr: int, starting_byte: int, content_length: int, writing_byte: int):
         if starting_byte + content_length > self.allocations[addr]:
@@ -95,49 +556,311 @@ class Memory:
             raise ValueError(
                 'Writing byte + content length must be less than or equal to file size')
 
-        block = addr >> self.OFFSET_BITS
-        offset = addr & ((2 ** self.OFFSET_BITS) - 1)
-
-        data = self.read_file(addr, starting_byte,
-                              starting_byte + content_length)
+        # read first: blocks the write fully covers are swapped without a copy,
+        # a live view still sees the old ones
+        data = self.read_file(addr, starting_byte, content_length)
+        addr = self._unshare(addr, writing_byte, content_length)
+        if len(self.extents[addr]) > 1:
+            # ranges may straddle runs, so the source can't be a live view
+            data = bytes(data)
 
-        self.memory[block][offset + writing_byte:offset +
-                           writing_byte + content_length] = data
+        # memoryview slice assignment is a memmove, overlapping ranges are fine
+        self._write(addr, writing_byte, data)
 
-        return addr
+        return self._dedup(addr, writing_byte, content_length)
 
+    @stats.probe(stats.REALLOCATE, lambda args, kwargs, result: args[0].used_per_allocation[result])
     def reallocate(self, addr: int, new_size: int):
-        if self.space_used - self.allocations[addr] + new_size > self.total_size:
-            raise ValueError('Not enough space in memory')
+        with self.lock:
+            if self.space_committed - self.allocations[addr] + new_size > self.total_size:
+                raise ValueError('Not enough space in memory')
 
-        self.deallocate(addr)
-        return self.allocate(new_size)
+            used = min(self.used_per_allocation[addr], new_size)
+            data = bytes(self.read_file(addr, 0, used))
 
-    def deallocate(self, addr: int):
-        size = self.allocations.get(addr, None)
-        if size is None:
-            return
+            self.deallocate(addr)
+            new_addr = self.allocate(new_size)
 
-        block = addr >> self.OFFSET_BITS
-        self.free_blocks.append(block)
-        self.space_used -= size
-        del self.allocations[addr]
-        del self.used_per_allocation[addr]
+            self._write(new_addr, 0, data)
+            self.used_per_allocation[new_addr] = used
+            return new_addr
+
+    @stats.probe(stats.DEALLOCATE)
+    def deallocate(self, addr: int):
+        with self.lock:
+            size = self.allocations.get(addr, None)
+            if size is None:
+                return
+
+            runs = self.extents.pop(addr)
+            if self.is_slab(addr):
+                if self.slot_births.get(addr, 0) <= self.shared_generation:
+                    self.dead.append(addr)
+                else:
+                    self._free_unit(addr)
+            else:
+                for start, length in runs:
+                    self._free_run(start, length)
+            self.space_used -= size
+            del self.allocations[addr]
+            del self.used_per_allocation[addr]
+            self.metadata_dirty = True
+
+    def compact(self):
+        # packs every allocation into one run, lowest first, in the order of
+        # their first block; slots of one slab block move together, a block
+        # several allocations share stays where the first of them put it;
+        # returns the report and old addr -> new addr
+        with self.lock:
+            if self.snapshots:
+                raise ValueError('Snapshots pin their blocks, delete them before compacting')
+
+            before = self.free_space.stats()['fragmentation']
+            offset_mask = (2 ** self.OFFSET_BITS) - 1
+
+            # first block -> addrs stored there, more than one for a slab
+            units: Dict[int, List[int]] = {}
+            for addr, runs in self.extents.items():
+                units.setdefault(runs[0][0], []).append(addr)
+            runs_before = sum(len(self.extents[addrs[0]]) for addrs in units.values())
+
+            # old block -> new block
+            placed = {}
+            cursor = 0
+            for first in sorted(units):
+                for start, length in self.extents[units[first][0]]:
+                    for old in range(start, start + length):
+                        if old not in placed:
+                            placed[old] = cursor
+                            cursor += 1
+
+            moves = {old: new for old, new in placed.items() if old != new}
+            moved = len(moves)
+            self._move_blocks(moves)
+
+            # shared blocks are freed once, after the runs around them
+            for addrs in units.values():
+                for start, length in self.extents[addrs[0]]:
+                    end = start + length
+                    for block in range(start, end) if self.refs else ():
+                        if block in self.refs:
+                            self.free_space.free(start, block - start)
+                            start = block + 1
+                    self.free_space.free(start, end - start)
+            for block in self.refs:
+                self.free_space.free(block, 1)
+            if cursor:
+                self.free_space.allocate_at(0, cursor)
+
+            remap = {}
+            extents = {}
+            for addrs in units.values():
+                runs = []
+                for start, length in self.extents[addrs[0]]:
+                    if not self.refs:
+                        # nothing shared, the run was placed in one piece
+                        self._add_run(runs, placed[start], length)
+                        continue
+
+                    for old in range(start, start + length):
+                        self._add_run(runs, placed[old], 1)
+                for addr in addrs:
+                    remap[addr] = (runs[0][0] << self.OFFSET_BITS) | (addr & offset_mask)
+                    extents[remap[addr]] = list(runs)
+
+            self.slabs.remap(placed)
+            self.allocations = {remap[addr]: size for addr, size in self.allocations.items()}
+            self.used_per_allocation = {remap[addr]: used for addr, used in self.used_per_allocation.items()}
+            self.extents = extents
+            self.refs = {placed[block]: refs for block, refs in self.refs.items()}
+            self.digests = {placed[block]: digest for block, digest in self.digests.items()}
+            self.index = {digest: block for block, digest in self.digests.items()}
+            self.metadata_dirty = True
+
+            return {
+                'bytes_moved': moved * constants.BLOCK_SIZE,
+                'fragmentation_before': before,
+                'fragmentation_after': self.free_space.stats()['fragmentation'],
+                'runs_before': runs_before,
+                'runs_after': sum(len(self.extents[remap[addrs[0]]]) for addrs in units.values()),
+            }, remap
+
+    def _copy_block(self, old: int, new: int):
+        block_size = constants.BLOCK_SIZE
+        self._store(new * block_size, bytes(self._load(old * block_size, block_size)))
+        self.dirty_pages.add(new * block_size // constants.PAGE_SIZE)
+
+    def _move_blocks(self, moves: Dict[int, int]):
+        # old block -> new block, destinations may still hold blocks that have
+        # to move: a block is copied once its destination has been vacated,
+        # what remains are cycles, each rotated through one scratch block
+        block_size = constants.BLOCK_SIZE
+        sources = {new: old for old, new in moves.items()}
+
+        ready = [old for old, new in moves.items() if new not in moves]
+        while ready:
+            old = ready.pop()
+            self._copy_block(old, moves.pop(old))
+            waiting = sources.get(old)
+            if waiting is not None:
+                ready.append(waiting)
+
+        while moves:
+            first, new = moves.popitem()
+            scratch = bytes(self._load(first * block_size, block_size))
+            block = first
+            while sources[block] != first:
+                old = sources[block]
+                self._copy_block(old, block)
+                del moves[old]
+                block = old
+            self._store(new * block_size, scratch)
+            self.dirty_pages.add(new * block_size // constants.PAGE_SIZE)
+
+    def freeze(self, snapshot: 'Snapshot'):
+        # the allocation maps as they are now, every unit allocated so far is
+        # shared with the snapshot until the live store writes or frees it
+        with self.lock:
+            if self.births is None:
+                # first snapshot: whatever exists now was born before it
+                self.births = array('I', bytes(4 * self.total_blocks))
+
+            snapshot.generation = self.generation
+            snapshot.allocations = dict(self.allocations)
+            snapshot.used_per_allocation = dict(self.used_per_allocation)
+            snapshot.extents = {addr: list(runs) for addr, runs in self.extents.items()}
+            # released since the snapshot before, still used by that one
+            snapshot.dead = self.dead
+
+            self.dead = []
+            self.generation += 1
+            self.snapshots[snapshot.name] = snapshot
+            self.metadata_dirty = True
+
+    def _exclusive(self, name: str):
+        # -> units only the snapshot uses, and the dead list of the one after
+        # it (or the live store's) they are on: born after the previous
+        # snapshot, released before the next
+        names = list(self.snapshots)
+        index = names.index(name)
+        previous = self.snapshots[names[index - 1]].generation if index else -1
+        later = self.snapshots[names[index + 1]] if index + 1 < len(names) else None
+
+        dead = later.dead if later else self.dead
+        return [unit for unit in dead if self._birth(unit) > previous], later
+
+    def exclusive_bytes(self, name: str) -> int:
+        with self.lock:
+            return sum(self._unit_size(unit) for unit in self._exclusive(name)[0])
+
+    def drop(self, name: str) -> int:
+        # frees what only the snapshot used, returns the bytes reclaimed
+        with self.lock:
+            exclusive, later = self._exclusive(name)
+            snapshot = self.snapshots.pop(name)
+
+            freed = 0
+            for unit in exclusive:
+                freed += self._unit_size(unit)
+                self._free_unit(unit)
+
+            # the rest of that dead list and the snapshot's own are still used
+            # by older snapshots
+            exclusive = set(exclusive)
+            dead = [unit for unit in (later.dead if later else self.dead) if unit not in exclusive]
+            dead.extend(snapshot.dead)
+            if later:
+                later.dead = dead
+            else:
+                self.dead = dead
+
+            if not self.snapshots:
+                # nothing is shared any more, births only matter while something is
+                self.births = None
+                self.slot_births = {}
+
+            self.metadata_dirty = True
+            return freed
+
+    def revert(self, name: str):
+        # back to the newest snapshot: units allocated since are freed, those
+        # released since are live again
+        with self.lock:
+            snapshot = self.snapshots[name]
+            for addr in list(self.allocations):
+                self.deallocate(addr)
+
+            # everything the snapshot uses was shared, so none of it was freed
+            self.dead = []
+            self.allocations = dict(snapshot.allocations)
+            self.used_per_allocation = dict(snapshot.used_per_allocation)
+            self.extents = {addr: list(runs) for addr, runs in snapshot.extents.items()}
+            self.space_used = sum(self.allocations.values())
+            # the index lost every block with its last live user, the
+            # snapshot's files may still share some between them
+            self.count_refs()
+            self.metadata_dirty = True
+
+    def rebuild_slabs(self):
+        # slots are not recorded in the image: a one-block allocation that
+        # reserves exactly a slot size is one, a whole block that small packs
+        # the same way; snapshots keep slots the live store released
+        offset_mask = (2 ** self.OFFSET_BITS) - 1
+        slots = {}
+        for maps in itertools.chain(self.snapshots.values(), [self]):
+            for addr, size in maps.allocations.items():
+                runs = maps.extents[addr]
+                if size in self.slabs.classes and len(runs) == 1 and runs[0][1] == 1:
+                    slots[addr] = (runs[0][0], addr & offset_mask, size)
+
+        for block, offset, size in slots.values():
+            self.slabs.mark_used(block, offset, size)
+
+    def count_refs(self):
+        # refs from the allocation maps, for blocks more than one allocation uses
+        refs = {}
+        for addr, runs in self.extents.items():
+            if self.is_slab(addr):
+                continue
+
+            for start, length in runs:
+                for block in range(start, start + length):
+                    refs[block] = refs.get(block, 0) + 1
+
+        self.refs = {block: count for block, count in refs.items() if count > 1}
+        self.deduped = sum(self.refs.values()) - len(self.refs)
+
+    def clear_dirty(self):
+        self.dirty_pages.clear()
+        self.metadata_dirty = False
 
     def get_free_space(self):
-        return self.total_size - self.space_used
+        return self.total_size - self.space_committed
 
     def show_memory_map(self, outfile=sys.stdout):
         print("Memory Map:", file=outfile)
-        print("Free Blocks:", self.free_blocks, file=outfile)
+        print("Free Extents:", self.free_space.free_extents(), file=outfile)
+        stats = self.free_space.stats()
+        print(
+            f"Free Blocks: {stats['free_blocks']}/{self.total_blocks}, Free Extents: {stats['free_extents']}, Largest Free Extent: {stats['largest_free_extent']}, Fragmentation: {stats['fragmentation']:.2%}", file=outfile)
+        if self.snapshots:
+            dead = len(self.dead) + sum(len(snapshot.dead) for snapshot in self.snapshots.values())
+            print(f"Snapshots: {len(self.snapshots)}, Units Only Snapshots Use: {dead}", file=outfile)
+        if self.dedup:
+            stored = sum(length for addr, runs in self.extents.items() if not self.is_slab(addr)
+                         for _, length in runs)
+            ratio = stored / (stored - self.deduped) if stored else 1.0
+            print(f"Dedup: {len(self.index)} Blocks Indexed, {len(self.refs)} Shared, Ratio: {ratio:.2f}x, "
+                  f"Saved: {self.deduped * constants.BLOCK_SIZE} bytes", file=outfile)
         for i, (addr, size) in enumerate(self.allocations.items()):
             print(
-                f"Allocation#{i+1} | Block#{addr >> self.OFFSET_BITS} Address: {hex(addr)}, Size: {size}, Used: {self.used_per_allocation[addr]}", file=outfile)
+                f"Allocation#{i+1} | Block#{addr >> self.OFFSET_BITS} Address: {hex(addr)}, Size: {size}, Used: {self.used_per_allocation[addr]}, Extents: {self.extents[addr]}", file=outfile)
 
     def show_memory_layout(self, outfile=sys.stdout):
         print("Memory Layout:", file=outfile)
-        for i, block in enumerate(self.memory):
-            print(f"Block {i}: {block}", file=outfile)
+        for i in range(self.total_blocks):
+            block = self._load(i * constants.BLOCK_SIZE, constants.BLOCK_SIZE)
+            print(f"Block {i}: {list(block)}", file=outfile)
 
     def __dict__(self):
         return {
@@ -145,7 +868,8 @@ class Memory:
             'total_size': self.total_size,
             'allocations': self.allocations,
             'used_per_allocation': self.used_per_allocation,
-            'memory': self.memory,
+            'extents': self.extents,
+            'memory': self._view.tolist(),
         }
 
     @classmethod
@@ -160,19 +884,142 @@ class Memory:
             int(addr): size for addr,
             size in data['used_per_allocation'].items()
         }
-        memory.memory = data['memory']
+        # saves from before extents had exactly one block per allocation
+        memory.extents = {
+            int(addr): [tuple(run) for run in runs] for addr,
+            runs in data.get('extents', {
+                addr: [(int(addr) >> cls.OFFSET_BITS, 1)] for addr in data['allocations']
+            }).items()
+        }
+
+        stored = data['memory']
+        if stored and isinstance(stored[0], list):
+            # older saves kept one list per block
+            stored = [byte for block in stored for byte in block]
+        memory._store(0, utils.to_buffer(stored))
+
+        for runs in memory.extents.values():
+            for start, length in runs:
+                memory.free_space.mark_used(start, length)
+        memory.free_space.rebuild()
+        memory.rebuild_slabs()
         return memory
 
 
-class FS_Node(ABC):
-    memory: Memory
+class Snapshot:
+    # a frozen tree: its inode table as the image encodes it and the store's
+    # allocation maps at the time, Memory.freeze fills in the block side
+    __slots__ = ('name', 'created', 'root_ino', 'inode_count', 'inodes', 'generation',
+                 'allocations', 'used_per_allocation', 'extents', 'dead')
 
-    def __init__(self, name: string, date_created: datetime) -> None:
+    def __init__(self, name: str, created: int, root_ino: int, inode_count: int, inodes: bytes) -> None:
         self.name = name
-        self.date_created = date_created
-        self.parent: FS_Node = None
+        # epoch microseconds
+        self.created = created
+        self.root_ino = root_ino
+        self.inode_count = inode_count
+        self.inodes = inodes
+
+        self.generation = 0
+        self.allocations: Dict[int, int] = {}
+        self.used_per_allocation: Dict[int, int] = {}
+        self.extents: Dict[int, List[Tuple[int, int]]] = {}
+        # units released after the snapshot before this one was taken that
+        # it, or an older one, still uses
+        self.dead: List[int] = []
 
-    def print_directory_structure(self, level=0, max_level=10):
+
+class SnapshotView(Memory):
+    # read-only: a snapshot's allocation maps over the live store's blocks,
+    # only the read paths are meant to be used
+    def __init__(self, store: Memory, snapshot: Snapshot) -> None:
+        self.store = store
+        self.total_size = store.total_size
+        self.total_blocks = store.total_blocks
+        self.slabs = store.slabs
+        self.lock = store.lock
+
+        self.allocations = snapshot.allocations
+        self.used_per_allocation = snapshot.used_per_allocation
+        self.extents = snapshot.extents
+
+    def _load(self, start: int, length: int):
+        return self.store._load(start, length)
+
+
+class FS_Node(ABC):
+    # handles over an InodeTable row, all metadata lives in the table
+    __slots__ = ('table', 'ino')
+
+    KIND = InodeTable.KIND_FREE
+
+    memory: Memory
+    root: 'DirectoryNode' = None
+    # table new nodes are created in, load_from_file swaps in the loaded one
+    inodes: InodeTable = InodeTable()
+    # bumped whenever an entry is unlinked, cached path lookups check it
+    generation = 0
+    _generations = itertools.count(1)
+
+    def __init__(self, name: string, date_created: datetime, date_modified: datetime = None, table: InodeTable = None) -> None:
+        # an empty table is falsy
+        self.table = table if table is not None else FS_Node.inodes
+        created = utils.datetime_to_micros(date_created)
+        modified = utils.datetime_to_micros(date_modified) if date_modified else created
+        self.ino = self.table.allocate(self.KIND, name, created, modified)
+
+    @classmethod
+    def from_inode(cls, table: InodeTable, ino: int):
+        node = cls.__new__(cls)
+        node.table = table
+        node.ino = ino
+        return node
+
+    @property
+    def lock(self) -> RWLock:
+        # directories: guards entries, files: guards contents and size
+        return self.table.lock(self.ino)
+
+    @property
+    def name(self) -> str:
+        return self.table.name(self.ino)
+
+    @name.setter
+    def name(self, name: str):
+        self.table.names[self.ino] = name
+        self.table.dirty.add(self.ino)
+        self.table.namespace_dirty = True
+
+    @property
+    def date_created(self) -> datetime:
+        return utils.micros_to_datetime(self.table.date_created[self.ino])
+
+    @date_created.setter
+    def date_created(self, date: datetime):
+        self.table.date_created[self.ino] = utils.datetime_to_micros(date)
+        self.table.dirty.add(self.ino)
+
+    @property
+    def parent(self) -> 'DirectoryNode':
+        parent = self.table.parent[self.ino]
+        return self.table.directories[parent] if parent >= 0 else None
+
+    @parent.setter
+    def parent(self, parent: 'DirectoryNode'):
+        self.table.parent[self.ino] = parent.ino if parent else -1
+        self.table.dirty.add(self.ino)
+        self.table.namespace_dirty = True
+
+    def get_path(self) -> str:
+        names = []
+        node = self
+        while node.parent:
+            names.append(node.name)
+            node = node.parent
+
+        return '/' + '/'.join(reversed(names))
+
+    def print_directory_structure(self, level=0, max_level=10, outfile=sys.stdout):
         if level > max_level:
             return
 
@@ -181,10 +1028,10 @@ class FS_Node(ABC):
               utils.TColors.OKCYAN + utils.TColors.BOLD if isinstance(
                   self, DirectoryNode) else '',
               self.name,
-              utils.TColors.ENDC)
+              utils.TColors.ENDC, file=outfile)
         if isinstance(self, DirectoryNode):
             for child in self.children:
-                child.print_directory_structure(level + 1, max_level)
+                child.print_directory_structure(level + 1, max_level, outfile)
 
     def __dict__(self):
         return self.name
@@ -198,32 +1045,73 @@ class FS_Node(ABC):
 
 
 class DirectoryNode(FS_Node):
-    def __init__(self, name: string, date_created: datetime) -> None:
-        super().__init__(name, date_created)
-        self.children: List[FS_Node] = []
+    __slots__ = ('_entries',)
+
+    KIND = InodeTable.KIND_DIRECTORY
+
+    def __init__(self, name: string, date_created: datetime, table: InodeTable = None) -> None:
+        super().__init__(name, date_created, table=table)
+        # name -> child, dicts keep insertion order so listings stay stable
+        self._entries: Dict[str, FS_Node] = {}
+        self.table.directories[self.ino] = self
+
+    @classmethod
+    def from_inode(cls, table: InodeTable, ino: int):
+        node = super().from_inode(table, ino)
+        # children stay in the image until the directory is first used
+        node._entries = None
+        table.directories[ino] = node
+        return node
+
+    @property
+    def loaded(self) -> bool:
+        return self._entries is not None
+
+    @property
+    def entries(self) -> Dict[str, FS_Node]:
+        if self._entries is None:
+            table = self.table
+            with table.mutex:
+                # another reader may have materialized it while we waited
+                if self._entries is None:
+                    entries = {}
+                    for ino in table.loaded_children(self.ino):
+                        cls = DirectoryNode if table.kind[ino] == InodeTable.KIND_DIRECTORY else FileNode
+                        entries[table.name(ino)] = cls.from_inode(table, ino)
+
+                    self._entries = entries
+
+        return self._entries
+
+    @property
+    def children(self) -> List[FS_Node]:
+        # a snapshot, so callers can iterate while others add and remove
+        with self.lock.read():
+            return list(self.entries.values())
 
     def add_child(self, child: FS_Node) -> FS_Node:
-        self.children.append(child)
-        child.parent = self
+        with self.lock.write():
+            self.entries[child.name] = child
+            child.parent = self
         return child
 
     def remove_child(self, child: FS_Node):
-        self.children.remove(child)
-        # child.__del__()
+        with self.lock.write():
+            del self.entries[child.name]
+            FS_Node.generation = next(FS_Node._generations)
+            self.table.dirty.add(child.ino)
+            self.table.namespace_dirty = True
 
     def get_child(self, name: str):
-        for child in self.children:
-            if child.name == name:
-                return child
-
-        return None
+        with self.lock.read():
+            return self.entries.get(name)
 
     def __dict__(self):
         return {
             'name': self.name,
             'date_created': str(self.date_created),
             'parent': str(self.parent) if self.parent else None,
-            'children': self.children,
+            'children': list(self.children),
 
             'type': __class__.__name__
         }
@@ -231,10 +1119,29 @@ class DirectoryNode(FS_Node):
     def __str__(self) -> str:
         return super().__str__()
 
-    def __del__(self):
-        # print('Deleting', self.name)
-        for child in self.children:
-            child.__del__()
+    def remount(self, table: InodeTable, ino: int):
+        # the root keeps its identity when the whole tree is swapped for
+        # another, every other node of the old table reads as removed
+        with self.table.mutex:
+            for directory in list(self.table.directories.values()):
+                if directory.loaded:
+                    for child in directory._entries.values():
+                        child.ino = None
+                directory.ino = None
+
+        self.table = table
+        self.ino = ino
+        self._entries = None
+        table.directories[ino] = self
+
+    def release(self):
+        with self.lock.write():
+            for child in self.children:
+                child.release()
+
+            self.entries.clear()
+            self.table.release(self.ino)
+            self.ino = None
 
     @classmethod
     def from_dict(cls, data):
@@ -251,29 +1158,90 @@ class DirectoryNode(FS_Node):
 
 
 class FileNode(FS_Node):
-    STATE_CLOSE = 0
-    STATE_OPEN = 1
+    __slots__ = ()
+
+    KIND = InodeTable.KIND_FILE
 
     MODE_NONE = None
     MODE_READ = 'r'
     MODE_WRITE = 'w'
     MODE_APPEND = 'a'
 
-    def __init__(self, name: string, date_created: datetime = datetime.datetime.now(), date_modified: datetime = datetime.datetime.now()) -> None:
-        super().__init__(name, date_created)
-        self.date_modified = date_modified
-        self.starting_addr = -1
-        self.size = 0
+    def __init__(self, name: string, date_created: datetime = None, date_modified: datetime = None, table: InodeTable = None) -> None:
+        date_created = date_created or datetime.datetime.now()
+        super().__init__(name, date_created, date_modified or date_created, table)
+
+    @property
+    def date_modified(self) -> datetime:
+        return utils.micros_to_datetime(self.table.date_modified[self.ino])
+
+    @date_modified.setter
+    def date_modified(self, date: datetime):
+        self.table.date_modified[self.ino] = utils.datetime_to_micros(date)
+        self.table.dirty.add(self.ino)
+
+    @property
+    def starting_addr(self) -> int:
+        return self.table.starting_addr[self.ino]
+
+    @starting_addr.setter
+    def starting_addr(self, addr: int):
+        self.table.starting_addr[self.ino] = addr
+        self.table.dirty.add(self.ino)
+
+    @property
+    def size(self) -> int:
+        return self.table.size[self.ino]
+
+    @size.setter
+    def size(self, size: int):
+        self.table.size[self.ino] = size
+        self.table.dirty.add(self.ino)
+
+    @property
+    def store(self) -> Memory:
+        # the live store, or a snapshot's view of it for a mounted snapshot
+        return self.table.memory or FS_Node.memory
 
-        self.state = FileNode.STATE_CLOSE
-        self.mode: FileNode.MODE_NONE | FileNode.MODE_READ | FileNode.MODE_WRITE | FileNode.MODE_APPEND = FileNode.MODE_NONE
+    @property
+    def extents(self) -> List[Tuple[int, int]]:
+        if self.starting_addr < 0:
+            return []
+
+        return self.store.extents.get(self.starting_addr, [])
+
+    def iter_chunks(self, starting_byte: int = 0, num_bytes: int = None,
+                    chunk_size: int = constants.STREAM_CHUNK_SIZE):
+        if num_bytes is None:
+            num_bytes = self.size - starting_byte
+        if self.starting_addr < 0 or num_bytes <= 0:
+            return iter(())
+
+        return self.store.iter_file(self.starting_addr, starting_byte, num_bytes, chunk_size)
+
+    def write_chunks(self, chunks, offset: int = 0) -> int:
+        # caller holds the write lock, returns the bytes written; the addr and
+        # size follow every chunk, a store that runs out leaves the file as
+        # far as it got. The reservation grows geometrically, shrink_to_fit
+        # gives the slack back
+        memory = self.store
+        if self.starting_addr < 0:
+            self.starting_addr = memory.allocate(0)
+
+        start = offset
+        for chunk in chunks:
+            self.starting_addr = memory.write_at(self.starting_addr, offset, chunk)
+            offset += len(chunk)
+            self.size = max(self.size, offset)
+
+        return offset - start
 
     def set_size(self, size):
-        if 0 <= size < constants.MAX_FILE_SIZE:
+        if 0 <= size < FS_Node.memory.max_file_size:
             self.size = size
 
         raise ValueError(
-            f'File size must be between 0 and {constants.MAX_FILE_SIZE / 1024} KB')
+            f'File size must be between 0 and {FS_Node.memory.max_file_size / 1024} KB')
 
     def set_starting_addr(self, addr):
         if 0 <= addr < constants.TOTAL_MEMORY_SIZE:
@@ -297,16 +1265,19 @@ class FileNode(FS_Node):
     def __str__(self) -> str:
         return super().__str__()
 
-    def __del__(self):
-        if self.starting_addr != -1 and self.size != 0:
-            FS_Node.memory.deallocate(self.starting_addr)
-            # print('Deallocated memory', self.starting_addr)
+    def release(self):
+        # explicit rather than __del__: caches and parent links keep nodes alive
+        with self.lock.write():
+            if self.starting_addr != -1:
+                self.store.deallocate(self.starting_addr)
+
+            self.table.release(self.ino)
+            self.ino = None
 
     @classmethod
     def from_dict(cls, data):
         file = FileNode(data['name'], utils.get_datetime_object(
             data['date_created']), utils.get_datetime_object(data['date_modified']))
-        file.parent = data['parent']
         file.starting_addr = data['starting_addr']
         file.size = data['size']
 
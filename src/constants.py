@@ -1,6 +1,8 @@
 import math
+from typing import Optional
 
 FILENAME = './storage.dat'
+JOURNAL_FILENAME = './storage.journal'
 
 # 1 KB
 TOTAL_MEMORY_SIZE: int = int(math.pow(2, 10))
@@ -9,5 +11,54 @@ BLOCK_SIZE: int = int(math.pow(2, 6))
 # 16
 TOTAL_BLOCKS: int = TOTAL_MEMORY_SIZE // BLOCK_SIZE
 
-# 64 KB
-MAX_FILE_SIZE: int = BLOCK_SIZE
+# bytes streamed per chunk by import, export and cat
+STREAM_CHUNK_SIZE: int = int(math.pow(2, 16))
+
+# smallest slot of the sub-block allocator: allocations of up to half a block
+# share blocks in power-of-two slots from this size up
+SLAB_MIN_SIZE: int = 4
+
+# files are extent lists, so by default (None) one can span the whole store,
+# whatever size the store was created with
+MAX_FILE_SIZE: Optional[int] = None
+
+# resolved paths kept by the dentry cache
+DENTRY_CACHE_SIZE: int = 1024
+
+# mounted snapshots show up read-only under /<SNAPSHOT_DIR>/<name>
+SNAPSHOT_DIR = '.snapshots'
+
+# time and count the hot paths from startup, the stats command can switch it later
+STATS_ENABLED: bool = False
+
+# seconds between automatic checkpoints of the image
+CHECKPOINT_INTERVAL: float = 5.0
+
+# free-space fragmentation at which a server compacts the store in the background
+COMPACT_FRAGMENTATION: float = 0.5
+
+# seconds between journal fsyncs, records in between are committed as a group
+JOURNAL_FSYNC_INTERVAL: float = 1.0
+
+# host file behind a PagedMemory store
+BACKING_FILENAME = './storage.blocks'
+
+# --script: commands between journal commits, bytes of output buffered
+SCRIPT_COMMIT_EVERY: int = 1024
+SCRIPT_OUTPUT_BUFFER: int = int(math.pow(2, 20))
+
+# 4 KB, unit the page cache reads and writes back, a multiple of BLOCK_SIZE
+PAGE_SIZE: int = int(math.pow(2, 12))
+# pages a PagedMemory keeps in RAM
+PAGE_CACHE_PAGES: int = 256
+
+# --serve: where to listen, threads running commands, requests a client may
+# have queued before the server stops reading from it, largest request frame
+SERVER_HOST = '127.0.0.1'
+SERVER_PORT: int = 7070
+SERVER_WORKERS: int = 8
+SERVER_PIPELINE_DEPTH: int = 32
+SERVER_MAX_FRAME: int = int(math.pow(2, 20))
+
+# byte sequences at least this long are converted through NumPy when it is installed
+NUMPY_MIN_BYTES: int = int(math.pow(2, 16))
@@ -1,23 +1,657 @@
+import itertools
 import json
+import mmap
 import os
+import struct
+import weakref
+import zlib
+from array import array
+from datetime import datetime
 from typing import Tuple
 
 import classes
 import constants
+import journal
+import locks
+import paths
+import stats
+import utils
+from inodes import InodeTable
+from pagecache import PagedMemory
 
+# Image layout, every offset is recorded in the superblock:
+#   superblock | block bitmap | data region (page aligned) | inode table | allocation table | slab state
+#   | snapshots | dedup index
+# The data region has a fixed size, so metadata that changes length only
+# ever rewrites the tail of the file.
+IMAGE_MAGIC = b'FSIMAGE\0'
+IMAGE_VERSION = 8
 
+# ..., last journal sequence number the image contains, root inode number, flags,
+# store generation, snapshots offset and count
+SUPERBLOCK = struct.Struct('<8sHIQQQQQQQQQQQIQQQ')
+# the data region is empty, blocks live in the PagedMemory backing file
+FLAG_EXTERNAL_DATA = 1
+# blocks are deduplicated, the dedup index follows the snapshots
+FLAG_DEDUP = 2
+# generation, created, root inode number, inodes, inode table bytes,
+# allocations, dead units, name bytes
+SNAPSHOT = struct.Struct('<qqqqqqqq')
+COUNT = struct.Struct('<q')
+
+# Every write of a checkpoint goes to filename + REDO_SUFFIX and is fsynced
+# before any of them touches the image or the backing file, a crash halfway
+# through is finished from it on load:
+#   magic, writes, image length (-1 to keep it) | target, offset, length, bytes ... | crc32
+REDO_SUFFIX = '.redo'
+REDO_MAGIC = b'FSREDO\0\0'
+REDO = struct.Struct('<8sqq')
+REDO_WRITE = struct.Struct('<Bqq')
+REDO_CRC = struct.Struct('<I')
+REDO_IMAGE = 0
+REDO_BACKING = 1
+
+# filename -> the inode table its image was last written from or loaded into,
+# a checkpoint only patches the inode section of that same table
+_written = weakref.WeakValueDictionary()
+
+
+def _align(offset: int, alignment: int) -> int:
+    return -(-offset // alignment) * alignment
+
+
+def _layout(memory: classes.Memory):
+    bitmap_offset = _align(SUPERBLOCK.size, 64)
+    bitmap = memory.free_space.bitmap_bytes()
+    data_offset = _align(bitmap_offset + len(bitmap), mmap.ALLOCATIONGRANULARITY)
+    data_length = 0 if isinstance(memory, PagedMemory) else len(memory._view)
+
+    return bitmap_offset, bitmap, data_offset, data_offset + data_length
+
+
+def _encode_inodes(table: InodeTable) -> bytes:
+    # columnar: every persisted column as raw array bytes, then name offsets,
+    # the child index of every directory and the names
+    names = [table.name_bytes(ino) for ino in range(len(table))]
+    name_offsets = array('q', [0])
+    total = 0
+    for name in names:
+        total += len(name)
+        name_offsets.append(total)
+
+    kind = table.kind
+    child_offsets = array('q', [0])
+    child_inos = array('q')
+    for ino in range(len(table)):
+        if kind[ino] == InodeTable.KIND_DIRECTORY:
+            node = table.directories.get(ino)
+            if node is not None and node.loaded:
+                child_inos.extend(child.ino for child in node.children)
+            else:
+                child_inos.extend(table.loaded_children(ino))
+
+        child_offsets.append(len(child_inos))
+
+    return b''.join([getattr(table, column).tobytes() for column in InodeTable.PERSISTED]
+                    + [name_offsets.tobytes(), child_offsets.tobytes(), child_inos.tobytes()]
+                    + names)
+
+
+def _decode_array(typecode: str, buffer, offset: int, count: int):
+    values = array(typecode)
+    values.frombytes(buffer[offset:offset + count * values.itemsize])
+    return values, offset + count * values.itemsize
+
+
+def _decode_inodes(buffer, offset: int, count: int, root_ino: int) -> Tuple[classes.DirectoryNode, InodeTable]:
+    # only the columns are copied out, names and directory contents are
+    # decoded the first time something looks at them
+    table = InodeTable()
+    for column in InodeTable.PERSISTED:
+        values, offset = _decode_array(getattr(table, column).typecode, buffer, offset, count)
+        setattr(table, column, values)
+
+    table.name_offsets, offset = _decode_array('q', buffer, offset, count + 1)
+    table.child_offsets, offset = _decode_array('q', buffer, offset, count + 1)
+    table.child_inos, offset = _decode_array('q', buffer, offset, table.child_offsets[-1])
+    table.name_blob = bytes(buffer[offset:offset + table.name_offsets[-1]])
+    table.names = [None] * count
+
+    kinds = table.kind.tobytes()
+    ino = kinds.find(InodeTable.KIND_FREE)
+    while ino != -1:
+        table.free.append(ino)
+        ino = kinds.find(InodeTable.KIND_FREE, ino + 1)
+
+    return classes.DirectoryNode.from_inode(table, root_ino), table
+
+
+def _encode_allocations(memory: classes.Memory) -> bytes:
+    # columnar like the inode table: the number of runs, then addrs, reserved
+    # sizes, used sizes and run counts, then every run as a start, length pair
+    addrs = array('q', memory.allocations)
+    extents = [memory.extents[addr] for addr in addrs]
+    runs = array('q', itertools.chain.from_iterable(itertools.chain.from_iterable(extents)))
+
+    return b''.join([COUNT.pack(len(runs) // 2), addrs.tobytes(),
+                     array('q', memory.allocations.values()).tobytes(),
+                     array('q', map(memory.used_per_allocation.__getitem__, addrs)).tobytes(),
+                     array('q', map(len, extents)).tobytes(), runs.tobytes()])
+
+
+def _decode_allocations(memory: classes.Memory, buffer, offset: int, count: int) -> int:
+    # into memory or a snapshot, returns the offset after the section
+    run_count = COUNT.unpack_from(buffer, offset)[0]
+    addrs, offset = _decode_array('q', buffer, offset + COUNT.size, count)
+    sizes, offset = _decode_array('q', buffer, offset, count)
+    used, offset = _decode_array('q', buffer, offset, count)
+    run_counts, offset = _decode_array('q', buffer, offset, count)
+    runs, offset = _decode_array('q', buffer, offset, run_count * 2)
+
+    memory.allocations.update(zip(addrs, sizes))
+    memory.used_per_allocation.update(zip(addrs, used))
+    runs = list(zip(runs[::2], runs[1::2]))
+    bounds = itertools.pairwise(itertools.accumulate(run_counts, initial=0))
+    memory.extents.update(zip(addrs, [runs[start:end] for start, end in bounds]))
+
+    return offset
+
+
+def _encode_slabs(memory: classes.Memory) -> bytes:
+    # the store's slab blocks, their slot sizes and used slot masks, so a
+    # load doesn't have to work them out from every allocation map again
+    slabs = memory.slabs
+    blocks = array('q', slabs.slot_size)
+    return b''.join([COUNT.pack(len(blocks)), blocks.tobytes(),
+                     array('q', slabs.slot_size.values()).tobytes(),
+                     array('Q', map(slabs.used.__getitem__, blocks)).tobytes()])
+
+
+def _decode_slabs(memory: classes.Memory, buffer, offset: int) -> int:
+    count = COUNT.unpack_from(buffer, offset)[0]
+    blocks, offset = _decode_array('q', buffer, offset + COUNT.size, count)
+    slots, offset = _decode_array('q', buffer, offset, count)
+    masks, offset = _decode_array('Q', buffer, offset, count)
+    memory.slabs.load(blocks, slots, masks)
+    return offset
+
+
+def _encode_snapshots(memory: classes.Memory) -> bytes:
+    # the live dead list, slot and block births, then every snapshot oldest
+    # first; empty without snapshots, births only matter while one exists
+    if not memory.snapshots:
+        return b''
+
+    slot_births = array('q', [value for item in memory.slot_births.items() for value in item])
+    parts = [COUNT.pack(len(memory.dead)), array('q', memory.dead).tobytes(),
+             COUNT.pack(len(memory.slot_births)), slot_births.tobytes(), memory.births.tobytes()]
+
+    for snapshot in memory.snapshots.values():
+        name = snapshot.name.encode()
+        parts.append(SNAPSHOT.pack(
+            snapshot.generation, snapshot.created, snapshot.root_ino, snapshot.inode_count,
+            len(snapshot.inodes), len(snapshot.allocations), len(snapshot.dead), len(name)))
+        parts.extend([name, snapshot.inodes, _encode_allocations(snapshot),
+                      array('q', snapshot.dead).tobytes()])
+
+    return b''.join(parts)
+
+
+def _decode_snapshots(memory: classes.Memory, buffer, offset: int, count: int) -> int:
+    # returns the offset after the last snapshot
+    if not count:
+        return offset
+
+    dead_count = COUNT.unpack_from(buffer, offset)[0]
+    dead, offset = _decode_array('q', buffer, offset + COUNT.size, dead_count)
+    memory.dead = dead.tolist()
+
+    slot_count = COUNT.unpack_from(buffer, offset)[0]
+    slot_births, offset = _decode_array('q', buffer, offset + COUNT.size, slot_count * 2)
+    memory.slot_births = dict(zip(slot_births[::2], slot_births[1::2]))
+    memory.births, offset = _decode_array('I', buffer, offset, memory.total_blocks)
+
+    for _ in range(count):
+        (generation, created, root_ino, inode_count, inode_length, allocation_count,
+         dead_count, name_length) = SNAPSHOT.unpack_from(buffer, offset)
+        offset += SNAPSHOT.size
+
+        name = bytes(buffer[offset:offset + name_length]).decode()
+        offset += name_length
+        snapshot = classes.Snapshot(name, created, root_ino, inode_count,
+                                    bytes(buffer[offset:offset + inode_length]))
+        offset = _decode_allocations(snapshot, buffer, offset + inode_length, allocation_count)
+        dead, offset = _decode_array('q', buffer, offset, dead_count)
+
+        snapshot.generation = generation
+        snapshot.dead = dead.tolist()
+        memory.snapshots[name] = snapshot
+
+    return offset
+
+
+def _encode_index(memory: classes.Memory) -> bytes:
+    # indexed blocks and their digests, then the refs of shared blocks;
+    # empty unless the store deduplicates
+    if not memory.dedup:
+        return b''
+
+    refs = array('q', [value for item in memory.refs.items() for value in item])
+    return b''.join([COUNT.pack(len(memory.digests)), array('q', memory.digests).tobytes(),
+                     *memory.digests.values(), COUNT.pack(len(memory.refs)), refs.tobytes()])
+
+
+def _decode_index(memory: classes.Memory, buffer, offset: int):
+    count = COUNT.unpack_from(buffer, offset)[0]
+    blocks, offset = _decode_array('q', buffer, offset + COUNT.size, count)
+    size = memory.DIGEST_SIZE
+    digests = [bytes(buffer[offset + i * size:offset + (i + 1) * size]) for i in range(count)]
+    offset += count * size
+
+    memory.digests = dict(zip(blocks, digests))
+    memory.index = dict(zip(digests, blocks))
+
+    count = COUNT.unpack_from(buffer, offset)[0]
+    refs, offset = _decode_array('q', buffer, offset + COUNT.size, count * 2)
+    memory.refs = dict(zip(refs[::2], refs[1::2]))
+    memory.deduped = sum(memory.refs.values()) - len(memory.refs)
+
+
+def _pack_superblock(structure: classes.FS_Node, memory: classes.Memory, bitmap_offset: int,
+                     data_offset: int, inode_offset: int, allocation_offset: int,
+                     snapshot_offset: int) -> bytes:
+    return SUPERBLOCK.pack(
+        IMAGE_MAGIC, IMAGE_VERSION, constants.BLOCK_SIZE, memory.total_blocks,
+        memory.total_size, memory.space_used, bitmap_offset, data_offset,
+        inode_offset, len(structure.table), allocation_offset, len(memory.allocations),
+        journal.wal.seq if journal.wal else 0, structure.ino,
+        (FLAG_EXTERNAL_DATA if isinstance(memory, PagedMemory) else 0) | (FLAG_DEDUP if memory.dedup else 0),
+        memory.generation, snapshot_offset, len(memory.snapshots))
+
+
+def _image_bytes(args, kwargs, result) -> int:
+    filename = args[0] if args else kwargs.get('filename', constants.FILENAME)
+    return os.path.getsize(filename) if os.path.isfile(filename) else 0
+
+
+@stats.probe(stats.SAVE, _image_bytes)
 def save_to_file(filename=constants.FILENAME, structure: classes.FS_Node = None, memory: classes.Memory = None):
-    with open(filename, 'w') as f:
-        json.dump({
-            'structure': structure,
-            'memory': memory
-        }, f, default=lambda o: o.__dict__())
+    # exclusive: no command may change the tree or the store mid-save
+    with locks.fs_lock.write():
+        _save_to_file(filename, structure, memory)
+
+
+def _save_to_file(filename: str, structure: classes.FS_Node, memory: classes.Memory):
+    if journal.wal:
+        journal.wal.sync()
+
+    bitmap_offset, bitmap, data_offset, data_end = _layout(memory)
+    inodes = _encode_inodes(structure.table)
+    allocations = _encode_allocations(memory) + _encode_slabs(memory)
+    snapshots = _encode_snapshots(memory) + _encode_index(memory)
+    superblock = _pack_superblock(structure, memory, bitmap_offset, data_offset, data_end,
+                                  data_end + len(inodes), data_end + len(inodes) + len(allocations))
+
+    if isinstance(memory, PagedMemory):
+        # the blocks are in the backing file, which can't be swapped in along
+        # with a new image: both go through the redo file, the image is small
+        image = bytearray(data_offset)
+        image[:len(superblock)] = superblock
+        image[bitmap_offset:bitmap_offset + len(bitmap)] = bitmap
+        image += inodes + allocations + snapshots
+
+        pages = memory.cache.pending()
+        _commit_writes(filename, memory.filename, [(REDO_BACKING, offset, page) for offset, page in pages]
+                       + [(REDO_IMAGE, 0, image)], len(image))
+        memory.cache.written()
+
+    else:
+        # the old image may still be mapped by memory, never write through it
+        temp_filename = filename + '.tmp'
+        with open(temp_filename, 'wb') as f:
+            f.write(superblock)
+
+            f.seek(bitmap_offset)
+            f.write(bitmap)
+            f.seek(data_offset)
+            f.write(memory._view)
+            f.write(inodes)
+            f.write(allocations)
+            f.write(snapshots)
+
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(temp_filename, filename)
+
+    memory.clear_dirty()
+    structure.table.clear_dirty()
+    _written[filename] = structure.table
+    if journal.wal:
+        journal.wal.reset()
+
 
+def _write_redo(filename: str, writes, length: int):
+    crc = 0
+    with open(filename + REDO_SUFFIX, 'wb') as f:
+        for part in itertools.chain([REDO.pack(REDO_MAGIC, len(writes), length)], *(
+                (REDO_WRITE.pack(target, offset, len(data)), data) for target, offset, data in writes)):
+            crc = zlib.crc32(part, crc)
+            f.write(part)
 
-def load_from_file(filename=constants.FILENAME) -> Tuple[classes.FS_Node | None, classes.Memory | None]:
+        f.write(REDO_CRC.pack(crc))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _read_redo(data: bytes):
+    # -> writes and image length, None for a redo file that was never finished
+    if len(data) < REDO.size + REDO_CRC.size or \
+            REDO_CRC.unpack_from(data, len(data) - REDO_CRC.size)[0] != zlib.crc32(data[:-REDO_CRC.size]):
+        return None, -1
+
+    magic, count, length = REDO.unpack_from(data)
+    if magic != REDO_MAGIC:
+        return None, -1
+
+    view = memoryview(data)
+    writes, offset = [], REDO.size
+    for _ in range(count):
+        target, target_offset, size = REDO_WRITE.unpack_from(data, offset)
+        offset += REDO_WRITE.size
+        writes.append((target, target_offset, view[offset:offset + size]))
+        offset += size
+
+    return writes, length
+
+
+def _apply_writes(filename: str, backing_filename: str, writes, length: int):
+    fds = {REDO_IMAGE: os.open(filename, os.O_RDWR | os.O_CREAT, 0o644)}
+    try:
+        if any(target == REDO_BACKING for target, _, _ in writes):
+            fds[REDO_BACKING] = os.open(backing_filename, os.O_RDWR | os.O_CREAT, 0o644)
+
+        for target, offset, data in writes:
+            os.pwrite(fds[target], data, offset)
+        if length >= 0:
+            os.ftruncate(fds[REDO_IMAGE], length)
+
+        for fd in fds.values():
+            os.fsync(fd)
+    finally:
+        for fd in fds.values():
+            os.close(fd)
+
+
+def _commit_writes(filename: str, backing_filename: str, writes, length: int = -1):
+    # writes: (REDO_IMAGE or REDO_BACKING, offset, bytes), all of them or none
+    # make it to disk; length truncates the image
+    _write_redo(filename, writes, length)
+    _apply_writes(filename, backing_filename, writes, length)
+    os.remove(filename + REDO_SUFFIX)
+
+
+def _recover(filename: str, backing_filename: str):
+    # finishes the writes of a checkpoint that crashed after its redo file was
+    # complete, an unfinished redo file means none of them had started
+    try:
+        with open(filename + REDO_SUFFIX, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return
+
+    writes, length = _read_redo(data)
+    if writes is not None:
+        _apply_writes(filename, backing_filename, writes, length)
+    os.remove(filename + REDO_SUFFIX)
+
+
+def _read_superblock(filename: str):
+    try:
+        with open(filename, 'rb') as f:
+            superblock = SUPERBLOCK.unpack(f.read(SUPERBLOCK.size))
+    except (OSError, struct.error):
+        return None
+
+    if superblock[0] != IMAGE_MAGIC or superblock[1] != IMAGE_VERSION:
+        return None
+
+    return superblock
+
+
+def _dirty_runs(pages):
+    runs = []
+    for page in sorted(pages):
+        if runs and runs[-1][1] == page:
+            runs[-1][1] = page + 1
+        else:
+            runs.append([page, page + 1])
+
+    return runs
+
+
+@stats.probe(stats.CHECKPOINT)
+def checkpoint(filename=constants.FILENAME, structure: classes.FS_Node = None, memory: classes.Memory = None):
+    with locks.fs_lock.write():
+        _checkpoint(filename, structure, memory)
+
+
+def _checkpoint(filename: str, structure: classes.FS_Node, memory: classes.Memory):
+    superblock = _read_superblock(filename)
+    bitmap_offset, bitmap, data_offset, data_end = _layout(memory)
+
+    if (superblock is None or superblock[2] != constants.BLOCK_SIZE
+            or superblock[3] != memory.total_blocks or superblock[7] != data_offset
+            or superblock[8] != data_end):
+        # no compatible image to patch yet
+        _save_to_file(filename, structure, memory)
+        return
+
+    table = structure.table
+    # a table swapped in since (a restored snapshot) is written whole
+    rewrite_inodes = table.namespace_dirty or _written.get(filename) is not table or len(table) != superblock[9]
+    if not memory.dirty_pages and not memory.metadata_dirty and not table.dirty and not rewrite_inodes:
+        return
+
+    # write-ahead: the records behind these pages are durable first
+    if journal.wal:
+        journal.wal.sync()
+
+    if isinstance(memory, PagedMemory):
+        writes = [(REDO_BACKING, offset, page) for offset, page in memory.cache.pending()]
+    else:
+        writes = [(REDO_IMAGE, data_offset + start * constants.PAGE_SIZE,
+                   memory._view[start * constants.PAGE_SIZE:end * constants.PAGE_SIZE])
+                  for start, end in _dirty_runs(memory.dirty_pages)]
+
+    allocation_offset, snapshot_offset = superblock[10], superblock[16]
+    length = -1
+    # a section is only rewritten when it changed, and the ones after it
+    # only when its length did
+    moved = False
+    if rewrite_inodes:
+        inodes = _encode_inodes(table)
+        moved = data_end + len(inodes) != allocation_offset
+        allocation_offset = data_end + len(inodes)
+        writes.append((REDO_IMAGE, data_end, inodes))
+
+    elif table.dirty:
+        # same rows, same names: the changed rows are patched in place
+        column_offset = data_end
+        for column in InodeTable.PERSISTED:
+            values = getattr(table, column)
+            for start, end in _dirty_runs(table.dirty):
+                writes.append((REDO_IMAGE, column_offset + start * values.itemsize, values[start:end].tobytes()))
+            column_offset += len(table) * values.itemsize
+
+    if memory.metadata_dirty or moved:
+        allocations = _encode_allocations(memory) + _encode_slabs(memory)
+        writes.append((REDO_IMAGE, bitmap_offset, bitmap))
+        writes.append((REDO_IMAGE, allocation_offset, allocations))
+        snapshot_offset = allocation_offset + len(allocations)
+
+        # snapshots and the dedup index change with the same allocations
+        snapshots = _encode_snapshots(memory) + _encode_index(memory)
+        writes.append((REDO_IMAGE, snapshot_offset, snapshots))
+        length = snapshot_offset + len(snapshots)
+
+    # always rewritten, it carries the journal sequence number
+    writes.append((REDO_IMAGE, 0, _pack_superblock(structure, memory, bitmap_offset, data_offset,
+                                                   data_end, allocation_offset, snapshot_offset)))
+    paged = isinstance(memory, PagedMemory)
+    _commit_writes(filename, memory.filename if paged else None, writes, length)
+
+    if paged:
+        memory.cache.written()
+    memory.clear_dirty()
+    table.clear_dirty()
+    _written[filename] = table
+    if journal.wal:
+        journal.wal.reset()
+
+
+@stats.probe(stats.COMPACT, lambda args, kwargs, result: result['bytes_moved'])
+def compact(filename=constants.FILENAME, structure: classes.FS_Node = None, memory: classes.Memory = None):
+    # exclusive: every file may get a new address, the checkpoint right after
+    # keeps the image's allocation table in step with where blocks now are
+    with locks.fs_lock.write():
+        report, remap = memory.compact()
+        structure.table.remap_addrs(remap)
+        _checkpoint(filename, structure, memory)
+
+    return report
+
+
+def snapshot(name: str, filename=constants.FILENAME, structure: classes.FS_Node = None,
+             memory: classes.Memory = None) -> classes.Snapshot:
+    # exclusive: the tree and the allocation maps are copied as of one
+    # instant, no block is; the checkpoint right after makes it durable
+    with locks.fs_lock.write():
+        if name in memory.snapshots:
+            raise ValueError('Snapshot already exists!')
+
+        snapshot = classes.Snapshot(name, utils.datetime_to_micros(datetime.now()), structure.ino,
+                                    len(structure.table), _encode_inodes(structure.table))
+        memory.freeze(snapshot)
+        _checkpoint(filename, structure, memory)
+
+    return snapshot
+
+
+def delete_snapshot(name: str, filename=constants.FILENAME, structure: classes.FS_Node = None,
+                    memory: classes.Memory = None) -> int:
+    # returns the bytes only the snapshot used, which are free again
+    with locks.fs_lock.write():
+        if name not in memory.snapshots:
+            raise ValueError('No such snapshot exists!')
+
+        paths.unmount(name)
+        freed = memory.drop(name)
+        _checkpoint(filename, structure, memory)
+
+    return freed
+
+
+def restore_snapshot(name: str, filename=constants.FILENAME, structure: classes.DirectoryNode = None,
+                     memory: classes.Memory = None):
+    # the whole filesystem goes back to the newest snapshot, which stays;
+    # structure stays the root, every other node of the old tree reads as removed
+    with locks.fs_lock.write():
+        if name not in memory.snapshots:
+            raise ValueError('No such snapshot exists!')
+
+        if name != next(reversed(memory.snapshots)):
+            raise ValueError('Only the newest snapshot can be restored, delete the newer ones first!')
+
+        snapshot = memory.snapshots[name]
+        memory.revert(name)
+        _, table = _decode_inodes(snapshot.inodes, 0, snapshot.inode_count, snapshot.root_ino)
+        structure.remount(table, snapshot.root_ino)
+        # none of the image's inode section describes the new table
+        table.namespace_dirty = True
+        classes.FS_Node.inodes = table
+        classes.FS_Node.generation = next(classes.FS_Node._generations)
+        paths.dcache.invalidate()
+
+        _checkpoint(filename, structure, memory)
+
+
+def open_snapshot(name: str, memory: classes.Memory) -> classes.DirectoryNode:
+    # its tree, read-only, its files read through the blocks it kept
+    snapshot = memory.snapshots.get(name)
+    if snapshot is None:
+        raise ValueError('No such snapshot exists!')
+
+    root, table = _decode_inodes(snapshot.inodes, 0, snapshot.inode_count, snapshot.root_ino)
+    table.read_only = True
+    table.memory = classes.SnapshotView(memory, snapshot)
+    table.names[root.ino] = name
+    return root
+
+
+def _load_image(f, backing_filename: str) -> Tuple[classes.FS_Node | None, classes.Memory | None, int]:
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as image:
+        (magic, version, block_size, total_blocks, total_size, space_used, bitmap_offset,
+         data_offset, inode_offset, inode_count, allocation_offset, allocation_count,
+         journal_seq, root_ino, flags, generation, snapshot_offset,
+         snapshot_count) = SUPERBLOCK.unpack_from(image)
+
+        if version != IMAGE_VERSION or block_size != constants.BLOCK_SIZE:
+            return None, None, 0
+
+        data_length = total_blocks * block_size
+        if flags & FLAG_EXTERNAL_DATA:
+            memory = PagedMemory(total_size, backing_filename, dedup=bool(flags & FLAG_DEDUP))
+        else:
+            # private mapping: pages are read on first touch and writes stay in memory
+            buffer = mmap.mmap(f.fileno(), data_length, offset=data_offset,
+                               access=mmap.ACCESS_COPY) if data_length else bytearray()
+            memory = classes.Memory(total_size, buffer=buffer, dedup=bool(flags & FLAG_DEDUP))
+
+        memory.space_used = space_used
+        memory.free_space.load_bitmap(
+            image[bitmap_offset:bitmap_offset + len(memory.free_space.bitmap_bytes())])
+        _decode_slabs(memory, image, _decode_allocations(memory, image, allocation_offset, allocation_count))
+        memory.generation = generation
+        index_offset = _decode_snapshots(memory, image, snapshot_offset, snapshot_count)
+        if memory.dedup:
+            _decode_index(memory, image, index_offset)
+
+        structure, table = _decode_inodes(image, inode_offset, inode_count, root_ino)
+        classes.FS_Node.inodes = table
+
+    return structure, memory, journal_seq
+
+
+@stats.probe(stats.LOAD, _image_bytes)
+def load_from_file(filename=constants.FILENAME, journal_filename=constants.JOURNAL_FILENAME,
+                   backing_filename=constants.BACKING_FILENAME) -> Tuple[classes.FS_Node | None, classes.Memory | None]:
+    # raises ValueError when the journal can't be replayed, nothing is written then
+    _recover(filename, backing_filename)
     if not os.path.isfile(filename):
-        return None, None
+        if not os.path.isfile(journal_filename):
+            return None, None
+
+        # only images from before main saved new stores right away: the store's
+        # geometry is unknown, the default one is used
+        structure = classes.DirectoryNode('/', datetime.now())
+        memory = classes.Memory()
+        journal.replay(structure, memory, 0, journal_filename)
+        return structure, memory
+
+    with open(filename, 'rb') as f:
+        if f.read(len(IMAGE_MAGIC)) == IMAGE_MAGIC:
+            try:
+                structure, memory, journal_seq = _load_image(f, backing_filename)
+            except (struct.error, ValueError):
+                return None, None
+
+            if structure is not None:
+                _written[filename] = structure.table
+                journal.replay(structure, memory, journal_seq, journal_filename)
+            return structure, memory
 
+    # images from before the binary format were plain JSON
     with open(filename, 'r') as f:
         try:
             data = json.load(f)
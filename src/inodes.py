@@ -0,0 +1,143 @@
+import threading
+from array import array
+from typing import Dict, List, Set
+
+from locks import RWLock
+
+
+class InodeTable:
+    KIND_FREE = 0
+    KIND_DIRECTORY = 1
+    KIND_FILE = 2
+
+    # columns written to the image
+    PERSISTED = ('kind', 'parent', 'size', 'starting_addr', 'date_created', 'date_modified')
+
+    def __init__(self) -> None:
+        # one slot per inode number, parallel typed columns
+        self.kind = array('b')
+        self.parent = array('q')
+        self.size = array('q')
+        self.starting_addr = array('q')
+        # epoch microseconds
+        self.date_created = array('q')
+        self.date_modified = array('q')
+        # None until first use for inodes loaded from an image
+        self.names: List[str] = []
+
+        # image sections kept around for lazy decoding: name bytes and the
+        # child inode numbers of every directory, both indexed by offsets
+        self.name_blob = b''
+        self.name_offsets = array('q', [0])
+        self.child_offsets = array('q', [0])
+        self.child_inos = array('q')
+
+        self.free: List[int] = []
+        # ino -> DirectoryNode, so a parent index can be turned back into a node
+        self.directories: Dict[int, object] = {}
+        # inodes changed since the last checkpoint
+        self.dirty: Set[int] = set()
+        # a name, a parent or a directory's children changed since the last
+        # checkpoint: the image's names and child index are stale, not just rows
+        self.namespace_dirty = False
+
+        # a mounted snapshot's table: nothing in it may change, and its files'
+        # addrs refer to this view of the store instead of the live one
+        self.read_only = False
+        self.memory = None
+
+        # guards slot allocation, lock creation and directory materialization
+        self.mutex = threading.RLock()
+        # ino -> reader/writer lock, created on first use and dropped on release
+        self.locks: Dict[int, RWLock] = {}
+
+    def __len__(self) -> int:
+        return len(self.kind)
+
+    def clear_dirty(self):
+        self.dirty.clear()
+        self.namespace_dirty = False
+
+    def allocate(self, kind: int, name: str, date_created: int, date_modified: int) -> int:
+        with self.mutex:
+            return self._allocate(kind, name, date_created, date_modified)
+
+    def _allocate(self, kind: int, name: str, date_created: int, date_modified: int) -> int:
+        if self.free:
+            ino = self.free.pop()
+            self.kind[ino] = kind
+            self.parent[ino] = -1
+            self.size[ino] = 0
+            self.starting_addr[ino] = -1
+            self.date_created[ino] = date_created
+            self.date_modified[ino] = date_modified
+            self.names[ino] = name
+
+        else:
+            ino = len(self.kind)
+            self.kind.append(kind)
+            self.parent.append(-1)
+            self.size.append(0)
+            self.starting_addr.append(-1)
+            self.date_created.append(date_created)
+            self.date_modified.append(date_modified)
+            self.names.append(name)
+
+        self.dirty.add(ino)
+        self.namespace_dirty = True
+        return ino
+
+    def release(self, ino: int):
+        with self.mutex:
+            self.kind[ino] = self.KIND_FREE
+            self.parent[ino] = -1
+            self.names[ino] = None
+            self.directories.pop(ino, None)
+            # the caller still holds it through its node, a reused number gets a fresh one
+            self.locks.pop(ino, None)
+            self.free.append(ino)
+            self.dirty.add(ino)
+            self.namespace_dirty = True
+
+    def remap_addrs(self, remap: Dict[int, int]):
+        # after the store moved allocations, point every file at its new addr
+        with self.mutex:
+            starting_addr = self.starting_addr
+            for ino in range(len(self.kind)):
+                addr = starting_addr[ino]
+                if addr in remap and self.kind[ino] == self.KIND_FILE:
+                    starting_addr[ino] = remap[addr]
+                    self.dirty.add(ino)
+
+    def lock(self, ino: int) -> RWLock:
+        lock = self.locks.get(ino)
+        if lock is None:
+            with self.mutex:
+                lock = self.locks.setdefault(ino, RWLock())
+
+        return lock
+
+    def name(self, ino: int) -> str:
+        name = self.names[ino]
+        if name is None and self.kind[ino] != self.KIND_FREE:
+            offsets = self.name_offsets
+            name = self.names[ino] = self.name_blob[offsets[ino]:offsets[ino + 1]].decode()
+
+        return name
+
+    def name_bytes(self, ino: int) -> bytes:
+        if self.kind[ino] == self.KIND_FREE:
+            return b''
+
+        name = self.names[ino]
+        if name is None:
+            return self.name_blob[self.name_offsets[ino]:self.name_offsets[ino + 1]]
+
+        return name.encode()
+
+    def loaded_children(self, ino: int):
+        # children recorded in the image for a directory nobody has opened yet
+        if ino + 1 >= len(self.child_offsets):
+            return array('q')
+
+        return self.child_inos[self.child_offsets[ino]:self.child_offsets[ino + 1]]
@@ -0,0 +1,293 @@
+import os
+import struct
+import threading
+import time
+import zlib
+from datetime import datetime
+
+import constants
+import paths
+import utils
+from classes import DirectoryNode, FileNode, FS_Node, Memory
+from paths import resolve_parent
+
+# payload length, crc32 of everything after the crc, sequence number, op
+RECORD = struct.Struct('<IIQB')
+LENGTH = struct.Struct('<I')
+INTEGER = struct.Struct('<q')
+
+OP_CHECKPOINT = 0
+OP_CREATE = 1
+OP_MKDIR = 2
+OP_REMOVE = 3
+OP_MOVE = 4
+OP_WRITE = 5
+OP_APPEND = 6
+OP_MOVE_WITHIN = 7
+OP_TRUNCATE = 8
+OP_WRITE_AT = 9
+
+# s = utf-8 string, b = raw bytes, q = signed 64 bit integer
+OP_FIELDS = {
+    OP_CHECKPOINT: '',
+    OP_CREATE: 'sq',
+    OP_MKDIR: 'sq',
+    OP_REMOVE: 's',
+    OP_MOVE: 'sss',
+    OP_WRITE: 'sbq',
+    OP_APPEND: 'sbq',
+    OP_MOVE_WITHIN: 'sqqqq',
+    OP_TRUNCATE: 'sqq',
+    OP_WRITE_AT: 'sqbq',
+}
+
+
+def _encode(op: int, fields) -> bytes:
+    parts = []
+    for kind, value in zip(OP_FIELDS[op], fields):
+        if kind == 'q':
+            parts.append(INTEGER.pack(value))
+            continue
+
+        if kind == 's':
+            value = value.encode()
+        parts.append(LENGTH.pack(len(value)))
+        parts.append(bytes(value))
+
+    return b''.join(parts)
+
+
+def _decode(op: int, payload: bytes):
+    fields = []
+    offset = 0
+    for kind in OP_FIELDS[op]:
+        if kind == 'q':
+            fields.append(INTEGER.unpack_from(payload, offset)[0])
+            offset += INTEGER.size
+            continue
+
+        length = LENGTH.unpack_from(payload, offset)[0]
+        offset += LENGTH.size
+        value = payload[offset:offset + length]
+        offset += length
+        fields.append(value.decode() if kind == 's' else value)
+
+    return fields
+
+
+def read_records(filename: str = constants.JOURNAL_FILENAME):
+    if not os.path.isfile(filename):
+        return
+
+    with open(filename, 'rb') as f:
+        data = f.read()
+
+    offset = 0
+    while offset + RECORD.size <= len(data):
+        length, crc, seq, op = RECORD.unpack_from(data, offset)
+        end = offset + RECORD.size + length
+        # a torn or corrupt record ends the committed prefix
+        if end > len(data) or op not in OP_FIELDS or \
+                zlib.crc32(data[offset + 8:end]) != crc:
+            return
+
+        yield seq, op, _decode(op, data[offset + RECORD.size:end]), end
+        offset = end
+
+
+class Journal:
+    def __init__(self, filename: str = constants.JOURNAL_FILENAME,
+                 fsync_interval: float = constants.JOURNAL_FSYNC_INTERVAL) -> None:
+        self.filename = filename
+        self.fsync_interval = fsync_interval
+
+        self.seq = 0
+        valid_end = 0
+        for seq, _, _, end in read_records(filename):
+            self.seq, valid_end = seq, end
+
+        self.fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        # drop a torn tail so new records follow the committed prefix
+        os.ftruncate(self.fd, valid_end)
+
+        self.buffer = []
+        self.unsynced = False
+        self.last_fsync = time.monotonic()
+        # fsyncs records left unsynced once the interval is up, an idle
+        # client or server commits nothing that would do it
+        self.flusher: threading.Timer = None
+        # sequence numbers follow the order records enter the buffer
+        self.lock = threading.RLock()
+        # while a transaction is open its records stay in the buffer
+        self.held = False
+
+    def append(self, op: int, *fields):
+        fields = _encode(op, fields)
+        with self.lock:
+            self.seq += 1
+            payload = struct.pack('<QB', self.seq, op) + fields
+            self.buffer.append(RECORD.pack(len(payload) - 9, zlib.crc32(payload), self.seq, op))
+            self.buffer.append(payload[9:])
+
+    def commit(self):
+        with self.lock:
+            if self.held:
+                return
+
+            # group commit: records reach the file on every commit, fsync is batched
+            if self.buffer:
+                os.write(self.fd, b''.join(self.buffer))
+                self.buffer.clear()
+                self.unsynced = True
+
+            if self.unsynced:
+                remaining = self.fsync_interval - (time.monotonic() - self.last_fsync)
+                if remaining <= 0:
+                    self.sync()
+                elif self.flusher is None:
+                    self.flusher = threading.Timer(remaining, self._flush)
+                    self.flusher.daemon = True
+                    self.flusher.start()
+
+    def _flush(self):
+        with self.lock:
+            self.flusher = None
+            if self.unsynced:
+                self.sync()
+
+    def sync(self):
+        with self.lock:
+            if self.buffer and not self.held:
+                os.write(self.fd, b''.join(self.buffer))
+                self.buffer.clear()
+
+            os.fsync(self.fd)
+            self.unsynced = False
+            self.last_fsync = time.monotonic()
+
+    def reset(self):
+        with self.lock:
+            # everything up to self.seq is in the image, keep only the marker
+            self.buffer.clear()
+            os.ftruncate(self.fd, 0)
+            self.seq -= 1
+            self.append(OP_CHECKPOINT)
+            self.sync()
+
+    def hold(self) -> int:
+        # returns the sequence number to go back to if the transaction is dropped
+        with self.lock:
+            self.commit()
+            self.held = True
+            return self.seq
+
+    def release(self):
+        with self.lock:
+            self.held = False
+            self.sync()
+
+    def discard(self, seq: int):
+        with self.lock:
+            self.buffer.clear()
+            self.seq = seq
+            self.held = False
+
+    def close(self):
+        with self.lock:
+            if self.flusher is not None:
+                self.flusher.cancel()
+                self.flusher = None
+
+            self.sync()
+            os.close(self.fd)
+
+
+wal: Journal = None
+
+
+def log(op: int, *fields):
+    if wal is not None:
+        wal.append(op, *fields)
+
+
+def commit():
+    if wal is not None:
+        wal.commit()
+
+
+def _apply(structure: DirectoryNode, memory: Memory, op: int, fields):
+    if op == OP_CREATE or op == OP_MKDIR:
+        path, micros = fields
+        parent, name = resolve_parent(path, structure)
+        date = utils.micros_to_datetime(micros)
+        parent.add_child(FileNode(name, date, date) if op == OP_CREATE
+                         else DirectoryNode(name, date))
+
+    elif op == OP_REMOVE:
+        node = paths.resolve(fields[0], structure)
+        node.parent.remove_child(node)
+        node.release()
+
+    elif op == OP_MOVE:
+        path, new_dir_path, new_name = fields
+        node = paths.resolve(path, structure)
+        new_dir = paths.resolve(new_dir_path, structure)
+
+        old_file = new_dir.get_child(new_name)
+        if old_file:
+            new_dir.remove_child(old_file)
+            old_file.release()
+
+        node.parent.remove_child(node)
+        node.name = new_name
+        new_dir.add_child(node)
+
+    else:
+        file: FileNode = paths.resolve(fields[0], structure)
+        file.date_modified = utils.micros_to_datetime(fields[-1])
+
+        if op == OP_WRITE or op == OP_APPEND or op == OP_WRITE_AT:
+            data = fields[-2]
+            if file.starting_addr < 0:
+                file.starting_addr = memory.allocate(len(data))
+
+            if op == OP_WRITE:
+                file.starting_addr = memory.write_file(file.starting_addr, data)
+                file.size = len(data)
+            elif op == OP_APPEND:
+                file.starting_addr = memory.append_file(file.starting_addr, data)
+                file.size += len(data)
+            else:
+                file.starting_addr = memory.write_at(file.starting_addr, fields[1], data)
+                file.size = max(file.size, fields[1] + len(data))
+
+        elif op == OP_MOVE_WITHIN:
+            # journals from before moves were logged as OP_WRITE_AT
+            file.starting_addr = memory.move_within_file(file.starting_addr, *fields[1:4])
+
+        elif op == OP_TRUNCATE:
+            if file.starting_addr >= 0:
+                memory.truncate(file.starting_addr, fields[1])
+            file.size = fields[1]
+
+
+def replay(structure: DirectoryNode, memory: Memory, after_seq: int = 0,
+           filename: str = constants.JOURNAL_FILENAME) -> int:
+    FS_Node.memory = memory
+    FS_Node.root = structure
+
+    applied = 0
+    for seq, op, fields, _ in read_records(filename):
+        if seq > after_seq and op != OP_CHECKPOINT:
+            try:
+                _apply(structure, memory, op, fields)
+            except (AttributeError, KeyError, ValueError) as error:
+                # the store is too small for what was logged, or the tree doesn't match it
+                raise ValueError(f'Journal record {seq} could not be replayed: {error}') from error
+            applied += 1
+
+    return applied
+
+
+def now_micros() -> int:
+    return utils.datetime_to_micros(datetime.now())
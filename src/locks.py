@@ -0,0 +1,97 @@
+import threading
+from typing import Dict
+
+
+class RWLock:
+    # writer-preferring, reentrant for the thread that holds it, a reader
+    # may upgrade to a writer as long as it is the only one doing so
+
+    def __init__(self) -> None:
+        self._cond = threading.Condition(threading.Lock())
+        # thread id -> read depth
+        self._readers: Dict[int, int] = {}
+        self._writer = None
+        self._write_depth = 0
+        self._waiting_writers = 0
+
+    def acquire_read(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer != me and me not in self._readers:
+                while self._writer is not None or self._waiting_writers:
+                    self._cond.wait()
+
+            self._readers[me] = self._readers.get(me, 0) + 1
+
+    def release_read(self):
+        me = threading.get_ident()
+        with self._cond:
+            depth = self._readers[me] - 1
+            if depth:
+                self._readers[me] = depth
+            else:
+                del self._readers[me]
+                # only writers ever wait for readers to leave
+                if self._waiting_writers:
+                    self._cond.notify_all()
+
+    def acquire_write(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._write_depth += 1
+                return
+
+            self._waiting_writers += 1
+            while self._writer is not None or any(reader != me for reader in self._readers):
+                self._cond.wait()
+            self._waiting_writers -= 1
+
+            self._writer = me
+            self._write_depth = 1
+
+    def release_write(self):
+        with self._cond:
+            self._write_depth -= 1
+            if not self._write_depth:
+                self._writer = None
+                self._cond.notify_all()
+
+    def read(self) -> '_Held':
+        return _Held(self, False)
+
+    def write(self) -> '_Held':
+        return _Held(self, True)
+
+
+class _Held:
+    # with-block for one side of an RWLock, every command takes a few of
+    # these and a generator context manager costs about as much as the lock
+    __slots__ = ('lock', 'write')
+
+    def __init__(self, lock: RWLock, write: bool) -> None:
+        self.lock = lock
+        self.write = write
+
+    def __enter__(self) -> RWLock:
+        if self.write:
+            self.lock.acquire_write()
+        else:
+            self.lock.acquire_read()
+        return self.lock
+
+    def __exit__(self, *exc_info):
+        if self.write:
+            self.lock.release_write()
+        else:
+            self.lock.release_read()
+
+
+# Lock order: fs_lock, rename_lock, directory locks (parent before child,
+# lower inode first among siblings), file locks, then the short internal
+# mutexes (inode table, allocator, page cache, dentry cache, journal).
+
+# shared by every command, exclusive for checkpoints so they see a quiet tree
+fs_lock = RWLock()
+# serializes renames, so two moves can't race each other into a cycle
+rename_lock = threading.Lock()
@@ -1,31 +1,95 @@
+import argparse
 import signal
+import sys
 from datetime import datetime
 
+import constants
 import file_io
+import journal
+import stats
 from classes import DirectoryNode, FS_Node, Memory
-from menu import display_menu, exit_program, user_input
+from menu import display_menu, exit_program, run_script, user_input
+from pagecache import PagedMemory
+from server import serve
 
 root: DirectoryNode = None
 memory: Memory = None
 
 
+def parse_args():
+    parser = argparse.ArgumentParser()
+    # only used when there is no image yet, an existing one keeps its own store
+    parser.add_argument('--paged', action='store_true',
+                        help=f'keep blocks in {constants.BACKING_FILENAME} behind a page cache')
+    parser.add_argument('--size', type=int, default=constants.TOTAL_MEMORY_SIZE,
+                        help='store size in bytes')
+    parser.add_argument('--dedup', action='store_true',
+                        help='share blocks with identical content between files')
+    parser.add_argument('--cache-pages', type=int, default=constants.PAGE_CACHE_PAGES,
+                        help=f'pages of {constants.PAGE_SIZE} bytes the page cache keeps in memory')
+
+    parser.add_argument('--serve', action='store_true',
+                        help='serve the filesystem to network clients instead of reading commands')
+    parser.add_argument('--host', default=constants.SERVER_HOST)
+    parser.add_argument('--port', type=int, default=constants.SERVER_PORT)
+    parser.add_argument('--unix', metavar='PATH', help='listen on a unix socket instead of tcp')
+
+    parser.add_argument('--stats', action='store_true',
+                        help='time and count operations from startup, see the stats command')
+
+    parser.add_argument('--script', metavar='FILE',
+                        help='run the commands in FILE (- for stdin) instead of prompting')
+    parser.add_argument('--atomic', action='store_true',
+                        help='with --script, roll every command back if one fails')
+    return parser.parse_args()
+
+
 def main():
     global root, memory
 
-    root, memory = file_io.load_from_file()
+    args = parse_args()
+    if args.stats:
+        stats.enable()
+
+    try:
+        root, memory = file_io.load_from_file()
+    except ValueError as error:
+        # the image and the journal are left as they are
+        print(f'Cannot load {constants.FILENAME}: {error}', file=sys.stderr)
+        sys.exit(1)
 
     if not root or not memory:
         root = DirectoryNode('/', datetime.now())
-        memory = Memory()
+        memory = PagedMemory(args.size, cache_pages=args.cache_pages, dedup=args.dedup) if args.paged \
+            else Memory(args.size, dedup=args.dedup)
+        # the store's geometry and flags reach the disk before any journal
+        # record, a crash before the first checkpoint replays into the same store
+        file_io.save_to_file(structure=root, memory=memory)
 
     FS_Node.memory = memory
+    FS_Node.root = root
+    journal.wal = journal.Journal()
+
+    if args.serve:
+        serve(root, memory, args.host, args.port, args.unix)
+        return
+
+    if args.script:
+        script = sys.stdin if args.script == '-' else open(args.script, encoding='utf-8')
+        outfile = open(sys.stdout.fileno(), 'w', buffering=constants.SCRIPT_OUTPUT_BUFFER,
+                       encoding='utf-8', closefd=False)
+        with script, outfile:
+            failed = run_script(script, outfile, args.atomic)
+
+        # a rolled back transaction reloads the tree
+        exit_program(FS_Node.root, FS_Node.memory, 1 if failed else 0)
 
     display_menu()
     user_input(root, memory)
 
 
 def handle_sigint(sig, frame):
-    exit_program(root, memory)
+    exit_program(FS_Node.root, FS_Node.memory)
 
 
 if __name__ == '__main__':
@@ -1,378 +1,946 @@
+import codecs
+import shlex
+import sys
 import time
+from contextlib import nullcontext
 from datetime import datetime
 from typing import List
 
+import constants
 import file_io
+import journal
+import locks
+import paths
+import stats
 from classes import DirectoryNode, FS_Node, FileNode, Memory
-from utils import bytes_to_string, split_strip, string_to_bytes
+from pagecache import PagedMemory
+from paths import dcache, mount, mounts, resolve_parent, unmount, unmount_all
+from session import OpenFile, Session, live_sessions
+from utils import bytes_to_string, datetime_to_micros, micros_to_datetime, string_to_bytes
 
 menu = {
     'help': 'Display this menu',
 
-    'touch <filename>': 'Create a new file',
-    'rm <filename | dirname>': 'Remove a file',
-    'mkdir <dirname>': 'Create a new directory',
+    'touch <path>': 'Create a new file',
+    'rm <path>': 'Remove a file or directory',
+    'mkdir <path>': 'Create a new directory',
     'cd <path>': 'Change directory',
-    'mv <in filename | dirname> <out filename | dirname>': 'Move a file or directory',
+    'mv <in path> <out path | dirname>': 'Move a file or directory',
 
-    'open <filename> <mode (r, w, a )>': 'Open a file',
-    'wf <filename> <content>': 'Write to a file',
-    'af <filename> <content>': 'Append to a file',
-    'mwf <filename> <starting byte> <content length> <writing byte>': 'Move content within a file',
-    'close <filename>': 'Close a file',
+    'open <filename> <mode (r, w, a )>': 'Open a file and print its file descriptor',
+    'wf <fd | filename> <content>': 'Write to a file',
+    'af <fd | filename> <content>': 'Append to a file',
+    'mwf <fd | filename> <starting byte> <content length> <writing byte>': 'Move content within a file',
+    'trunc <fd | filename> <size>': 'Truncate a file and release its spare space',
+    'close <fd | filename>': 'Close a file descriptor, or every descriptor open on a file',
 
-    'cat <filename>': 'Read from a file',
-    'rf <filename> <starting byte> <content length>': 'Read from a file from a specific byte',
+    'cat <fd | filename>': 'Read from a file',
+    'rf <fd | filename> <starting byte> <content length>': 'Read from a file from a specific byte',
+    'import <host path> <fd | filename>': 'Replace a file with the contents of a host file',
+    'export <fd | filename> <host path>': 'Copy a file out to the host',
+
+    'read <fd> [length]': 'Read from the descriptor offset onwards',
+    'write <fd> <content>': 'Write at the descriptor offset',
+    'seek <fd> <offset> [set | cur | end]': 'Move the descriptor offset',
 
     'mmap': 'Display memory map',
+    'stats [on | off | reset]': 'Show operation counts, latencies and allocator state',
+    'sync': 'Checkpoint changes to the storage image',
+    'defrag': 'Move every file into one contiguous run and checkpoint',
+
+    'snapshot [list]': 'List snapshots and the bytes deleting each would free',
+    'snapshot create <name>': 'Freeze the whole filesystem, blocks are copied only once written',
+    'snapshot <mount | umount> <name>': f'Show or hide a snapshot read-only under /{constants.SNAPSHOT_DIR}/<name>',
+    'snapshot delete <name>': 'Delete a snapshot and free the blocks only it used',
+    'snapshot restore <name>': 'Roll the whole filesystem back to the newest snapshot',
 
-    'ls <path>': 'List files and directories',
+    'ls [path]': 'List files and directories',
     'exit': 'Exit the program'
 }
 
 
-def display_menu():
-    print('---------- Available Commands ----------')
+def display_menu(outfile=sys.stdout):
+    print('---------- Available Commands ----------', file=outfile)
     for key, value in menu.items():
-        print(f'-- {key}  :  {value}')
+        print(f'-- {key}  :  {value}', file=outfile)
 
-    print('----------------------------------------')
+    print('----------------------------------------', file=outfile)
 
 
 def user_input(root: DirectoryNode, memory: Memory):
-
-    currentDir = root
+    session = Session(root)
+    last_checkpoint = time.monotonic()
 
     while True:
+        if time.monotonic() - last_checkpoint >= constants.CHECKPOINT_INTERVAL:
+            file_io.checkpoint(structure=FS_Node.root, memory=FS_Node.memory)
+            last_checkpoint = time.monotonic()
+
         command = input('Enter the command: ').strip()
+        if command == 'sync':
+            last_checkpoint = time.monotonic()
+
+        if not run_command(session, command):
+            exit_program(FS_Node.root, FS_Node.memory)
+
+
+def run_script(lines, outfile=sys.stdout, atomic: bool = False) -> int:
+    # batch mode: one command per line, blank lines and # comments are skipped,
+    # begin / commit / rollback bracket all-or-nothing transactions and atomic
+    # makes the whole script one; returns the number of failed commands
+    session = Session(FS_Node.root, outfile)
+    transaction = _begin(session) if atomic else None
+    aborted = False
+    pending = 0
+    last_checkpoint = time.monotonic()
+
+    for line in lines:
+        command = line.strip()
+        if not command or command.startswith('#'):
+            continue
+
+        if command in ('begin', 'commit', 'rollback'):
+            if command == 'begin' and transaction is None and not aborted:
+                transaction = _begin(session)
+            elif command == 'commit' and transaction is not None:
+                _commit(transaction)
+                transaction = None
+                print('Transaction committed!', file=outfile)
+            elif command == 'rollback' and transaction is not None:
+                _rollback(session, transaction)
+                transaction = None
+            elif command != 'begin' and aborted:
+                # closes a transaction a failed command already rolled back
+                aborted = False
+            else:
+                _error(session, 'Invalid transaction command!')
+            continue
+
+        if aborted:
+            continue
+
+        name = command.partition(' ')[0]
+        if transaction is not None and name in ('sync', 'defrag', 'snapshot'):
+            # all write the image, which a rollback goes back to
+            _error(session, f'Cannot {name} inside a transaction!')
+            continue
+
+        if name.startswith('exit'):
+            break
+
+        # already stripped, and committed per chunk below
+        errors = session.errors
+        _execute(session, command)
+
+        if transaction is not None and session.errors > errors:
+            _rollback(session, transaction)
+            transaction = None
+            aborted = True
+            continue
+
+        # group commit per chunk of commands instead of per command
+        pending += 1
+        if pending >= constants.SCRIPT_COMMIT_EVERY:
+            journal.commit()
+            pending = 0
+
+        if transaction is None and time.monotonic() - last_checkpoint >= constants.CHECKPOINT_INTERVAL:
+            journal.commit()
+            file_io.checkpoint(structure=FS_Node.root, memory=FS_Node.memory)
+            last_checkpoint = time.monotonic()
+
+    if transaction is not None:
+        if atomic:
+            _commit(transaction)
+            print('Transaction committed!', file=outfile)
+        else:
+            # begin without commit
+            _rollback(session, transaction)
 
-        if command == 'help':
-            display_menu()
+    journal.commit()
+    return session.errors
 
-        elif command.startswith('exit'):
-            exit_program(root, memory)
 
-        elif command.startswith('touch'):
-            _, filename = split_strip(command, ' ')
-            touch(currentDir, filename)
+def _begin(session: Session):
+    # the transaction owns the filesystem until it ends, it starts from a
+    # checkpoint so rolling back is reloading the image
+    locks.fs_lock.acquire_write()
+    file_io.checkpoint(structure=FS_Node.root, memory=FS_Node.memory)
 
-        elif command.startswith('mkdir'):
-            _, dirname = split_strip(command, ' ')
-            mkdir(currentDir, dirname)
+    # a paged store's changes stay in its cache and spill file until a
+    # checkpoint, of which there is none before the transaction ends
+    seq = journal.wal.hold() if journal.wal else 0
+    return seq, session.cwd.get_path()
 
-        elif command.startswith('ls'):
-            if command == 'ls':
-                currentDir.print_directory_structure()
 
-            else:
-                _, path = command.split(' ')
-                ls(currentDir, path)
+def _commit(transaction):
+    if journal.wal:
+        journal.wal.release()
+    locks.fs_lock.release_write()
+
+
+def _rollback(session: Session, transaction):
+    seq, cwd = transaction
+    if journal.wal:
+        journal.wal.discard(seq)
 
-        elif command.startswith('rm'):
-            _, name = split_strip(command, ' ')
-            remove(currentDir, name)
+    if isinstance(FS_Node.memory, PagedMemory):
+        FS_Node.memory.discard()
+
+    root, memory = file_io.load_from_file()
+    FS_Node.root, FS_Node.memory = root, memory
+    dcache.invalidate()
+    # mounted snapshots read through the dropped store
+    unmount_all()
 
-        elif command.startswith('mv'):
-            _, name, destination = split_strip(command, ' ')
-            move(currentDir, name, destination)
+    # handles and the working directory pointed into the dropped tree
+    _reset(session, cwd, root)
 
-        elif command.startswith('cd'):
-            _, path = split_strip(command, ' ')
+    locks.fs_lock.release_write()
+    print('Transaction rolled back!', file=session.outfile)
 
-            currentDir = change_dir(currentDir, path)
 
-        elif command.startswith('wf'):
-            segments = split_strip(command, ' ')
-            filename = segments[1]
-            content = ' '.join(segments[2:])
+def _reset(session: Session, cwd: str, root: DirectoryNode):
+    session.close_all()
+    node = paths.resolve(cwd, root)
+    session.cwd = node if isinstance(node, DirectoryNode) else root
 
-            write_file(currentDir, filename, content)
 
-        elif command.startswith('af'):
-            segments = split_strip(command, ' ')
-            filename = segments[1]
-            content = ' '.join(segments[2:])
+def run_command(session: Session, command: str, commit: bool = True) -> bool:
+    # returns False once the client asked to leave
+    command = command.strip()
+    if command.startswith('exit'):
+        return False
 
-            append_file(currentDir, filename, content)
+    _execute(session, command)
+    if commit:
+        journal.commit()
+    return True
 
-        elif command.startswith('mwf'):
-            segments = split_strip(command, ' ')
-            filename = segments[1]
-            starting_byte = int(segments[2])
-            content_length = int(segments[3])
-            writing_byte = int(segments[4])
 
-            move_within_file(currentDir, filename, starting_byte,
-                             content_length, writing_byte)
+def _execute(session: Session, command: str):
+    # one stripped command, the exit check and the commit are the caller's
+    if command == 'sync':
+        # outside fs_lock, the checkpoint takes it exclusively
+        file_io.checkpoint(structure=FS_Node.root, memory=FS_Node.memory)
+        print('Checkpoint written!', file=session.outfile)
 
-        elif command.startswith('cat'):
-            _, filename = split_strip(command, ' ')
+    elif command == 'defrag':
+        # outside fs_lock as well, compaction takes it exclusively
+        defrag(session)
 
-            display_file(currentDir, filename)
+    elif command.partition(' ')[0] == 'snapshot':
+        # outside fs_lock too, all but list, mount and umount take it exclusively
+        try:
+            handler, args = parse(command)
+            handler(session, *args)
+        except (ValueError, IndexError):
+            _error(session, 'Invalid command!')
 
-        elif command.startswith('rf'):
-            segments = split_strip(command, ' ')
-            filename = segments[1]
-            starting_byte = int(segments[2])
-            content_length = int(segments[3])
+    elif command:
+        try:
+            handler, args = parse(command)
 
-            display_file(currentDir, filename, starting_byte, content_length)
+            # shared with other commands, checkpoints take it exclusively
+            with locks.fs_lock.read():
+                handler(session, *args)
+        except (ValueError, IndexError):
+            # unknown command, wrong number or type of arguments
+            _error(session, 'Invalid command!')
 
-        elif command.startswith('open'):
-            segments = split_strip(command, ' ')
-            filename = segments[1]
-            mode = segments[2]
 
-            open_file(currentDir, filename, mode)
+def split_args(text: str, count: int, rest: bool) -> List[str]:
+    # shell-style words, with rest the last of count arguments is the remainder
+    # of the line as typed, so content keeps its spacing and apostrophes
+    quoted = '"' in text or "'" in text or '\\' in text
+    if not rest:
+        return shlex.split(text) if quoted else text.split()
 
-        elif command.startswith('close'):
-            _, filename = split_strip(command, ' ')
+    if not quoted:
+        return text.split(None, count - 1)
 
-            close_file(currentDir, filename)
+    lexer = shlex.shlex(text, posix=True)
+    lexer.whitespace_split = True
+    lexer.commenters = ''
 
-        elif command.startswith('mmap'):
-            memory.show_memory_map()
-            memory.show_memory_layout()
+    args = []
+    while len(args) < count - 1:
+        token = lexer.get_token()
+        if token is None:
+            return args
+        args.append(token)
 
-        else:
-            print('Invalid command!')
+    remainder = lexer.instream.read().lstrip()
+    if remainder[:1] in ('"', "'"):
+        # a single quoted word is taken without its quotes
+        words = shlex.split(remainder)
+        if len(words) == 1:
+            remainder = words[0]
 
+    if remainder:
+        args.append(remainder)
+    return args
 
-def touch(currentDir, name: str):
-    if currentDir.get_child(name):
-        print('File already exists!')
 
-    else:
-        new_file = currentDir.add_child(FileNode(name, datetime.now()))
-        print('File has been created successfully!')
-        return new_file
+def parse(command: str):
+    # -> handler and converted arguments, ValueError for anything malformed
+    name, _, text = command.partition(' ')
+    if name not in COMMANDS:
+        raise ValueError(name)
 
+    handler, kinds, required = COMMANDS[name]
+    args = split_args(text, len(kinds), kinds.endswith('r'))
+    if not required <= len(args) <= len(kinds):
+        raise ValueError(command)
 
-def remove(currentDir, name):
-    if currentDir.get_child(name):
-        child = currentDir.get_child(name)
-        currentDir.remove_child(child)
-        print('Deleted successfully!')
+    return handler, [int(arg) if kind == 'i' else arg for kind, arg in zip(kinds, args)]
 
-    else:
-        print('No such file or directory exists!')
 
+def _error(session: Session, message):
+    session.errors += 1
+    print(message, file=session.outfile)
+
+
+def _read_only(session: Session, node: FS_Node) -> bool:
+    # nodes of a mounted snapshot
+    if node.table.read_only:
+        _error(session, 'Snapshots are read-only!')
+        return True
+
+    return False
+
+
+def help_menu(session: Session):
+    display_menu(session.outfile)
+
+
+def show_memory(session: Session):
+    FS_Node.memory.show_memory_map(session.outfile)
+    FS_Node.memory.show_memory_layout(session.outfile)
+
+
+def touch(session, path: str):
+    generation = FS_Node.generation
+    parent, name = resolve_parent(path, session.cwd)
+
+    if not parent:
+        _error(session, 'No such directory exists!')
+        return
+
+    if _read_only(session, parent):
+        return
+
+    # check and insert under one lock, or two creators could both succeed
+    with parent.lock.write():
+        if parent.ino is None:
+            _error(session, 'No such directory exists!')
+            return
+
+        if parent.get_child(name):
+            _error(session, 'File already exists!')
+            return
+
+        new_file = parent.add_child(FileNode(name, datetime.now()))
+        journal.log(journal.OP_CREATE, new_file.get_path(),
+                    datetime_to_micros(new_file.date_created))
+        paths.remember(path, session.cwd, new_file, generation)
+
+    print('File has been created successfully!', file=session.outfile)
+    return new_file
+
+
+def remove(session, path):
+    child = paths.resolve(path, session.cwd)
+    parent = child.parent if child else None
+
+    if not parent:
+        _error(session, 'No such file or directory exists!')
+        return
+
+    if _read_only(session, parent):
+        return
+
+    with parent.lock.write():
+        if parent.ino is None or parent.get_child(child.name) is not child:
+            _error(session, 'No such file or directory exists!')
+            return
+
+        journal.log(journal.OP_REMOVE, child.get_path())
+        parent.remove_child(child)
+
+    child.release()
+    print('Deleted successfully!', file=session.outfile)
+
+
+def mkdir(session, path: str):
+    generation = FS_Node.generation
+    parent, name = resolve_parent(path, session.cwd)
+
+    if not parent:
+        _error(session, 'No such directory exists!')
+        return
+
+    if _read_only(session, parent):
+        return
 
-def mkdir(currentDir, name: str):
-    if currentDir.get_child(name):
-        print('Directory already exists!')
+    with parent.lock.write():
+        if parent.ino is None:
+            _error(session, 'No such directory exists!')
+            return
+
+        if parent.get_child(name):
+            _error(session, 'Directory already exists!')
+            return
 
+        new_dir = parent.add_child(DirectoryNode(name, datetime.now()))
+        journal.log(journal.OP_MKDIR, new_dir.get_path(),
+                    datetime_to_micros(new_dir.date_created))
+        paths.remember(path, session.cwd, new_dir, generation)
+
+    print('Directory has been created successfully!', file=session.outfile)
+    return new_dir
+
+
+def ls(session, path='.'):
+    node = paths.resolve(path, session.cwd)
+
+    if node:
+        node.print_directory_structure(outfile=session.outfile)
     else:
-        new_dir = currentDir.add_child(DirectoryNode(name, datetime.now()))
-        print('Directory has been created successfully!')
-        return new_dir
+        _error(session, 'No such path exists!')
 
 
-def ls(currentDir, path):
-    if path == '..':
-        if currentDir.parent:
-            currentDir.parent.print_directory_structure()
-        else:
-            print('No such path exists!')
+def move(session, path, new_path):
+    child = paths.resolve(path, session.cwd)
 
+    if not child or not child.parent:
+        _error(session, 'No such file or directory exists!')
+        return
+
+    target = paths.resolve(new_path, session.cwd)
+    if isinstance(target, DirectoryNode):
+        new_dir, new_name = target, child.name
     else:
-        if currentDir.get_child(path):
-            currentDir.get_child(path).print_directory_structure()
-        else:
-            print('No such path exists!')
+        new_dir, new_name = resolve_parent(new_path, session.cwd)
 
+    if not new_dir:
+        _error(session, 'No such directory exists!')
+        return
 
-def move(currentDir, name, new_name):
-    if currentDir.get_child(name):
-        child = currentDir.get_child(name)
+    if _read_only(session, child) or _read_only(session, new_dir):
+        return
 
-        if '/' in new_name:
-            dir, file = new_name.split('/')
-            new_dir = currentDir.get_child(dir)
-            currentDir.remove_child(child)
-            new_dir.add_child(child)
+    with locks.rename_lock:
+        old_dir = child.parent
+        if old_dir is None:
+            _error(session, 'No such file or directory exists!')
+            return
 
-            if currentDir.get_child(file):
-                old_file = currentDir.get_child(file)
-                currentDir.remove_child(old_file)
-                del old_file
+        ancestor = new_dir
+        while ancestor:
+            if ancestor is child:
+                _error(session, 'Cannot move a directory into itself!')
+                return
+            ancestor = ancestor.parent
 
-            child.name = file
+        # both directories, always in inode order
+        first, second = (sorted((old_dir, new_dir), key=lambda d: d.ino)
+                         if old_dir is not new_dir else (old_dir, None))
+        with first.lock.write():
+            with second.lock.write() if second else nullcontext():
+                old_file = new_dir.get_child(new_name)
+                # only a file replaces a file, a move never releases a subtree
+                if old_file is not None and old_file is not child:
+                    if isinstance(old_file, DirectoryNode):
+                        _error(session, 'A directory with that name already exists!')
+                        return
 
-        else:
+                    if isinstance(child, DirectoryNode):
+                        _error(session, 'Cannot replace a file with a directory!')
+                        return
 
-            if isinstance(currentDir.get_child(new_name), DirectoryNode):
-                new_dir = currentDir.get_child(new_name)
-                currentDir.remove_child(child)
-                new_dir.add_child(child)
+                if old_file is not child:
+                    journal.log(journal.OP_MOVE, child.get_path(), new_dir.get_path(), new_name)
 
-            else:
-                if currentDir.get_child(new_name):
-                    old_file = currentDir.get_child(new_name)
-                    currentDir.remove_child(old_file)
-                    del old_file
+                    if old_file:
+                        new_dir.remove_child(old_file)
+                        old_file.release()
 
-                child.name = new_name
+                    # entries are keyed by name, rename before re-inserting
+                    old_dir.remove_child(child)
+                    child.name = new_name
+                    new_dir.add_child(child)
 
-        print('Moved successfully!')
+    print('Moved successfully!', file=session.outfile)
 
-    else:
-        print('No such file or directory exists!')
 
+def change_dir(session, path):
+    node = paths.resolve(path, session.cwd)
 
-def change_dir(currentDir, path):
-    if path == '..':
-        return currentDir.parent if currentDir.parent else currentDir
+    if isinstance(node, DirectoryNode):
+        session.cwd = node
+        return node
 
-    elif currentDir.get_child(path):
-        return currentDir.get_child(path)
+    _error(session, "No such directory exists")
+    return session.cwd
 
-    print("No such directory exists")
-    return currentDir
 
+def _handle(session: Session, target: str, modes, error: str) -> OpenFile:
+    # an fd, or else the first handle this session has open on the path in one of modes
+    if target.isdigit() and int(target) in session.fds:
+        handle = session.fds[int(target)]
+    else:
+        file = paths.resolve(target, session.cwd)
+        if not file or not isinstance(file, FileNode):
+            _error(session, 'No such file exists!')
+            return None
 
-def write_file(currentDir: DirectoryNode, filename: str, content: List[str]):
-    memory = FS_Node.memory
+        handle = next((session.fds[fd] for fd in session.handles(file)
+                       if session.fds[fd].mode in modes), None)
 
-    file: FileNode = currentDir.get_child(filename)
+    if handle is None or handle.mode not in modes:
+        _error(session, error)
+        return None
 
-    if not file or not isinstance(file, FileNode):
-        print('No such file exists!')
+    return handle
+
+
+def write_file(session: Session, target: str, content: str = ''):
+    memory = FS_Node.memory
+    handle = _handle(session, target, (FileNode.MODE_WRITE,), 'File is not open in write mode!')
+    if not handle:
         return
 
-    if file.state == FileNode.STATE_OPEN and file.mode == FileNode.MODE_WRITE:
+    file = handle.file
+    with file.lock.write():
+        if file.ino is None:
+            _error(session, 'No such file exists!')
+            return
+
         content_bytes = string_to_bytes(content)
         if file.starting_addr < 0 and file.size == 0:
             try:
                 file.starting_addr = memory.allocate(len(content_bytes))
-                file.size = len(content)
             except ValueError:
-                print('Not enough memory!')
+                _error(session, 'Not enough memory!')
                 return
 
         file.starting_addr = memory.write_file(
             file.starting_addr, content_bytes)
 
+        file.size = len(content_bytes)
         file.date_modified = datetime.now()
-        print('File written successfully!')
+        journal.log(journal.OP_WRITE, file.get_path(), content_bytes,
+                    datetime_to_micros(file.date_modified))
 
-    else:
-        print('File is not open in write mode!')
+    print('File written successfully!', file=session.outfile)
 
 
-def append_file(currentDir: DirectoryNode, filename: str, new_content: List[str]):
+def append_file(session: Session, target: str, new_content: str = ''):
     memory = FS_Node.memory
-    file: FileNode = currentDir.get_child(filename)
-
-    if not file or not isinstance(file, FileNode):
-        print('No such file exists!')
+    handle = _handle(session, target, (FileNode.MODE_APPEND,), 'File is not open in append mode!')
+    if not handle:
         return
 
-    if file.state == FileNode.STATE_OPEN and file.mode == FileNode.MODE_APPEND:
+    file = handle.file
+    with file.lock.write():
+        if file.ino is None:
+            _error(session, 'No such file exists!')
+            return
+
         new_content_bytes = string_to_bytes(new_content)
         if file.starting_addr < 0 and file.size == 0:
             try:
                 file.starting_addr = memory.allocate(len(new_content_bytes))
             except ValueError:
-                print('Not enough memory!')
+                _error(session, 'Not enough memory!')
                 return
 
         file.starting_addr = memory.append_file(
             file.starting_addr, new_content_bytes)
 
-        file.size += len(new_content)
+        file.size += len(new_content_bytes)
         file.date_modified = datetime.now()
-        print('File appended successfully!')
+        journal.log(journal.OP_APPEND, file.get_path(), new_content_bytes,
+                    datetime_to_micros(file.date_modified))
 
-    else:
-        print('File is not open in append mode!')
+    print('File appended successfully!', file=session.outfile)
 
 
-def move_within_file(currentDir: DirectoryNode, filename: str, starting_byte: int, content_length: int, writing_byte: int):
+def move_within_file(session: Session, target: str, starting_byte: int, content_length: int, writing_byte: int):
     memory = FS_Node.memory
-    file: FileNode = currentDir.get_child(filename)
-
-    if not file or not isinstance(file, FileNode):
-        print('No such file exists!')
+    handle = _handle(session, target, (FileNode.MODE_WRITE,), 'File is not open in write mode!')
+    if not handle:
         return
 
-    if file.state == FileNode.STATE_OPEN and file.mode == FileNode.MODE_WRITE:
+    file = handle.file
+    with file.lock.write():
+        if file.ino is None:
+            _error(session, 'No such file exists!')
+            return
+
         if file.starting_addr < 0 and file.size == 0:
-            print('File is empty!')
+            _error(session, 'File is empty!')
             return
 
         if starting_byte + content_length > file.size:
-            print('Invalid starting byte and content length!')
+            _error(session, 'Invalid starting byte and content length!')
             return
 
         if writing_byte > file.size:
-            print('Invalid writing byte!')
+            _error(session, 'Invalid writing byte!')
             return
 
         file.starting_addr = memory.move_within_file(
             file.starting_addr, starting_byte, content_length, writing_byte)
 
+        # logged as the bytes it left behind: replay starts from the last
+        # checkpoint's blocks and a move is not safe to redo over them
         file.date_modified = datetime.now()
-        print('File moved successfully!')
+        if journal.wal:
+            end = min(writing_byte + content_length, file.size)
+            journal.log(journal.OP_WRITE_AT, file.get_path(), writing_byte,
+                        bytes(memory.read_file(file.starting_addr, writing_byte, max(0, end - writing_byte))),
+                        datetime_to_micros(file.date_modified))
+
+    print('File moved successfully!', file=session.outfile)
 
 
-def display_file(currentDir: DirectoryNode, filename: str, starting_byte: int = 0, content_length: int = -1):
+def truncate_file(session: Session, target: str, size: int):
     memory = FS_Node.memory
-    file: FileNode = currentDir.get_child(filename)
+    handle = _handle(session, target, (FileNode.MODE_WRITE,), 'File is not open in write mode!')
+    if not handle:
+        return
 
-    if not file or not isinstance(file, FileNode):
-        print('No such file exists!')
+    file = handle.file
+    with file.lock.write():
+        if file.ino is None:
+            _error(session, 'No such file exists!')
+            return
+
+        if size < 0 or size > file.size:
+            _error(session, 'Invalid size!')
+            return
+
+        if file.starting_addr >= 0:
+            memory.truncate(file.starting_addr, size)
+
+        file.size = size
+        file.date_modified = datetime.now()
+        journal.log(journal.OP_TRUNCATE, file.get_path(), size,
+                    datetime_to_micros(file.date_modified))
+
+    print('File truncated successfully!', file=session.outfile)
+
+
+def display_file(session: Session, target: str, starting_byte: int = 0, content_length: int = -1):
+    handle = _handle(session, target, (FileNode.MODE_READ, FileNode.MODE_WRITE),
+                     'File is not open in read mode!')
+    if not handle:
         return
 
-    if file.state == FileNode.STATE_OPEN and file.mode == FileNode.MODE_WRITE:
-        if file.starting_addr < 0 and file.size == 0:
-            print()
+    file = handle.file
+    # readers of the same file run in parallel
+    with file.lock.read():
+        if file.ino is None:
+            _error(session, 'No such file exists!')
             return
 
-        content = bytes_to_string(
-            memory.read_file(
-                file.starting_addr,
-                starting_byte=starting_byte,
-                num_bytes=file.size if content_length == -1 else content_length)
-        )
+        if content_length == -1:
+            content_length = max(0, file.size - starting_byte)
 
-        print(content)
+        if starting_byte < 0 or content_length < 0 or starting_byte + content_length > file.size:
+            _error(session, 'Invalid starting byte and content length!')
+            return
 
-    else:
-        print('File is not open in read mode!')
+        # streamed: a character split across chunks is decoded once whole
+        decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        for chunk in file.iter_chunks(starting_byte, content_length):
+            session.outfile.write(decoder.decode(chunk))
 
+    print(decoder.decode(b'', final=True), file=session.outfile)
 
-def open_file(currentDir: DirectoryNode, filename: str, mode: str):
-    file: FileNode = currentDir.get_child(filename)
 
-    if not file or not isinstance(file, FileNode):
-        print('No such file exists!')
+def import_file(session: Session, host_path: str, target: str):
+    handle = _handle(session, target, (FileNode.MODE_WRITE,), 'File is not open in write mode!')
+    if not handle:
         return
 
-    if mode in [FileNode.MODE_NONE, FileNode.MODE_READ, FileNode.MODE_WRITE, FileNode.MODE_APPEND]:
-        file.mode = mode
-        file.state = FileNode.STATE_OPEN
-        print('File opened successfully!')
-    else:
-        print('Invalid mode!')
+    if not session.host_files:
+        _error(session, 'Host files are not available to this session!')
+        return
+
+    try:
+        host = open(host_path, 'rb')
+    except OSError as error:
+        _error(session, f'Cannot read {host_path}: {error.strerror}!')
+        return
+
+    memory = FS_Node.memory
+    file = handle.file
+    with host, file.lock.write():
+        if file.ino is None:
+            _error(session, 'No such file exists!')
+            return
+
+        path = file.get_path()
+        file.date_modified = datetime.now()
+        micros = datetime_to_micros(file.date_modified)
+        if file.size:
+            memory.truncate(file.starting_addr, 0)
+            file.size = 0
+            journal.log(journal.OP_TRUNCATE, path, 0, micros)
+
+        def chunks():
+            # one record per chunk, logged once the chunk is in the store
+            offset = 0
+            for chunk in iter(lambda: host.read(constants.STREAM_CHUNK_SIZE), b''):
+                yield chunk
+                journal.log(journal.OP_WRITE_AT, path, offset, chunk, micros)
+                journal.commit()
+                offset += len(chunk)
+
+        try:
+            written = file.write_chunks(chunks())
+        except ValueError:
+            # the chunks written so far are in the file and the journal
+            memory.shrink_to_fit(file.starting_addr)
+            _error(session, f'Not enough memory, {file.size} bytes imported!')
+            return
+
+        memory.shrink_to_fit(file.starting_addr)
 
+    print(f'{written} bytes imported!', file=session.outfile)
+
+
+def export_file(session: Session, target: str, host_path: str):
+    handle = _handle(session, target, (FileNode.MODE_READ, FileNode.MODE_WRITE),
+                     'File is not open in read mode!')
+    if not handle:
+        return
 
-def close_file(currentDir: DirectoryNode, filename: str):
-    file: FileNode = currentDir.get_child(filename)
+    if not session.host_files:
+        _error(session, 'Host files are not available to this session!')
+        return
+
+    try:
+        host = open(host_path, 'wb')
+    except OSError as error:
+        _error(session, f'Cannot write {host_path}: {error.strerror}!')
+        return
+
+    file = handle.file
+    with host, file.lock.read():
+        if file.ino is None:
+            _error(session, 'No such file exists!')
+            return
+
+        for chunk in file.iter_chunks():
+            host.write(chunk)
+        written = file.size
+
+    print(f'{written} bytes exported!', file=session.outfile)
+
+
+def open_file(session: Session, filename: str, mode: str):
+    file: FileNode = paths.resolve(filename, session.cwd)
 
     if not file or not isinstance(file, FileNode):
-        print('No such file exists!')
+        _error(session, 'No such file exists!')
+        return
+
+    if mode not in OpenFile.MODES:
+        _error(session, 'Invalid mode!')
+        return
+
+    if mode != FileNode.MODE_READ and _read_only(session, file):
         return
 
-    if file.state == FileNode.STATE_OPEN:
-        file.state = FileNode.STATE_CLOSED
-        print('File closed successfully!')
+    fd = session.open(file, mode)
+    print(f'File opened successfully! fd: {fd}', file=session.outfile)
+    return fd
+
+
+def close_file(session: Session, target: str):
+    # an fd closes one handle, a path closes every handle on that file
+    if target.isdigit() and int(target) in session.fds:
+        fds = [int(target)]
     else:
-        print('File is not open!')
+        file = paths.resolve(target, session.cwd)
+        if not file or not isinstance(file, FileNode):
+            _error(session, 'No such file exists!')
+            return
+
+        fds = session.handles(file)
+
+    if not fds:
+        _error(session, 'File is not open!')
+        return
+
+    for fd in fds:
+        session.close(fd)
+
+    print('File closed successfully!', file=session.outfile)
+
+
+def read_fd(session: Session, fd: int, num_bytes: int = -1):
+    try:
+        data = session.read(fd, num_bytes)
+    except ValueError as error:
+        _error(session, error)
+        return
+
+    print(bytes_to_string(data), file=session.outfile)
+
+
+def write_fd(session: Session, fd: int, content: str = ''):
+    try:
+        written = session.write(fd, string_to_bytes(content))
+    except ValueError as error:
+        _error(session, error)
+        return
+
+    print(f'{written} bytes written!', file=session.outfile)
+
+
+def seek_fd(session: Session, fd: int, offset: int, whence: str = 'set'):
+    whences = {'set': Session.SEEK_SET, 'cur': Session.SEEK_CUR, 'end': Session.SEEK_END}
+
+    try:
+        position = session.seek(fd, offset, whences.get(whence, -1))
+    except ValueError as error:
+        _error(session, error)
+        return
+
+    print(f'Offset: {position}', file=session.outfile)
+
+
+def show_stats(session: Session, action: str = None):
+    if action == 'on':
+        stats.enable()
+    elif action == 'off':
+        stats.disable()
+    elif action == 'reset':
+        stats.reset()
+    elif action is not None:
+        _error(session, 'Invalid command!')
+        return
+
+    stats.show(FS_Node.memory, session.outfile)
+
+
+def defrag(session: Session):
+    try:
+        report = file_io.compact(structure=FS_Node.root, memory=FS_Node.memory)
+    except ValueError as error:
+        _error(session, f'{error}!')
+        return
+
+    print(f"Moved {report['bytes_moved']} bytes, "
+          f"extents: {report['runs_before']} -> {report['runs_after']}, "
+          f"fragmentation: {report['fragmentation_before']:.2%} -> {report['fragmentation_after']:.2%}",
+          file=session.outfile)
+
+
+def snapshot(session: Session, action: str = 'list', name: str = None):
+    if action == 'list':
+        with locks.fs_lock.read():
+            list_snapshots(session)
+        return
+
+    if not name or '/' in name or name in ('.', '..'):
+        _error(session, 'Invalid snapshot name!')
+        return
 
+    try:
+        if action == 'create':
+            file_io.snapshot(name, structure=FS_Node.root, memory=FS_Node.memory)
+            print(f'Snapshot {name} created!', file=session.outfile)
+
+        elif action == 'delete':
+            freed = file_io.delete_snapshot(name, structure=FS_Node.root, memory=FS_Node.memory)
+            print(f'Snapshot {name} deleted, {freed} bytes freed!', file=session.outfile)
+
+        elif action == 'restore':
+            # every session's handles and working directory point into the old
+            # tree, they all move over before another command can run
+            with locks.fs_lock.write():
+                cwds = [(other, other.cwd.get_path() if other.cwd.ino is not None else '/')
+                        for other in live_sessions()]
+                file_io.restore_snapshot(name, structure=FS_Node.root, memory=FS_Node.memory)
+                for other, cwd in cwds:
+                    _reset(other, cwd, FS_Node.root)
+            print(f'Restored snapshot {name}!', file=session.outfile)
+
+        elif action == 'mount':
+            with locks.fs_lock.read():
+                if not mount(file_io.open_snapshot(name, FS_Node.memory)):
+                    _error(session, 'Snapshot is already mounted!')
+                    return
+            print(f'Mounted at /{constants.SNAPSHOT_DIR}/{name}', file=session.outfile)
+
+        elif action == 'umount':
+            with locks.fs_lock.read():
+                if not unmount(name):
+                    _error(session, 'Snapshot is not mounted!')
+                    return
+            print('Unmounted successfully!', file=session.outfile)
 
-def exit_program(structure: DirectoryNode, memory: Memory):
+        else:
+            _error(session, 'Invalid command!')
+
+    except ValueError as error:
+        _error(session, error)
+
+
+def list_snapshots(session: Session):
+    memory = FS_Node.memory
+    if not memory.snapshots:
+        print('No snapshots', file=session.outfile)
+        return
+
+    for name, frozen in memory.snapshots.items():
+        mounted = ', mounted' if name in mounts.entries else ''
+        print(f'{name}  {micros_to_datetime(frozen.created)}  {len(frozen.allocations)} allocations, '
+              f'{memory.exclusive_bytes(name)} bytes only here{mounted}', file=session.outfile)
+
+
+def exit_program(structure: DirectoryNode, memory: Memory, status: int = 0):
     print('Persisting data...')
 
-    file_io.save_to_file(structure=structure, memory=memory)
-    exit(0)
+    file_io.checkpoint(structure=structure, memory=memory)
+    exit(status)
+
+
+# name -> handler, its arguments and how many are required; kinds are
+# s = word, i = integer, r = rest of the line
+COMMANDS = {
+    'help': (help_menu, '', 0),
+    'touch': (touch, 's', 1),
+    'rm': (remove, 's', 1),
+    'mkdir': (mkdir, 's', 1),
+    'cd': (change_dir, 's', 1),
+    'mv': (move, 'ss', 2),
+    'ls': (ls, 's', 0),
+
+    'open': (open_file, 'ss', 2),
+    'wf': (write_file, 'sr', 1),
+    'af': (append_file, 'sr', 1),
+    'mwf': (move_within_file, 'siii', 4),
+    'trunc': (truncate_file, 'si', 2),
+    'close': (close_file, 's', 1),
+
+    'import': (import_file, 'ss', 2),
+    'export': (export_file, 'ss', 2),
+
+    'cat': (display_file, 's', 1),
+    'rf': (display_file, 'sii', 3),
+
+    'read': (read_fd, 'ii', 1),
+    'write': (write_fd, 'ir', 1),
+    'seek': (seek_fd, 'iis', 2),
+
+    'mmap': (show_memory, '', 0),
+    'stats': (show_stats, 's', 0),
+    'snapshot': (snapshot, 'ss', 0),
+}
@@ -0,0 +1,200 @@
+import os
+import sys
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Callable, Set
+
+import constants
+import journal
+from allocator import FreeSpaceManager
+from classes import Memory
+
+
+class PageCache:
+    # the backing file only ever holds what the last checkpoint wrote, dirty
+    # pages evicted before it go to a private spill file instead: replay after
+    # a crash starts from the checkpoint and must not find later bytes there
+
+    def __init__(self, fd: int, page_size: int = constants.PAGE_SIZE,
+                 capacity: int = constants.PAGE_CACHE_PAGES, before_writeback: Callable = None,
+                 spill_dir: str = None) -> None:
+        if capacity < 1:
+            raise ValueError('Page cache needs room for at least one page')
+
+        self.fd = fd
+        self.spill = tempfile.TemporaryFile(dir=spill_dir)
+        self.page_size = page_size
+        self.capacity = capacity
+        self.before_writeback = before_writeback
+
+        # page number -> page, least recently used first
+        self.pages: OrderedDict = OrderedDict()
+        self.dirty: Set[int] = set()
+        # changed pages that were evicted, at their own offset in the spill file
+        self.spilled: Set[int] = set()
+        # one lock for the whole cache, held across the pread/pwrite calls
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.writebacks = 0
+
+    def _page(self, page_no: int) -> bytearray:
+        page = self.pages.get(page_no)
+        if page is not None:
+            self.pages.move_to_end(page_no)
+            self.hits += 1
+            return page
+
+        self.misses += 1
+        page = bytearray(self.page_size)
+        if page_no in self.spilled:
+            # changed since the backing file was written, so dirty again
+            data = os.pread(self.spill.fileno(), self.page_size, page_no * self.page_size)
+            self.spilled.discard(page_no)
+            self.dirty.add(page_no)
+        else:
+            data = os.pread(self.fd, self.page_size, page_no * self.page_size)
+        page[:len(data)] = data
+
+        self.pages[page_no] = page
+        if len(self.pages) > self.capacity:
+            self._evict()
+
+        return page
+
+    def _evict(self):
+        page_no, page = self.pages.popitem(last=False)
+        self.evictions += 1
+        if page_no in self.dirty:
+            os.pwrite(self.spill.fileno(), page, page_no * self.page_size)
+            self.dirty.discard(page_no)
+            self.spilled.add(page_no)
+
+    def read(self, start: int, length: int) -> bytes:
+        chunks = []
+        with self.lock:
+            while length > 0:
+                page_no, offset = divmod(start, self.page_size)
+                chunk = min(self.page_size - offset, length)
+                chunks.append(self._page(page_no)[offset:offset + chunk])
+                start += chunk
+                length -= chunk
+
+        return b''.join(chunks)
+
+    def write(self, start: int, data):
+        data = memoryview(data)
+        written = 0
+        with self.lock:
+            while written < len(data):
+                page_no, offset = divmod(start + written, self.page_size)
+                chunk = min(self.page_size - offset, len(data) - written)
+                self._page(page_no)[offset:offset + chunk] = data[written:written + chunk]
+                self.dirty.add(page_no)
+                written += chunk
+
+    def pending(self):
+        # (offset, page) of every page the backing file doesn't have yet
+        with self.lock:
+            pages = [(page_no * self.page_size, bytes(self.pages[page_no])) for page_no in self.dirty]
+            pages += [(page_no * self.page_size, os.pread(self.spill.fileno(), self.page_size,
+                                                          page_no * self.page_size))
+                      for page_no in self.spilled]
+
+        return sorted(pages)
+
+    def written(self):
+        # the pages pending() returned are in the backing file now
+        with self.lock:
+            self.writebacks += len(self.dirty) + len(self.spilled)
+            self.dirty.clear()
+            self.spilled.clear()
+
+    def flush(self):
+        # straight into the backing file, for a store without an image;
+        # checkpoints write pending() through the image's redo file instead
+        pages = self.pending()
+        if pages and self.before_writeback:
+            self.before_writeback()
+
+        for offset, page in pages:
+            os.pwrite(self.fd, page, offset)
+        os.fsync(self.fd)
+        self.written()
+
+    def discard(self):
+        with self.lock:
+            self.pages.clear()
+            self.dirty.clear()
+            self.spilled.clear()
+
+    def close(self):
+        self.spill.close()
+
+    def stats(self):
+        accesses = self.hits + self.misses
+        return {
+            'resident_pages': len(self.pages),
+            'dirty_pages': len(self.dirty),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'writebacks': self.writebacks,
+            'hit_rate': self.hits / accesses if accesses else 0.0,
+        }
+
+
+def _sync_journal():
+    # write-ahead: no page reaches the backing file before its records
+    if journal.wal is not None and (journal.wal.buffer or journal.wal.unsynced):
+        journal.wal.sync()
+
+
+class PagedMemory(Memory):
+    # the store lives in a host file, only cache_pages pages of it are in RAM
+
+    def __init__(self, total_size=constants.TOTAL_MEMORY_SIZE, filename: str = constants.BACKING_FILENAME,
+                 cache_pages: int = constants.PAGE_CACHE_PAGES, free_space: FreeSpaceManager = None,
+                 dedup: bool = False) -> None:
+        self.filename = filename
+        self.cache_pages = cache_pages
+        super().__init__(total_size, free_space, dedup=dedup)
+
+    def _attach(self, buffer):
+        self.fd = os.open(self.filename, os.O_RDWR | os.O_CREAT, 0o644)
+        size = self.total_blocks * constants.BLOCK_SIZE
+        if os.fstat(self.fd).st_size < size:
+            # sparse, untouched blocks take no space on the host
+            os.ftruncate(self.fd, size)
+
+        self.cache = PageCache(self.fd, constants.PAGE_SIZE, self.cache_pages, _sync_journal,
+                               os.path.dirname(os.path.abspath(self.filename)))
+
+    def _load(self, start: int, length: int):
+        return self.cache.read(start, length)
+
+    def _store(self, start: int, data):
+        self.cache.write(start, data)
+
+    def flush(self):
+        self.cache.flush()
+
+    def close(self):
+        self.flush()
+        self.cache.close()
+        os.close(self.fd)
+
+    def discard(self):
+        # drops every unwritten change, the backing file keeps its last flushed state
+        self.cache.discard()
+        self.cache.close()
+        os.close(self.fd)
+
+    def show_memory_map(self, outfile=sys.stdout):
+        super().show_memory_map(outfile)
+        stats = self.cache.stats()
+        print(
+            f"Page Cache: {stats['resident_pages']}/{self.cache.capacity} pages, Dirty: {stats['dirty_pages']}, Hits: {stats['hits']}, Misses: {stats['misses']}, Hit Rate: {stats['hit_rate']:.2%}, Evictions: {stats['evictions']}, Writebacks: {stats['writebacks']}", file=outfile)
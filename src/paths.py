@@ -0,0 +1,167 @@
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import List, Tuple
+
+import constants
+import stats
+from classes import DirectoryNode, FS_Node
+from inodes import InodeTable
+
+
+class DentryCache:
+    def __init__(self, capacity: int = constants.DENTRY_CACHE_SIZE) -> None:
+        self.capacity = capacity
+        # (id(base), path) -> (base, node), least recently used first
+        self.entries: OrderedDict = OrderedDict()
+        self.generation = FS_Node.generation
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def _check_generation(self):
+        # caller holds self.lock
+        if self.generation != FS_Node.generation:
+            self.entries.clear()
+            self.generation = FS_Node.generation
+
+    def get(self, base: FS_Node, path: str):
+        with self.lock:
+            self._check_generation()
+
+            key = (id(base), path)
+            entry = self.entries.get(key)
+            if entry is None or entry[0] is not base:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, base: FS_Node, path: str, node: FS_Node, generation: int = None):
+        with self.lock:
+            # a lookup that raced with an unlink must not cache its result
+            if generation is not None and generation != FS_Node.generation:
+                return
+
+            key = (id(base), path)
+            self.entries[key] = (base, node)
+            self.entries.move_to_end(key)
+
+            if len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+
+    def invalidate(self):
+        with self.lock:
+            self.entries.clear()
+            self.generation = FS_Node.generation
+
+
+dcache = DentryCache()
+
+# holds the root of every mounted snapshot, each still in its own table
+mounts = DirectoryNode(constants.SNAPSHOT_DIR, datetime.now(), table=InodeTable())
+mounts.table.read_only = True
+
+
+def mount(root: DirectoryNode) -> bool:
+    with mounts.lock.write():
+        if root.name in mounts.entries:
+            return False
+
+        # not add_child: the root's parent stays unset in its own table
+        mounts.entries[root.name] = root
+        return True
+
+
+def unmount(name: str) -> bool:
+    with mounts.lock.write():
+        root = mounts.entries.get(name)
+        if root is None:
+            return False
+
+        mounts.remove_child(root)
+        return True
+
+
+def unmount_all():
+    for root in mounts.children:
+        unmount(root.name)
+
+
+def split_path(path: str) -> Tuple[bool, List[str]]:
+    components = [c for c in path.split('/') if c and c != '.']
+    return path.startswith('/'), components
+
+
+def _root(cwd: FS_Node) -> FS_Node:
+    if FS_Node.root is not None:
+        return FS_Node.root
+
+    while cwd.parent:
+        cwd = cwd.parent
+    return cwd
+
+
+@stats.probe(stats.LOOKUP)
+def resolve(path: str, cwd: FS_Node):
+    absolute, components = split_path(path)
+    base = _root(cwd) if absolute else cwd
+
+    if components and components[0] == constants.SNAPSHOT_DIR and base is _root(cwd):
+        base, components = mounts, components[1:]
+
+    if not components:
+        return base
+
+    generation = FS_Node.generation
+    node = dcache.get(base, '/'.join(components))
+    if node is not None:
+        return node
+
+    # resume from the longest prefix that is still cached
+    node, start = base, 0
+    for i in range(len(components) - 1, 0, -1):
+        cached = dcache.get(base, '/'.join(components[:i]))
+        if cached is not None:
+            node, start = cached, i
+            break
+
+    for i in range(start, len(components)):
+        if not isinstance(node, DirectoryNode):
+            return None
+
+        name = components[i]
+        if name == '..':
+            node = node.parent or node
+        else:
+            node = node.get_child(name)
+            if node is None:
+                return None
+
+        dcache.put(base, '/'.join(components[:i + 1]), node, generation)
+
+    return node
+
+
+def remember(path: str, cwd: FS_Node, node: FS_Node, generation: int):
+    # caches a node just created at path, scripts use a new name right after
+    # creating it and would otherwise miss on every one
+    absolute, components = split_path(path)
+    base = _root(cwd) if absolute else cwd
+    if components and components[0] != constants.SNAPSHOT_DIR:
+        dcache.put(base, '/'.join(components), node, generation)
+
+
+def resolve_parent(path: str, cwd: FS_Node):
+    absolute, components = split_path(path)
+    if not components or components[-1] == '..':
+        return None, None
+
+    parent = resolve(('/' if absolute else '') + '/'.join(components[:-1]), cwd)
+    if not isinstance(parent, DirectoryNode):
+        return None, components[-1]
+
+    return parent, components[-1]
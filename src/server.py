@@ -0,0 +1,131 @@
+import asyncio
+import io
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from typing import Tuple
+
+import constants
+import file_io
+from classes import DirectoryNode, Memory
+from menu import run_command
+from session import Session
+
+# every request and response: 4 byte big-endian length, then utf-8 text
+FRAME = struct.Struct('>I')
+
+
+async def read_frame(reader: asyncio.StreamReader) -> bytes:
+    # None once the peer is gone
+    try:
+        length = FRAME.unpack(await reader.readexactly(FRAME.size))[0]
+        if length > constants.SERVER_MAX_FRAME:
+            raise ValueError(f'Frame of {length} bytes is too large')
+
+        return await reader.readexactly(length)
+
+    except asyncio.IncompleteReadError:
+        return None
+
+
+def write_frame(writer: asyncio.StreamWriter, payload: bytes):
+    writer.write(FRAME.pack(len(payload)) + payload)
+
+
+class Server:
+    def __init__(self, root: DirectoryNode, memory: Memory, workers: int = constants.SERVER_WORKERS,
+                 pipeline_depth: int = constants.SERVER_PIPELINE_DEPTH) -> None:
+        self.root = root
+        self.memory = memory
+        # commands block on filesystem locks, keep them off the event loop
+        self.executor = ThreadPoolExecutor(workers)
+        self.pipeline_depth = pipeline_depth
+        self.clients = 0
+
+    def _execute(self, session: Session, command: str) -> Tuple[bytes, bool]:
+        session.outfile = io.StringIO()
+        keep_open = run_command(session, command)
+        return session.outfile.getvalue().encode(), keep_open
+
+    async def _receive(self, reader: asyncio.StreamReader, queue: asyncio.Queue):
+        try:
+            while True:
+                frame = await read_frame(reader)
+                # blocks once the client is pipeline_depth requests ahead,
+                # so the socket buffer fills and TCP pushes back on it
+                await queue.put(frame)
+                if frame is None:
+                    return
+
+        except (ConnectionError, ValueError):
+            await queue.put(None)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        loop = asyncio.get_running_loop()
+        # remote clients never get at the server's own files
+        session = Session(self.root, host_files=False)
+        queue = asyncio.Queue(self.pipeline_depth)
+        receiver = asyncio.create_task(self._receive(reader, queue))
+        self.clients += 1
+
+        try:
+            while True:
+                frame = await queue.get()
+                if frame is None:
+                    break
+
+                command = frame.decode(errors='replace').strip()
+                # pipelined requests run one at a time, so responses keep their order
+                output, keep_open = await loop.run_in_executor(
+                    self.executor, self._execute, session, command)
+
+                write_frame(writer, output)
+                await writer.drain()
+
+                if not keep_open:
+                    break
+
+        except ConnectionError:
+            pass
+
+        finally:
+            self.clients -= 1
+            receiver.cancel()
+            session.close_all()
+            writer.close()
+
+    async def _checkpoints(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(constants.CHECKPOINT_INTERVAL)
+            await loop.run_in_executor(
+                self.executor, lambda: file_io.checkpoint(structure=self.root, memory=self.memory))
+
+            # background defragmentation once free space has broken up enough,
+            # snapshots pin their blocks where they are
+            if (not self.memory.snapshots and self.memory.free_space.stats()['fragmentation']
+                    >= constants.COMPACT_FRAGMENTATION):
+                await loop.run_in_executor(
+                    self.executor, lambda: file_io.compact(structure=self.root, memory=self.memory))
+
+    async def serve(self, host: str = constants.SERVER_HOST, port: int = constants.SERVER_PORT,
+                    unix_path: str = None):
+        if unix_path:
+            server = await asyncio.start_unix_server(self.handle, unix_path)
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+
+        addresses = ', '.join(str(sock.getsockname()) for sock in server.sockets)
+        print(f'Serving on {addresses}')
+
+        checkpoints = asyncio.create_task(self._checkpoints())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            checkpoints.cancel()
+            self.executor.shutdown()
+
+
+def serve(root: DirectoryNode, memory: Memory, host: str = constants.SERVER_HOST,
+          port: int = constants.SERVER_PORT, unix_path: str = None):
+    asyncio.run(Server(root, memory).serve(host, port, unix_path))
@@ -0,0 +1,164 @@
+import heapq
+import sys
+import threading
+import weakref
+from datetime import datetime
+from typing import Dict, List
+
+import journal
+from classes import DirectoryNode, FileNode, FS_Node
+from utils import datetime_to_micros
+
+
+class OpenFile:
+    # one open() of a file: the node, how it was opened and where the cursor is
+    __slots__ = ('file', 'mode', 'offset')
+
+    MODES = (FileNode.MODE_READ, FileNode.MODE_WRITE, FileNode.MODE_APPEND)
+
+    def __init__(self, file: FileNode, mode: str) -> None:
+        self.file = file
+        self.mode = mode
+        self.offset = 0
+
+    @property
+    def readable(self) -> bool:
+        return self.mode in (FileNode.MODE_READ, FileNode.MODE_WRITE)
+
+    @property
+    def writable(self) -> bool:
+        return self.mode in (FileNode.MODE_WRITE, FileNode.MODE_APPEND)
+
+
+# every session still in use, a snapshot restore moves them all to the new tree
+_sessions = weakref.WeakSet()
+_sessions_lock = threading.Lock()
+
+
+def live_sessions() -> List['Session']:
+    with _sessions_lock:
+        return list(_sessions)
+
+
+class Session:
+    SEEK_SET = 0
+    SEEK_CUR = 1
+    SEEK_END = 2
+
+    # per-client state: working directory, open-file table and where output goes
+    def __init__(self, cwd: DirectoryNode, outfile=sys.stdout, host_files: bool = True) -> None:
+        self.cwd = cwd
+        self.outfile = outfile
+        # whether import / export may touch files on the host
+        self.host_files = host_files
+        # commands that printed an error, batches use it to spot a failure
+        self.errors = 0
+
+        # fd -> handle, the lowest closed fd is handed out first
+        self.fds: Dict[int, OpenFile] = {}
+        self._free_fds: List[int] = []
+        # id(file) -> its fds in open order, close looks them up on every command
+        self._by_file: Dict[int, List[int]] = {}
+
+        with _sessions_lock:
+            _sessions.add(self)
+
+    def open(self, file: FileNode, mode: str) -> int:
+        if mode not in OpenFile.MODES:
+            raise ValueError('Invalid mode!')
+
+        fd = heapq.heappop(self._free_fds) if self._free_fds else len(self.fds)
+        self.fds[fd] = OpenFile(file, mode)
+        self._by_file.setdefault(id(file), []).append(fd)
+        return fd
+
+    def handle(self, fd: int) -> OpenFile:
+        handle = self.fds.get(fd)
+        if handle is None:
+            raise ValueError('Bad file descriptor!')
+
+        if handle.file.ino is None:
+            raise ValueError('File no longer exists!')
+
+        return handle
+
+    def handles(self, file: FileNode) -> List[int]:
+        return list(self._by_file.get(id(file), ()))
+
+    def close(self, fd: int):
+        handle = self.fds.pop(fd, None)
+        if handle is None:
+            raise ValueError('Bad file descriptor!')
+
+        fds = self._by_file[id(handle.file)]
+        fds.remove(fd)
+        if not fds:
+            del self._by_file[id(handle.file)]
+        heapq.heappush(self._free_fds, fd)
+
+    def close_all(self):
+        self.fds.clear()
+        self._free_fds.clear()
+        self._by_file.clear()
+
+    def seek(self, fd: int, offset: int, whence: int = SEEK_SET) -> int:
+        handle = self.handle(fd)
+
+        if whence == self.SEEK_CUR:
+            offset += handle.offset
+        elif whence == self.SEEK_END:
+            offset += handle.file.size
+        elif whence != self.SEEK_SET:
+            raise ValueError('Invalid whence!')
+
+        if offset < 0:
+            raise ValueError('Invalid offset!')
+
+        handle.offset = offset
+        return offset
+
+    def read(self, fd: int, num_bytes: int = -1) -> bytes:
+        handle = self.handle(fd)
+        if not handle.readable:
+            raise ValueError('File is not open in read mode!')
+
+        file = handle.file
+        with file.lock.read():
+            if file.ino is None:
+                raise ValueError('File no longer exists!')
+
+            remaining = max(0, file.size - handle.offset)
+            num_bytes = remaining if num_bytes < 0 else min(num_bytes, remaining)
+            if num_bytes == 0:
+                return b''
+
+            data = bytes(file.store.read_file(file.starting_addr, handle.offset, num_bytes))
+
+        handle.offset += num_bytes
+        return data
+
+    def write(self, fd: int, data: bytes) -> int:
+        handle = self.handle(fd)
+        if not handle.writable:
+            raise ValueError('File is not open in write mode!')
+
+        memory = FS_Node.memory
+        file = handle.file
+        with file.lock.write():
+            if file.ino is None:
+                raise ValueError('File no longer exists!')
+
+            if handle.mode == FileNode.MODE_APPEND:
+                handle.offset = file.size
+
+            if file.starting_addr < 0:
+                file.starting_addr = memory.allocate(handle.offset + len(data))
+
+            file.starting_addr = memory.write_at(file.starting_addr, handle.offset, data)
+            file.size = max(file.size, handle.offset + len(data))
+            file.date_modified = datetime.now()
+            journal.log(journal.OP_WRITE_AT, file.get_path(), handle.offset, data,
+                        datetime_to_micros(file.date_modified))
+
+        handle.offset += len(data)
+        return len(data)
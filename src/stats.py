@@ -0,0 +1,212 @@
+import functools
+import sys
+import threading
+import time
+
+import constants
+
+ALLOCATE = 'allocate'
+DEALLOCATE = 'deallocate'
+REALLOCATE = 'reallocate'
+READ = 'read'
+WRITE = 'write'
+APPEND = 'append'
+LOOKUP = 'lookup'
+SAVE = 'save'
+CHECKPOINT = 'checkpoint'
+LOAD = 'load'
+COMPACT = 'compact'
+
+OPS = (ALLOCATE, DEALLOCATE, REALLOCATE, READ, WRITE, APPEND, LOOKUP, SAVE, CHECKPOINT, LOAD, COMPACT)
+
+# latencies go in power-of-two buckets: bucket i holds [2 ** (i - 1), 2 ** i) ns
+BUCKETS = 64
+
+enabled = constants.STATS_ENABLED
+
+# (owner, name, plain, timed) of every probed function, enable and disable
+# install one or the other, so a disabled probe costs nothing at all
+_probes = []
+
+
+class OpStats:
+    __slots__ = ('count', 'total_ns', 'max_ns', 'bytes', 'histogram')
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        self.bytes = 0
+        self.histogram = [0] * BUCKETS
+
+    def merge(self, other: 'OpStats'):
+        self.count += other.count
+        self.total_ns += other.total_ns
+        self.max_ns = max(self.max_ns, other.max_ns)
+        self.bytes += other.bytes
+        self.histogram = [mine + theirs for mine, theirs in zip(self.histogram, other.histogram)]
+
+    def percentile_ns(self, percentile: float) -> int:
+        # upper bound of the bucket the percentile falls in
+        rank = self.count * percentile / 100
+        seen = 0
+        for bucket, count in enumerate(self.histogram):
+            seen += count
+            if count and seen >= rank:
+                return min(2 ** bucket, self.max_ns)
+
+        return self.max_ns
+
+
+# every thread records into its own table, snapshot merges them, so the
+# hot path takes no lock
+_local = threading.local()
+_tables = []
+_lock = threading.Lock()
+
+
+def _table():
+    table = _local.table = {op: OpStats() for op in OPS}
+    with _lock:
+        _tables.append(table)
+    return table
+
+
+def _install():
+    for owner, name, plain, timed in _probes:
+        setattr(owner, name, timed if enabled else plain)
+
+
+def enable():
+    global enabled
+    enabled = True
+    _install()
+
+
+def disable():
+    global enabled
+    enabled = False
+    _install()
+
+
+def reset():
+    with _lock:
+        for table in _tables:
+            for op in OPS:
+                table[op] = OpStats()
+
+
+def record(op: str, elapsed_ns: int, nbytes: int = 0):
+    try:
+        entry = _local.table[op]
+    except AttributeError:
+        entry = _table()[op]
+
+    entry.count += 1
+    entry.total_ns += elapsed_ns
+    entry.bytes += nbytes
+    if elapsed_ns > entry.max_ns:
+        entry.max_ns = elapsed_ns
+    entry.histogram[elapsed_ns.bit_length()] += 1
+
+
+class _Probe:
+    # a probed method until its class exists, which it then registers with
+    __slots__ = ('plain', 'timed')
+
+    def __init__(self, plain, timed) -> None:
+        self.plain = plain
+        self.timed = timed
+
+    def __set_name__(self, owner, name):
+        _probes.append((owner, name, self.plain, self.timed))
+        setattr(owner, name, self.timed if enabled else self.plain)
+
+
+def probe(op: str, nbytes=None):
+    # times every call of the decorated function into op while stats are on,
+    # nbytes(args, kwargs, result) gives the bytes the call copied; callers
+    # must look module functions up through their module, a name imported
+    # from it keeps whichever version was installed at the time
+    def decorator(function):
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            started = time.perf_counter_ns()
+            result = function(*args, **kwargs)
+            record(op, time.perf_counter_ns() - started, nbytes(args, kwargs, result) if nbytes else 0)
+            return result
+
+        if '.' in function.__qualname__:
+            return _Probe(function, timed)
+
+        _probes.append((sys.modules[function.__module__], function.__name__, function, timed))
+        return timed if enabled else function
+
+    return decorator
+
+
+def snapshot(memory=None):
+    # plain dicts, safe to serialize or diff between two calls
+    merged = {op: OpStats() for op in OPS}
+    with _lock:
+        for table in _tables:
+            for op in OPS:
+                merged[op].merge(table[op])
+
+    ops = {}
+    for op, entry in merged.items():
+        if not entry.count:
+            continue
+
+        ops[op] = {
+            'count': entry.count,
+            'bytes': entry.bytes,
+            'total_ms': entry.total_ns / 1e6,
+            'mean_us': entry.total_ns / entry.count / 1e3,
+            'p50_us': entry.percentile_ns(50) / 1e3,
+            'p99_us': entry.percentile_ns(99) / 1e3,
+            'max_us': entry.max_ns / 1e3,
+            # bucket upper bound in ns -> calls
+            'histogram': {2 ** bucket: count for bucket, count in enumerate(entry.histogram) if count},
+        }
+
+    result = {'enabled': enabled, 'ops': ops}
+    if memory is not None:
+        allocator = memory.free_space.stats()
+        allocator.update(memory.slabs.stats())
+        allocator['allocations'] = len(memory.allocations)
+        allocator['space_used'] = memory.space_used
+        allocator['total_size'] = memory.total_size
+        result['allocator'] = allocator
+
+        cache = getattr(memory, 'cache', None)
+        if cache is not None:
+            result['page_cache'] = cache.stats()
+
+    return result
+
+
+def show(memory=None, outfile=sys.stdout):
+    data = snapshot(memory)
+    print(f"Stats: {'enabled' if data['enabled'] else 'disabled'}", file=outfile)
+
+    if data['ops']:
+        print(f"{'op':<11}{'count':>10}{'bytes':>14}{'mean us':>10}{'p50 us':>10}{'p99 us':>10}{'max us':>10}",
+              file=outfile)
+        for op, entry in data['ops'].items():
+            print(f"{op:<11}{entry['count']:>10}{entry['bytes']:>14}{entry['mean_us']:>10.1f}"
+                  f"{entry['p50_us']:>10.1f}{entry['p99_us']:>10.1f}{entry['max_us']:>10.1f}", file=outfile)
+
+    allocator = data.get('allocator')
+    if allocator:
+        print(f"Allocator: {allocator['allocations']} allocations, {allocator['space_used']}/"
+              f"{allocator['total_size']} bytes reserved, {allocator['free_blocks']} free blocks in "
+              f"{allocator['free_extents']} extents, largest {allocator['largest_free_extent']}, "
+              f"fragmentation {allocator['fragmentation']:.2%}, {allocator['slab_slots']} slots in "
+              f"{allocator['slab_blocks']} slab blocks", file=outfile)
+
+    cache = data.get('page_cache')
+    if cache:
+        print(f"Page cache: {cache['resident_pages']} pages ({cache['dirty_pages']} dirty), "
+              f"hit rate {cache['hit_rate']:.2%}, {cache['evictions']} evictions, "
+              f"{cache['writebacks']} writebacks", file=outfile)
@@ -1,6 +1,13 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import List
 
+import constants
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 class TColors:
     HEADER = '\033[95m'
@@ -14,18 +21,49 @@ class TColors:
     UNDERLINE = '\033[4m'
 
 
-def string_to_bytes(string):
-    return list([ord(char) for char in string])
+def string_to_bytes(string: str) -> bytes:
+    return string.encode('utf-8')
+
+
+def bytes_to_string(data) -> str:
+    # any buffer works, a memoryview into the store is decoded without a copy;
+    # a range that splits a character decodes to U+FFFD instead of failing
+    return str(data, 'utf-8', 'replace')
+
+
+def to_buffer(data):
+    # bytes-like objects pass through, text is utf-8, anything else is a
+    # sequence of byte values (older saves and callers still use lists)
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return data
+
+    if isinstance(data, str):
+        return string_to_bytes(data)
 
+    if numpy is not None and len(data) >= constants.NUMPY_MIN_BYTES:
+        values = numpy.asarray(data)
+        if values.size and (values.min() < 0 or values.max() > 255):
+            raise ValueError('bytes must be in range(0, 256)')
+        return values.astype(numpy.uint8).tobytes()
 
-def bytes_to_string(bytes):
-    return ''.join([chr(byte) for byte in bytes])
+    return bytes(data)
 
 
 def get_datetime_object(date_string: str):
     return datetime.strptime(date_string, '%Y-%m-%d %H:%M:%S.%f')
 
 
+EPOCH = datetime(1970, 1, 1)
+
+
+def datetime_to_micros(date: datetime) -> int:
+    return (date - EPOCH) // timedelta(microseconds=1)
+
+
+def micros_to_datetime(micros: int) -> datetime:
+    return EPOCH + timedelta(microseconds=micros)
+
+
 def split_strip(string: str, separator: str, num: int = -1) -> List[str]:
     ret = [s for s in string.split(separator) if s]
     if num != -1:
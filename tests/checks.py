@@ -0,0 +1,34 @@
+from classes import Memory
+
+
+def check_memory(memory: Memory):
+    # every block is free, a slab block, held for a snapshot, or used by
+    # allocations that agree with the refs of blocks more than one uses
+    owners = {block: 'slab' for block in memory.slabs.slot_size}
+    slots = 0
+    for addr, runs in memory.extents.items():
+        if memory.is_slab(addr):
+            block = runs[0][0]
+            assert runs == [(block, 1)] and memory.slabs.slot_size[block] == memory.allocations[addr]
+            slots += 1
+            continue
+
+        for start, length in runs:
+            for block in range(start, start + length):
+                assert not memory.free_space.is_free(block), f'block {block} of {addr} is free'
+                assert owners.get(block) != 'slab', f'block {block} of {addr} is a slab block'
+                owners[block] = owners.get(block, 0) + 1
+
+    assert memory.refs == {block: count for block, count in owners.items() if count != 'slab' and count > 1}
+    assert memory.deduped == sum(memory.refs.values()) - len(memory.refs)
+    assert memory.space_used == sum(memory.allocations.values())
+
+    dead = list(memory.dead)
+    for snapshot in memory.snapshots.values():
+        dead.extend(snapshot.dead)
+    dead_slots = [unit for unit in dead if memory.is_slab(unit)]
+    dead_blocks = {unit >> Memory.OFFSET_BITS for unit in dead if not memory.is_slab(unit)}
+    assert not dead_blocks & owners.keys()
+
+    assert sum(bin(mask).count('1') for mask in memory.slabs.used.values()) == slots + len(dead_slots)
+    assert memory.free_space.free_count + len(owners) + len(dead_blocks) == memory.total_blocks
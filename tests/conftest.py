@@ -0,0 +1,88 @@
+import io
+import os
+import sys
+from datetime import datetime
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+import file_io
+import journal
+import paths
+from classes import DirectoryNode, FS_Node, Memory
+from inodes import InodeTable
+from pagecache import PagedMemory
+from menu import run_command
+from session import Session
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    # the image, journal and backing file keep their default relative names
+    monkeypatch.chdir(tmp_path)
+    yield tmp_path
+
+    if journal.wal:
+        journal.wal.close()
+    journal.wal = None
+    paths.unmount_all()
+    paths.dcache.invalidate()
+
+
+class Shell:
+    # a fresh filesystem and one session over it, commands as typed in the menu
+    def __init__(self, size: int, dedup: bool, paged: bool = False) -> None:
+        FS_Node.inodes = InodeTable()
+        self.root = DirectoryNode('/', datetime.now())
+        # a paged store keeps two pages in RAM, most writes evict something
+        self.memory = PagedMemory(size, cache_pages=2, dedup=dedup) if paged else Memory(size, dedup=dedup)
+        FS_Node.root, FS_Node.memory = self.root, self.memory
+        self.session = Session(self.root, io.StringIO())
+
+    def run(self, *commands: str):
+        for command in commands:
+            errors = self.session.errors
+            run_command(self.session, command)
+            assert self.session.errors == errors, self.session.outfile.getvalue()
+
+    def write(self, path: str, content: bytes):
+        if paths.resolve(path, self.root) is None:
+            self.run(f'touch {path}')
+        self.run(f'open {path} w', f'wf {path} {content.decode()}', f'close {path}')
+
+    def read(self, path: str, root: DirectoryNode = None, memory: Memory = None) -> bytes:
+        file = paths.resolve(path, root or self.root)
+        return bytes((memory or self.memory).read_file(file.starting_addr, 0, file.size)) if file.size else b''
+
+
+@pytest.fixture
+def shell():
+    return Shell(64 * 1024, dedup=False)
+
+
+@pytest.fixture
+def dedup_shell():
+    return Shell(64 * 1024, dedup=True)
+
+
+@pytest.fixture
+def paged_shell():
+    shell = Shell(64 * 1024, dedup=False, paged=True)
+    yield shell
+    shell.memory.discard()
+
+
+@pytest.fixture
+def journaled(shell):
+    # what main does for a new store: the image first, then the journal
+    file_io.save_to_file(structure=shell.root, memory=shell.memory)
+    journal.wal = journal.Journal()
+    return shell
+
+
+@pytest.fixture
+def paged_journaled(paged_shell):
+    file_io.save_to_file(structure=paged_shell.root, memory=paged_shell.memory)
+    journal.wal = journal.Journal()
+    return paged_shell
@@ -0,0 +1,29 @@
+import file_io
+from tests.checks import check_memory
+
+
+def test_checkpoint_after_restore(shell):
+    # as many inodes before and after, the image's inode section is stale anyway
+    shell.write('/a', b'a' * 100)
+    shell.run('mkdir /d1', 'touch /c', 'rm /c', 'snapshot create s', 'touch /d1/c', 'sync', 'snapshot restore s')
+
+    root, memory = file_io.load_from_file()
+    check_memory(memory)
+    assert root.get_child('c') is None
+    assert root.get_child('d1').get_child('c') is None
+    assert shell.read('/a', root, memory) == b'a' * 100
+
+
+def test_checkpoint_patches_changed_rows(shell):
+    shell.write('/a', b'a' * 100)
+    shell.write('/b', b'b' * 100)
+    shell.run('sync')
+
+    # same names, only the rows of /b change
+    shell.write('/b', b'B' * 300)
+    shell.run('sync')
+
+    root, memory = file_io.load_from_file()
+    check_memory(memory)
+    assert shell.read('/a', root, memory) == b'a' * 100
+    assert shell.read('/b', root, memory) == b'B' * 300
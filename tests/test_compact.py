@@ -0,0 +1,83 @@
+import pytest
+
+import constants
+import file_io
+from classes import Memory
+from tests.checks import check_memory
+
+
+def _fill(memory: Memory, count: int):
+    # every block holds its own number, so a copy is easy to trace
+    for block in range(count):
+        memory._store(block * constants.BLOCK_SIZE, bytes([block]) * constants.BLOCK_SIZE)
+
+
+def _block(memory: Memory, block: int) -> bytes:
+    return bytes(memory._load(block * constants.BLOCK_SIZE, constants.BLOCK_SIZE))
+
+
+@pytest.mark.parametrize('moves', [
+    # a chain: each destination is vacated by the move after it
+    {1: 0, 2: 1, 3: 2, 4: 3},
+    # runs sliding over themselves, the way compaction packs them
+    {5: 2, 6: 3, 7: 4, 8: 5, 9: 6},
+    # a cycle, and a two-block swap
+    {0: 1, 1: 2, 2: 0, 5: 6, 6: 5},
+    # a cycle next to a chain
+    {3: 4, 4: 5, 5: 3, 10: 11, 11: 12},
+])
+def test_move_blocks(moves):
+    memory = Memory(64 * constants.BLOCK_SIZE)
+    _fill(memory, 16)
+
+    expected = {block: _block(memory, block) for block in range(16)}
+    for old, new in moves.items():
+        expected[new] = bytes([old]) * constants.BLOCK_SIZE
+
+    memory._move_blocks(dict(moves))
+    for block, content in expected.items():
+        if block not in moves or block in moves.values():
+            assert _block(memory, block) == content, block
+
+
+@pytest.mark.parametrize('fixture', ['shell', 'dedup_shell'])
+def test_compact_fragmented(fixture, request):
+    shell = request.getfixturevalue(fixture)
+    contents = {}
+    for i in range(24):
+        # every third file repeats another's blocks, so dedup shares some
+        content = (f'{i % 8:02}' * 20 * (i % 5 + 1) if i % 3 == 0 else f'{i:02}' * 40 * (i % 4 + 1)).encode()
+        shell.write(f'/f{i}', content)
+        contents[f'/f{i}'] = content
+
+    # holes everywhere, and files grown past the neighbour after them
+    for i in range(1, 24, 3):
+        shell.run(f'rm /f{i}')
+        del contents[f'/f{i}']
+    for i in range(2, 23, 3):
+        shell.run(f'open /f{i} a', f'af /f{i} {"+" * 150}', f'close /f{i}')
+        contents[f'/f{i}'] += b'+' * 150
+
+    memory = shell.memory
+    assert any(len(runs) > 1 for runs in memory.extents.values())
+
+    report = file_io.compact(structure=shell.root, memory=memory)
+    check_memory(memory)
+    assert report['fragmentation_after'] == 0.0
+    assert all(len(runs) == 1 for runs in memory.extents.values()) or memory.refs
+    for path, content in contents.items():
+        assert shell.read(path) == content, path
+
+    # the checkpoint after it wrote the new addrs to the image
+    root, loaded = file_io.load_from_file()
+    check_memory(loaded)
+    for path, content in contents.items():
+        assert shell.read(path, root, loaded) == content, path
+
+
+def test_compact_refused_with_snapshots(shell):
+    shell.write('/a', b'a' * 200)
+    shell.run('snapshot create one')
+
+    with pytest.raises(ValueError):
+        file_io.compact(structure=shell.root, memory=shell.memory)
@@ -0,0 +1,80 @@
+import file_io
+from tests.checks import check_memory
+
+# four blocks unlike each other, the first of a file is never shared
+CONTENT = b'a' * 64 + b'b' * 64 + b'c' * 64 + b'd' * 64
+
+
+def _shared(shell, *paths: str):
+    # blocks all of the files use
+    blocks = [set(block for start, length in shell.memory.extents[shell.root.get_child(path[1:]).starting_addr]
+                  for block in range(start, start + length)) for path in paths]
+    return set.intersection(*blocks)
+
+
+def test_identical_files_share_blocks(dedup_shell):
+    dedup_shell.write('/a', CONTENT)
+    dedup_shell.write('/b', CONTENT)
+    memory = dedup_shell.memory
+
+    check_memory(memory)
+    assert len(_shared(dedup_shell, '/a', '/b')) == 3
+    assert memory.refs == {block: 2 for block in _shared(dedup_shell, '/a', '/b')}
+    assert memory.deduped == 3
+    assert memory.space_committed == memory.space_used - 3 * 64
+    assert dedup_shell.read('/b') == CONTENT
+
+
+def test_overwrite_unshares(dedup_shell):
+    dedup_shell.write('/a', CONTENT)
+    dedup_shell.write('/b', CONTENT)
+
+    dedup_shell.run('open /b w', 'wf /b ' + 'x' * 64 + 'b' * 64 + 'y' * 64 + 'z' * 64, 'close /b')
+    check_memory(dedup_shell.memory)
+    assert dedup_shell.memory.deduped == 1
+    assert dedup_shell.read('/a') == CONTENT
+
+    # a write into the middle copies the shared block first
+    dedup_shell.run('open /b w', 'mwf /b 0 10 70', 'close /b')
+    check_memory(dedup_shell.memory)
+    assert dedup_shell.memory.deduped == 0
+    assert dedup_shell.read('/a') == CONTENT
+    assert dedup_shell.read('/b') == b'x' * 64 + b'b' * 6 + b'x' * 10 + b'b' * 48 + b'y' * 64 + b'z' * 64
+
+
+def test_truncate_and_delete_drop_refs(dedup_shell):
+    free = dedup_shell.memory.free_space.free_count
+    dedup_shell.write('/a', CONTENT)
+    dedup_shell.write('/b', CONTENT)
+    dedup_shell.write('/c', CONTENT)
+    memory = dedup_shell.memory
+    assert memory.refs == {block: 3 for block in _shared(dedup_shell, '/a', '/b', '/c')}
+
+    dedup_shell.run('open /b w', 'trunc /b 128', 'close /b')
+    check_memory(memory)
+    # its second block is still shared, the two after it no longer by /b
+    assert memory.deduped == 2 + 1 + 1
+    assert dedup_shell.read('/b') == CONTENT[:128]
+
+    # the first file's blocks stay for the others
+    dedup_shell.run('rm /a')
+    check_memory(memory)
+    assert dedup_shell.read('/c') == CONTENT
+    assert dedup_shell.read('/b') == CONTENT[:128]
+
+    dedup_shell.run('rm /b', 'rm /c')
+    check_memory(memory)
+    assert not memory.refs and not memory.deduped
+    assert memory.free_space.free_count == free
+
+
+def test_index_survives_reload(dedup_shell):
+    dedup_shell.write('/a', CONTENT)
+    dedup_shell.write('/b', CONTENT)
+    dedup_shell.run('sync')
+
+    root, memory = file_io.load_from_file()
+    check_memory(memory)
+    assert memory.refs == dedup_shell.memory.refs
+    assert memory.index == dedup_shell.memory.index
+    assert dedup_shell.read('/b', root, memory) == CONTENT
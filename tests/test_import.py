@@ -0,0 +1,31 @@
+import constants
+import file_io
+import journal
+from menu import run_command
+from tests.checks import check_memory
+
+
+def test_import_that_runs_out_keeps_what_it_wrote(journaled, tmp_path, monkeypatch):
+    # far more than the 64 KB store, distinct chunks so a misplaced one shows
+    monkeypatch.setattr(constants, 'STREAM_CHUNK_SIZE', 4096)
+    host = tmp_path / 'host.bin'
+    chunks = [bytes([i]) * constants.STREAM_CHUNK_SIZE for i in range(24)]
+    host.write_bytes(b''.join(chunks))
+
+    journaled.run('touch /big', 'open /big w')
+    run_command(journaled.session, f'import {host} /big')
+    assert journaled.session.errors == 1
+
+    file = journaled.root.get_child('big')
+    assert 0 < file.size < len(chunks) * constants.STREAM_CHUNK_SIZE
+    assert file.size % constants.STREAM_CHUNK_SIZE == 0
+    assert journaled.session.outfile.getvalue().splitlines()[-1] == f'Not enough memory, {file.size} bytes imported!'
+    check_memory(journaled.memory)
+    live = journaled.read('/big')
+    assert live == b''.join(chunks)[:file.size]
+
+    # replay rebuilds the same file
+    journal.wal.sync()
+    root, memory = file_io.load_from_file()
+    check_memory(memory)
+    assert journaled.read('/big', root, memory) == live
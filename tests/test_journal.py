@@ -0,0 +1,143 @@
+import os
+import time
+
+import pytest
+
+import constants
+import file_io
+import journal
+from tests.checks import check_memory
+
+
+def test_replay_before_first_checkpoint(journaled):
+    # far more than the default store holds, replay needs the saved geometry
+    journaled.write('/big', b'x' * 3000)
+    journaled.run('mkdir /d')
+    journaled.write('/d/small', b'small')
+    journal.wal.sync()
+
+    root, memory = file_io.load_from_file()
+    check_memory(memory)
+    assert memory.total_size == 64 * 1024
+    assert journaled.read('/big', root, memory) == b'x' * 3000
+    assert journaled.read('/d/small', root, memory) == b'small'
+
+
+def test_replay_stops_at_torn_tail(journaled):
+    journaled.write('/a', b'a' * 100)
+    journaled.run('sync')
+    journaled.write('/b', b'b' * 100)
+    journaled.write('/c', b'c' * 100)
+    journal.wal.sync()
+
+    # the last record only half reached the disk
+    size = os.path.getsize(constants.JOURNAL_FILENAME)
+    os.truncate(constants.JOURNAL_FILENAME, size - 20)
+    records = list(journal.read_records())
+    assert records and records[-1][3] < size - 20
+
+    root, memory = file_io.load_from_file()
+    check_memory(memory)
+    assert journaled.read('/a', root, memory) == b'a' * 100
+    assert journaled.read('/b', root, memory) == b'b' * 100
+    # created, the write was torn
+    assert root.get_child('c').size == 0
+
+    # reopening drops the torn bytes, new records follow the last whole one
+    journal.wal.close()
+    journal.wal = journal.Journal()
+    assert journal.wal.seq == records[-1][0]
+    assert os.path.getsize(constants.JOURNAL_FILENAME) == records[-1][3]
+
+
+def test_replay_failure_is_reported(journaled):
+    journaled.write('/big', b'x' * 3000)
+    journal.wal.sync()
+
+    # a journal without its image replays into the default store, too small
+    os.remove(constants.FILENAME)
+    with pytest.raises(ValueError, match='could not be replayed'):
+        file_io.load_from_file()
+
+
+def test_idle_records_are_synced(tmp_path):
+    wal = journal.Journal(str(tmp_path / 'idle.journal'), fsync_interval=0.05)
+    try:
+        wal.sync()
+        wal.append(journal.OP_REMOVE, '/a')
+        wal.commit()
+        assert wal.unsynced
+
+        # nothing else commits, the timer syncs it
+        time.sleep(0.2)
+        assert not wal.unsynced and wal.flusher is None
+    finally:
+        wal.close()
+
+
+def test_move_replays_after_eviction(paged_journaled):
+    paged_journaled.write('/a', b'0123456789')
+    paged_journaled.run('sync')
+    paged_journaled.run('open /a w', 'mwf /a 0 4 2', 'close /a')
+    assert paged_journaled.read('/a') == b'0101236789'
+
+    # enough other pages that the moved one is evicted before any checkpoint
+    for i in range(4):
+        paged_journaled.write(f'/f{i}', bytes([48 + i]) * 5000)
+    journal.wal.sync()
+
+    root, memory = file_io.load_from_file()
+    try:
+        check_memory(memory)
+        assert paged_journaled.read('/a', root, memory) == b'0101236789'
+        assert paged_journaled.read('/f3', root, memory) == b'3' * 5000
+    finally:
+        memory.discard()
+
+
+def _crash_checkpoint(monkeypatch, shell, applied: int):
+    # the process dies after the redo file and the first applied writes
+    def apply(filename, backing_filename, writes, length):
+        apply_writes(filename, backing_filename, writes[:applied], -1)
+        raise OSError('crashed')
+
+    apply_writes = file_io._apply_writes
+    monkeypatch.setattr(file_io, '_apply_writes', apply)
+    with pytest.raises(OSError):
+        file_io.checkpoint(structure=shell.root, memory=shell.memory)
+    monkeypatch.setattr(file_io, '_apply_writes', apply_writes)
+
+
+@pytest.mark.parametrize('fixture', ['journaled', 'paged_journaled'])
+def test_torn_checkpoint_is_finished(fixture, request, monkeypatch):
+    shell = request.getfixturevalue(fixture)
+    shell.write('/a', b'a' * 5000)
+    shell.run('sync')
+    shell.write('/a', b'b' * 300)
+    shell.write('/c', b'c' * 5000)
+
+    _crash_checkpoint(monkeypatch, shell, 1)
+    assert os.path.exists(constants.FILENAME + file_io.REDO_SUFFIX)
+
+    root, memory = file_io.load_from_file()
+    check_memory(memory)
+    assert not os.path.exists(constants.FILENAME + file_io.REDO_SUFFIX)
+    assert shell.read('/a', root, memory) == b'b' * 300
+    assert shell.read('/c', root, memory) == b'c' * 5000
+
+
+def test_unfinished_redo_is_dropped(journaled, monkeypatch):
+    journaled.write('/a', b'a' * 5000)
+    journaled.run('sync')
+    journaled.write('/a', b'b' * 300)
+
+    _crash_checkpoint(monkeypatch, journaled, 0)
+    # the redo file itself was torn, the image is the last checkpoint's
+    redo = constants.FILENAME + file_io.REDO_SUFFIX
+    os.truncate(redo, os.path.getsize(redo) - 10)
+
+    root, memory = file_io.load_from_file()
+    check_memory(memory)
+    assert not os.path.exists(redo)
+    # and the journal brings the rest
+    assert journaled.read('/a', root, memory) == b'b' * 300
@@ -0,0 +1,45 @@
+from menu import run_command
+from tests.checks import check_memory
+
+
+def _fails(shell, command: str, message: str):
+    errors = shell.session.errors
+    run_command(shell.session, command)
+    assert shell.session.errors == errors + 1
+    assert shell.session.outfile.getvalue().splitlines()[-1] == message
+
+
+def test_file_replaces_file(shell):
+    shell.write('/a', b'a' * 300)
+    shell.write('/b', b'b' * 500)
+
+    shell.run('mv /a /b')
+    check_memory(shell.memory)
+    assert shell.root.get_child('a') is None
+    assert shell.read('/b') == b'a' * 300
+
+
+def test_directory_is_never_replaced(shell):
+    shell.run('mkdir /d', 'mkdir /d/a', 'mkdir /d/f', 'mkdir /a')
+    shell.write('/d/a/inner', b'i' * 100)
+    shell.write('/f', b'f' * 10)
+
+    # into /d, where a directory of the same name already is
+    _fails(shell, 'mv /a /d', 'A directory with that name already exists!')
+    _fails(shell, 'mv /f /d', 'A directory with that name already exists!')
+
+    check_memory(shell.memory)
+    assert shell.read('/d/a/inner') == b'i' * 100
+    assert shell.root.get_child('a').parent is shell.root
+    assert shell.read('/f') == b'f' * 10
+
+
+def test_directory_does_not_replace_file(shell):
+    shell.run('mkdir /d')
+    shell.write('/d/inner', b'i' * 100)
+    shell.write('/g', b'g' * 10)
+
+    _fails(shell, 'mv /d /g', 'Cannot replace a file with a directory!')
+    check_memory(shell.memory)
+    assert shell.read('/g') == b'g' * 10
+    assert shell.read('/d/inner') == b'i' * 100
@@ -0,0 +1,63 @@
+import io
+
+import paths
+import stats
+from classes import Memory
+from menu import run_script
+
+
+def test_plain_and_quoted_lines(shell):
+    out = io.StringIO()
+    errors = run_script([
+        'mkdir /d',
+        'touch /d/a',
+        '  open /d/a w  ',
+        "wf /d/a it's  spaced",
+        'close /d/a',
+        'touch "/d/b c"',
+        'open "/d/b c" w',
+        'wf "/d/b c" "quoted"',
+        'close "/d/b c"',
+        'exit',
+        'touch /d/never',
+    ], out)
+
+    assert errors == 0, out.getvalue()
+    assert shell.read('/d/a') == b"it's  spaced"
+    assert shell.read('/d/b c') == b'quoted'
+    # lines after exit are not run
+    assert paths.resolve('/d/never', shell.root) is None
+
+
+def test_created_paths_are_cached(shell):
+    run_script(['mkdir /d', 'touch /d/a'], io.StringIO())
+    hits = paths.dcache.hits
+    assert paths.resolve('/d/a', shell.root) is shell.root.get_child('d').get_child('a')
+    assert paths.dcache.hits == hits + 1
+
+
+def test_handles_follow_open_and_close(shell):
+    shell.write('/a', b'a')
+    file = paths.resolve('/a', shell.root)
+    session = shell.session
+    first, second = session.open(file, 'r'), session.open(file, 'w')
+    assert session.handles(file) == [first, second]
+
+    session.close(first)
+    assert session.handles(file) == [second]
+    # the freed fd is handed out again
+    assert session.open(file, 'a') == first
+    assert session.handles(file) == [second, first]
+
+    session.close_all()
+    assert session.handles(file) == []
+
+
+def test_probes_only_while_enabled():
+    allocate = Memory.allocate
+    stats.enable()
+    try:
+        assert Memory.allocate is not allocate
+    finally:
+        stats.disable()
+    assert Memory.allocate is allocate
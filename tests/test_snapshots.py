@@ -0,0 +1,146 @@
+import io
+
+import file_io
+import paths
+from classes import DirectoryNode
+from session import Session
+from tests.checks import check_memory
+
+
+def _snapshot_read(shell, name: str, path: str) -> bytes:
+    root = file_io.open_snapshot(name, shell.memory)
+    file = root.get_child(path.lstrip('/'))
+    # a mounted snapshot's files read through its view of the store
+    return bytes(file.store.read_file(file.starting_addr, 0, file.size))
+
+
+def _tree(shell, root=None, memory=None) -> dict:
+    # path -> None for a directory, its content for a file
+    root = root or shell.root
+    tree = {}
+
+    def walk(directory, path):
+        for child in directory.children:
+            child_path = f'{path}/{child.name}'
+            if isinstance(child, DirectoryNode):
+                tree[child_path] = None
+                walk(child, child_path)
+            else:
+                tree[child_path] = shell.read(child_path, root, memory)
+
+    walk(root, '')
+    return tree
+
+
+def test_snapshot_overwrite_revert(shell):
+    shell.write('/a', b'a' * 300)
+    shell.write('/b', b'b' * 150)
+    shell.write('/small', b's' * 10)
+    shell.run('snapshot create one')
+
+    shell.write('/a', b'A' * 500)
+    shell.run('open /b a', f'af /b {"B" * 100}', 'close /b', 'rm /small')
+    shell.write('/c', b'c' * 200)
+    check_memory(shell.memory)
+
+    # the live tree changed, the snapshot still reads what it froze
+    assert shell.read('/a') == b'A' * 500
+    assert _snapshot_read(shell, 'one', '/a') == b'a' * 300
+    assert _snapshot_read(shell, 'one', '/b') == b'b' * 150
+    assert _snapshot_read(shell, 'one', '/small') == b's' * 10
+
+    shell.run('snapshot restore one')
+    check_memory(shell.memory)
+    assert shell.read('/a') == b'a' * 300
+    assert shell.read('/b') == b'b' * 150
+    assert shell.read('/small') == b's' * 10
+    assert shell.root.get_child('c') is None
+
+    # the restored tree is the image's too
+    root, memory = file_io.load_from_file()
+    check_memory(memory)
+    assert shell.read('/a', root, memory) == b'a' * 300
+    assert root.get_child('c') is None
+
+
+def test_drop_frees_what_only_the_snapshot_used(shell):
+    shell.write('/a', b'a' * 640)
+    free = shell.memory.free_space.free_count
+    shell.run('snapshot create one')
+
+    shell.write('/a', b'A' * 640)
+    # the old blocks are kept for the snapshot, the new ones are extra
+    assert shell.memory.free_space.free_count < free
+    check_memory(shell.memory)
+
+    freed = file_io.delete_snapshot('one', structure=shell.root, memory=shell.memory)
+    assert freed == 640
+    assert shell.memory.free_space.free_count == free
+    assert shell.read('/a') == b'A' * 640
+    check_memory(shell.memory)
+
+
+def test_births_only_while_snapshots_exist(shell):
+    shell.write('/a', b'a' * 200)
+    assert shell.memory.births is None
+
+    shell.run('snapshot create one', 'snapshot create two')
+    assert shell.memory.births is not None
+
+    shell.run('snapshot delete one')
+    assert shell.memory.births is not None
+    shell.run('snapshot delete two')
+    assert shell.memory.births is None and not shell.memory.slot_births
+
+
+def test_snapshots_survive_reload(shell):
+    shell.write('/a', b'a' * 300)
+    shell.run('snapshot create one')
+    shell.write('/a', b'b' * 300)
+    shell.run('snapshot create two')
+    shell.run('rm /a', 'sync')
+
+    root, memory = file_io.load_from_file()
+    check_memory(memory)
+    assert list(memory.snapshots) == ['one', 'two']
+    assert root.get_child('a') is None
+    shell.memory = memory
+    assert _snapshot_read(shell, 'one', '/a') == b'a' * 300
+    assert _snapshot_read(shell, 'two', '/a') == b'b' * 300
+
+
+def test_restore_survives_reload(shell):
+    shell.run('mkdir /d', 'mkdir /d/e')
+    shell.write('/d/a', b'a' * 300)
+    shell.write('/d/e/b', b'b' * 50)
+    shell.run('touch /empty')
+    shell.run('snapshot create one')
+    frozen = _tree(shell)
+
+    shell.write('/d/a', b'A' * 700)
+    shell.run('rm /d/e', 'rm /empty', 'mkdir /new')
+    shell.write('/new/c', b'c' * 100)
+    shell.run('sync', 'snapshot restore one')
+    assert _tree(shell) == frozen
+
+    root, memory = file_io.load_from_file()
+    check_memory(memory)
+    assert _tree(shell, root, memory) == frozen
+
+
+def test_restore_moves_every_session(shell):
+    shell.run('mkdir /d', 'mkdir /d/e')
+    shell.write('/d/a', b'a' * 100)
+    shell.run('snapshot create one')
+    shell.run('mkdir /gone')
+
+    # another client, somewhere in the tree with a file open
+    other = Session(paths.resolve('/d/e', shell.root), io.StringIO())
+    other.open(paths.resolve('/d/a', shell.root), 'r')
+    third = Session(paths.resolve('/gone', shell.root), io.StringIO())
+
+    shell.run('snapshot restore one')
+    assert not other.fds and other.handles(paths.resolve('/d/a', shell.root)) == []
+    assert other.cwd is paths.resolve('/d/e', shell.root) and other.cwd.ino is not None
+    # its directory is not in the snapshot
+    assert third.cwd is shell.root